@@ -1,50 +1,126 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session
-from werkzeug.security import generate_password_hash
 from flask_cors import CORS
 from dotenv import load_dotenv
+import logging
 import os
+import threading
+from bson.errors import InvalidId
 from datetime import datetime
-from bson.objectid import ObjectId
 import jwt
-from backend.itinerary import generate_invite_code
-
-load_dotenv()
-
-app = Flask(__name__)
-CORS(app)
-
-app.config["MONGO_URI"] = os.getenv("MONGO_URI")
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
-
-from backend.models import mongo
-
-mongo.init_app(app)
-
 from backend.auth import auth_bp, token_required
 from backend.chat import chat_bp
 from backend.itinerary import itinerary_bp
 from backend.budget import budget_bp
+from backend.events import events_bp
+from backend.metrics import metrics_bp
+from backend.places import places_bp
+from backend.gazetteer import gazetteer_bp
+from backend.repositories import budgets, itinerary_items, trips, users
+from backend.schedule import conflicting_ids, coordinates, items_query, serialize_item
+from backend.indexes import IndexBuildError, ensure_indexes
+from backend.commands import commands
+from backend import events, gazetteer, places, profiling, repositories, revisions, telemetry
+from backend.profiling import profiled
+from backend.telemetry import log_event
+from backend.revisions import conditional
 from jwt.exceptions import ExpiredSignatureError
-
-app.register_blueprint(auth_bp, url_prefix="/auth")
-app.register_blueprint(chat_bp, url_prefix="/chat")
-app.register_blueprint(itinerary_bp, url_prefix="/itinerary")
-app.register_blueprint(budget_bp, url_prefix="/budget")
-
-
-@app.route("/")
+from pymongo.errors import PyMongoError
+
+# Routes are collected here and attached by create_app(), so importing this
+# module does no I/O. `flask run` and the CLI find create_app() on their own.
+ROUTES = []
+
+# The trip page previews the start of the itinerary, the rest is paged by day
+TRIP_PAGE_ITEMS = 10
+TRIP_PAGE_PROJECTION = {"trip_name": 1, "users": 1, "invite_code": 1}
+NEARBY_RADIUS = 1000
+MAX_NEARBY_RADIUS = 50000
+NEARBY_RESULTS = 10
+MAX_NEARBY_RESULTS = 100
+
+
+def route(rule, **options):
+    def decorator(f):
+        ROUTES.append((rule, f, options))
+        return f
+
+    return decorator
+
+
+def create_app(config=None):
+    load_dotenv()
+
+    app = Flask(__name__)
+    CORS(app)
+
+    app.config["MONGO_URI"] = os.getenv("MONGO_URI")
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+    app.config["ENSURE_INDEXES"] = os.getenv("ENSURE_INDEXES", "1") == "1"
+    if config:
+        app.config.update(config)
+
+    # Connects flask_pymongo unless DATA_BACKEND=memory
+    repositories.init_app(app)
+    telemetry.init_app(app)
+    profiling.init_app(app)
+    revisions.init_app(app)
+    events.init_app(app)
+    places.init_app(app)
+    gazetteer.init_app(app)
+
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(chat_bp, url_prefix="/chat")
+    app.register_blueprint(itinerary_bp, url_prefix="/itinerary")
+    app.register_blueprint(budget_bp, url_prefix="/budget")
+    app.register_blueprint(events_bp, url_prefix="/events")
+    app.register_blueprint(places_bp, url_prefix="/places")
+    app.register_blueprint(gazetteer_bp, url_prefix="/gazetteer")
+    app.register_blueprint(metrics_bp)
+
+    for rule, view_func, options in ROUTES:
+        app.add_url_rule(rule, view_func=view_func, **options)
+
+    for command in commands:
+        app.cli.add_command(command)
+
+    if app.config["ENSURE_INDEXES"]:
+        _ensure_indexes_on_first_request(app)
+
+    return app
+
+
+def _ensure_indexes_on_first_request(app):
+    # Runs once per process, on the first request rather than at import
+    lock = threading.Lock()
+    state = {"done": False}
+
+    @app.before_request
+    def ensure_indexes_once():
+        if state["done"]:
+            return
+        with lock:
+            if state["done"]:
+                return
+            # One try per process: a refused index (say, duplicates under a
+            # new unique index) must not fail every request. Fix the data and
+            # run `flask ensure-indexes`.
+            try:
+                ensure_indexes()
+            except (IndexBuildError, PyMongoError) as e:
+                log_event("indexes.failed", level=logging.ERROR, sample_rate=1, error=str(e))
+            finally:
+                state["done"] = True
+
+
+@route("/")
 def welcome():
-    print("Welcome route accessed")  # Debugging print statement
     token = request.cookies.get("x-access-token")
     if token:
         try:
-            print("User already logged in")
             data = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=["HS256"])
             username = data["username"]
-            print(f"Token username: {username}")  # Debugging print statement
             return redirect(url_for("mainpage", username=username))
         except ExpiredSignatureError:
-            print("Token has expired")  # Debugging print statement
             return redirect(
                 url_for("auth.login")
             )  # Redirect to login page or handle accordingly
@@ -54,39 +130,39 @@ def welcome():
     )
 
 
-@app.route("/admit")
+@route("/admit")
 def admit():
     return render_template(
         "admit.html", google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY")
     )
 
 
-@app.route("/signup")
+@route("/signup")
 def signup():
     return render_template(
         "signup.html", google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY")
     )
 
 
-@app.route("/main")
+@route("/main")
 def main():
-    print("Main route accessed")  # Debugging print statement
     return render_template(
         "mainpage.html", google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY")
     )
 
 
-@app.route("/trip")
+@route("/trip")
 def trip(username, trip_name):
     return render_template(
         "trip.html", google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY")
     )
 
 
-@app.route("/trip/<trip_id>/chat")
+@route("/trip/<trip_id>/chat")
 @token_required
+@conditional
 def trip_chat(current_user, trip_id):
-    trip = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
+    trip = trips.get(trip_id, {"trip_name": 1})
     if not trip:
         return jsonify({"error": "Trip not found"}), 404
     return render_template(
@@ -97,336 +173,142 @@ def trip_chat(current_user, trip_id):
     )
 
 
-@app.route("/trip/<trip_id>/budget")
+@route("/trip/<trip_id>/budget")
 @token_required
+@conditional
 def budget(current_user, trip_id):
-    trip = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
-    user_ids = trip["users"]
-    user_budgets = []
-    for budget in trip["budget"]:
-        user = mongo.db.users.find_one({"_id": budget["user_id"]})
-        if user:
-            user_budget = {"username": user["username"], "budget": budget}
-            user_budgets.append(user_budget)
+    # Rows, per-category totals and averages come from one aggregate; a trip
+    # whose members have no budget rows gets an empty summary
+    summary = budgets.summary(trip_id)
+    if summary is None:
+        return jsonify({"error": "Trip not found"}), 404
+    trip = {"_id": summary["_id"], "trip_name": summary["trip_name"]}
 
     return render_template(
         "budget.html",
         trip=trip,
-        user_budgets=user_budgets,
+        summary=summary,
         user=current_user,
         google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY"),
     )
 
 
-@app.route("/trip/<trip_id>/itinerary")
+@route("/trip/<trip_id>/itinerary")
 @token_required
+@conditional
 def itinerary(current_user, trip_id):
-    trip = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
+    trip = trips.get(trip_id, {"trip_name": 1})
     if not trip:
         return jsonify({"error": "Trip not found"}), 404
+    # One day at a time; the day list comes from the index alone
+    days = itinerary_items.days(trip_id)
+    day = request.args.get("day")
+    if day not in days:
+        day = days[0] if days else None
+    items = itinerary_items.on_day(trip_id, day) if day else []
     return render_template(
         "itinerary.html",
         trip=trip,
+        days=days,
+        day=day,
+        items=items,
+        conflicts=conflicting_ids(items),
         user=current_user,
         google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY"),
     )
 
 
-@app.route("/mainpage/<username>")
+@route("/trip/<trip_id>/nearby")
+@token_required
+def nearby(current_user, trip_id):
+    # Around ?item=<id>, ?lat=&lng=, or by default the next stop with a known
+    # place; ?radius= in metres, ?k= results per kind
+    try:
+        radius = min(float(request.args.get("radius", NEARBY_RADIUS)), MAX_NEARBY_RADIUS)
+        k = max(1, min(int(request.args.get("k", NEARBY_RESULTS)), MAX_NEARBY_RESULTS))
+        item_id = request.args.get("item")
+        center_item = None
+        if item_id:
+            center_item = itinerary_items.get(trip_id, item_id)
+            if not center_item or not coordinates(center_item):
+                return jsonify({"error": "Item has no known location"}), 404
+            lat, lng = coordinates(center_item)
+        elif "lat" in request.args and "lng" in request.args:
+            lat, lng = float(request.args["lat"]), float(request.args["lng"])
+        else:
+            center_item = itinerary_items.next_placed(trip_id, datetime.utcnow())
+            if not center_item:
+                return jsonify({"error": "No upcoming stop with a known location"}), 404
+            lat, lng = coordinates(center_item)
+    except (InvalidId, ValueError):
+        return jsonify({"error": "Invalid query"}), 400
+
+    items = itinerary_items.nearby(
+        trip_id, lat, lng, radius, k, exclude=center_item["_id"] if center_item else None
+    )
+    found_places = places.client.nearby(lat, lng, radius, k)
+    return (
+        jsonify(
+            {
+                "center": {"latitude": lat, "longitude": lng},
+                "item": serialize_item(center_item) if center_item else None,
+                "items": [
+                    dict(serialize_item(item), distance_m=round(item["distance_m"], 1))
+                    for item in items
+                ],
+                "places": [
+                    dict(place, distance_m=round(distance, 1))
+                    for distance, place in found_places
+                ],
+            }
+        ),
+        200,
+    )
+
+
+@route("/mainpage/<username>")
+@profiled
 @token_required
 def mainpage(current_user, username):
-    print(f"Mainpage route accessed for user: {username}")  # Debugging print statement
-    user = mongo.db.users.find_one({"username": username})
+    user = users.principal(username)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    for trip in user["profile"]["past_trips"]:
-        user_names = []
-        for user_id in trip["users"]:
-            trip_user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-            if trip_user:
-                user_names.append(trip_user["username"])
-        trip["user_names"] = user_names
+    past_trips = trips.for_user(user)
+    # Resolve the members of every trip in one query
+    members = users.load_many(
+        user_id for trip in past_trips for user_id in trip["users"]
+    )
+    for trip in past_trips:
+        trip["user_names"] = users.usernames(trip["users"], members)
 
     return render_template(
         "mainpage.html",
         user=user,
-        trip=user["profile"]["past_trips"],
+        trips=past_trips,
         google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY"),
     )
 
 
-@app.route("/trip/<trip_id>")
+@route("/trip/<trip_id>")
+@profiled
 @token_required
+@conditional
 def trip_detail(current_user, trip_id):
-    print(
-        f"Trip detail route accessed for trip_id: {trip_id}"
-    )  # Debugging print statement
-    trip = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
+    trip = trips.get(trip_id, TRIP_PAGE_PROJECTION)
     if not trip:
         return jsonify({"error": "Trip not found"}), 404
-    users = []
-    for user_id in trip["users"]:
-        user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-        if user:
-            users.append(user["username"])
-    trip["user_names"] = users
+    trip["user_names"] = users.usernames(trip["users"])
+    items, _ = itinerary_items.page(items_query(trip_id), TRIP_PAGE_ITEMS)
 
     return render_template(
         "trip.html",
         trip=trip,
+        items=items,
         user=current_user,
-        rapidapi_key=os.getenv("RAPIDAPI_KEY"),
         google_maps_api_key=os.getenv("GOOGLEMAPS_API_KEY"),
     )
 
 
-def initialize_database():
-    test_users = [
-        {
-            "username": "testuser1",
-            "password": "testpassword1",
-            "email": "testuser1@example.com",
-        },
-        {
-            "username": "testuser2",
-            "password": "testpassword2",
-            "email": "testuser2@example.com",
-        },
-    ]
-
-    user_ids = []
-    for user in test_users:
-        existing_user = mongo.db.users.find_one({"username": user["username"]})
-        if not existing_user:
-            hashed_password = generate_password_hash(user["password"])
-            user_id = mongo.db.users.insert_one(
-                {
-                    "username": user["username"],
-                    "password": hashed_password,
-                    "email": user["email"],
-                    "profile": {
-                        "name": f"Test User {user['username'][-1]}",
-                        "past_trips": [],
-                    },
-                }
-            ).inserted_id
-            user_ids.append(user_id)
-            print(f"Test user {user['username']} created with user_id: {user_id}")
-        else:
-            user_ids.append(existing_user["_id"])
-
-    # check if the itinerary already exists
-    existing_itinerary = mongo.db.itineraries.find_one({"trip_name": "Test Trip"})
-    if not existing_itinerary:
-        # create a dummy chatroom in the chatrooms collection
-        chatroom_id = mongo.db.chatrooms.insert_one(
-            {
-                "chat_logs": [
-                    {
-                        "user_id": user_ids[0],
-                        "username": "testuser1",
-                        "message": "Looking forward to the trip!",
-                        "timestamp": datetime.utcnow().strftime("%H:%M"),
-                    },
-                    {
-                        "user_id": user_ids[1],
-                        "username": "testuser2",
-                        "message": "Don't forget to pack comfortable shoes.",
-                        "timestamp": datetime.utcnow().strftime("%H:%M"),
-                    },
-                ],
-            }
-        ).inserted_id
-
-        # create a dummy itinerary in the itineraries collection
-        itinerary_id = mongo.db.itineraries.insert_one(
-            {
-                "trip_name": "Test Trip",
-                "users": user_ids,
-                "chatroom_id": chatroom_id,
-                "itinerary": [
-                    {
-                        "activity": "Visit Eiffel Tower",
-                        "location": "Paris",
-                        "time": datetime(2022, 7, 15, 10, 0).isoformat(),
-                        "notes": "Buy tickets online",
-                    },
-                    {
-                        "activity": "Lunch at Le Jules Verne",
-                        "location": "Paris",
-                        "time": datetime(2022, 7, 15, 13, 0).isoformat(),
-                        "notes": "Reservation at 1 PM",
-                    },
-                ],
-                "budget": [
-                    {
-                        "user_id": user_ids[0],
-                        "flight": 300,
-                        "hotel": 400,
-                        "food": 200,
-                        "transport": 150,
-                        "activities": 200,
-                        "spending": 100,
-                    },
-                    {
-                        "user_id": user_ids[1],
-                        "flight": 200,
-                        "hotel": 300,
-                        "food": 100,
-                        "transport": 50,
-                        "activities": 100,
-                        "spending": 80,
-                    },
-                ],
-                "invite_code": generate_invite_code(),
-            }
-        ).inserted_id
-
-        itinerary = mongo.db.itineraries.find_one({"_id": ObjectId(itinerary_id)})
-
-        # add the itinerary to each user's past trips
-        for user_id in user_ids:
-            mongo.db.users.update_one(
-                {"_id": ObjectId(user_id)}, {"$push": {"profile.past_trips": itinerary}}
-            )
-
-        print(
-            f"Dummy itinerary added to past trips for both test users with itinerary_id: {itinerary_id}"
-        )
-    else:
-        # chatroom_id = existing_itinerary["chatroom_id"]
-        print("Dummy itinerary already exists with chatroom_id")
-
-
-# def initialize_database():
-#     test_users = [
-#         {
-#             "username": "testuser1",
-#             "password": "testpassword1",
-#             "email": "testuser1@example.com",
-#         },
-#         {
-#             "username": "testuser2",
-#             "password": "testpassword2",
-#             "email": "testuser2@example.com",
-#         },
-#     ]
-
-#     user_ids = []
-#     for user in test_users:
-#         existing_user = mongo.db.users.find_one({"username": user["username"]})
-#         if not existing_user:
-#             hashed_password = generate_password_hash(user["password"])
-#             user_id = mongo.db.users.insert_one(
-#                 {
-#                     "username": user["username"],
-#                     "password": hashed_password,
-#                     "email": user["email"],
-#                     "profile": {
-#                         "name": f"Test User {user['username'][-1]}",
-#                         "past_trips": [],
-#                     },
-#                 }
-#             ).inserted_id
-#             user_ids.append(user_id)
-#             print(f"Test user {user['username']} created with user_id: {user_id}")
-#         else:
-#             user_ids.append(existing_user["_id"])
-
-#     # check if the itinerary already exists
-#     existing_itinerary = mongo.db.itineraries.find_one({"trip_name": "Test Trip"})
-#     if not existing_itinerary:
-#         # create a dummy chatroom in the chatrooms collection
-#         chatroom_id = mongo.db.chatrooms.insert_one(
-#             {
-#             "chat_logs": [
-#                 {
-#                 "user_id": user_ids[0],
-#                 "username": "testuser1",
-#                 "message": "Looking forward to the trip!",
-#                 "timestamp": datetime.utcnow().strftime("%H:%M"),
-#                 },
-#                 {
-#                 "user_id": user_ids[1],
-#                 "username": "testuser2",
-#                 "message": "Don't forget to pack comfortable shoes.",
-#                 "timestamp": datetime.utcnow().strftime("%H:%M"),
-#                 },
-#             ],
-#             }
-#         ).inserted_id
-
-#         # create a dummy itinerary in the itineraries collection
-#         itinerary_id = mongo.db.itineraries.insert_one(
-#             {
-#                 "trip_name": "Test Trip",
-#                 "users": user_ids,
-#                 "chatroom_id": chatroom_id,
-#                 "itinerary": [
-#                     {
-#                         "activity": "Visit Eiffel Tower",
-#                         "location": "Paris",
-#                         "time": datetime(2022, 7, 15, 10, 0).isoformat(),
-#                         "notes": "Buy tickets online",
-#                     },
-#                     {
-#                         "activity": "Lunch at Le Jules Verne",
-#                         "location": "Paris",
-#                         "time": datetime(2022, 7, 15, 13, 0).isoformat(),
-#                         "notes": "Reservation at 1 PM",
-#                     },
-
-#                 ],
-#                 "budget" :  [
-#                     {
-#                     "user_id": user_ids[0],
-#                     "flight": 300,
-#                     "hotel": 400,
-#                     "food": 200,
-#                     "transport": 150,
-#                     "activities": 200,
-#                     "spending": 100,
-#                     },
-#                     {
-#                     "user_id": user_ids[1],
-#                     "flight": 200,
-#                     "hotel": 300,
-#                     "food": 100,
-#                     "transport": 50,
-#                     "activities": 100,
-#                     "spending": 80,
-#                     },
-#                 ],
-#             }
-#         ).inserted_id
-
-#         itinerary = mongo.db.itineraries.find_one({"_id": ObjectId(itinerary_id)})
-
-#         # add the itinerary to each user's past trips
-#         for user_id in user_ids:
-#             mongo.db.users.update_one(
-#                 {"_id": ObjectId(user_id)}, {"$push": {"profile.past_trips": itinerary}}
-#             )
-
-#         print(
-#             f"Dummy itinerary added to past trips for both test users with itinerary_id: {itinerary_id}"
-#         )
-#     else:
-#         if "chatroom_id" not in existing_itinerary:
-#             chatroom_id = mongo.db.chatrooms.insert_one({"chat_logs": []}).inserted_id
-#             mongo.db.itineraries.update_one(
-#                 {"_id": existing_itinerary["_id"]},
-#                 {"$set": {"chatroom_id": chatroom_id}},
-#             )
-#             print(
-#                 f"Chatroom added to existing itinerary with id: {existing_itinerary['_id']}"
-#             )
-#         else:
-#             print("Dummy itinerary already exists with chatroom_id")
-
-
-initialize_database()
-
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from werkzeug.security import generate_password_hash, check_password_hash
-from backend.models import mongo
+from backend.repositories import users
 import jwt
 import datetime
 from functools import wraps
@@ -8,7 +8,6 @@ import os
 
 auth_bp = Blueprint("auth", __name__)
 
-
 @auth_bp.route("/admit", methods=["GET"])
 def templ():
     return render_template("admit.html")
@@ -22,7 +21,7 @@ def token_required(f):
             return jsonify({"error": "Token is missing"}), 401
         try:
             data = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=["HS256"])
-            current_user = mongo.db.users.find_one({"username": data["username"]})
+            current_user = users.principal(data["username"])
         except Exception as e:
             return jsonify({"error": "Token is invalid"}), 401
         return f(current_user, *args, **kwargs)
@@ -40,7 +39,7 @@ def register():
             flash("Invalid Input", "warning")
             return render_template("signup.html")
 
-        if mongo.db.users.find_one({"username": username}):
+        if users.exists(username):
             flash("User already exists", "warning")
             return render_template("signup.html")
 
@@ -49,14 +48,7 @@ def register():
             return render_template("signup.html")
 
         hashed_password = generate_password_hash(password)
-        user_id = mongo.db.users.insert_one(
-            {
-                "username": username,
-                "password": hashed_password,
-                "email": email,
-                "profile": {"name": "", "past_trips": []},
-            }
-        ).inserted_id
+        users.create(username, hashed_password, email)
 
         # Generate token for the new user
         token = jwt.encode(
@@ -106,7 +98,7 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
 
-        user = mongo.db.users.find_one({"username": username})
+        user = users.credentials(username)
         if user and check_password_hash(user["password"], password):
             token = jwt.encode(
                 {
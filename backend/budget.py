@@ -1,31 +1,243 @@
-from flask import Blueprint, request, jsonify, redirect, url_for
-from backend.models import mongo
+from flask import Blueprint, Response, request, jsonify, redirect, url_for, stream_with_context
 from backend.auth import token_required
+from backend.events import publish
+from backend.ledger import (
+    DEFAULT_PAGE_SIZE,
+    INSERT_CHUNK,
+    MAX_PAGE_SIZE,
+    InvalidExpense,
+    build_expense,
+    expense_query,
+    export_csv,
+    export_jsonl,
+    iter_ndjson,
+    serialize_expense,
+)
+from backend.memberships import BUDGET_FIELDS
+from backend.repositories import budgets, trips, users
 from bson import ObjectId
+from bson.errors import InvalidId
 
 
 budget_bp = Blueprint("budget", __name__)
 
+MAX_BATCH_TRIPS = 100
+
+
+def serialize_summary(summary):
+    summary = dict(summary, _id=str(summary["_id"]))
+    summary["members"] = [
+        dict(member, user_id=str(member["user_id"])) for member in summary["members"]
+    ]
+    return summary
+
+
+@budget_bp.route("/<trip_id>/summary", methods=["GET"])
+@token_required
+def get_summary(current_user, trip_id):
+    try:
+        summary = budgets.summary(trip_id)
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    if summary is None:
+        return jsonify({"error": "Trip not found"}), 404
+    return jsonify(serialize_summary(summary)), 200
+
+
+@budget_bp.route("/summary", methods=["GET"])
+@token_required
+def get_summaries(current_user):
+    # ?trip_id=a&trip_id=b or ?trip_id=a,b
+    trip_ids = [
+        trip_id
+        for value in request.args.getlist("trip_id")
+        for trip_id in value.split(",")
+        if trip_id
+    ]
+    if not trip_ids or len(trip_ids) > MAX_BATCH_TRIPS:
+        return jsonify({"error": f"Pass between 1 and {MAX_BATCH_TRIPS} trip ids"}), 400
+    try:
+        summaries = budgets.summaries(trip_ids)
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    return (
+        jsonify({str(trip_id): serialize_summary(s) for trip_id, s in summaries.items()}),
+        200,
+    )
+
+
+def _trip_members(trip_id):
+    # None for an unknown trip; expenses can only be paid by its members
+    try:
+        trip = trips.get(trip_id, {"users": 1})
+    except InvalidId:
+        return None
+    return None if trip is None else set(trip.get("users", []))
+
 
 @budget_bp.route("/<trip_id>/expenses", methods=["POST"])
 @token_required
 def add_expense(current_user, trip_id):
-    data = request.get_json()
-    category = data.get("category")
-    amount = data.get("amount")
-    description = data.get("description")
-    if not category or not amount or not description:
-        return jsonify({"error": "Invalid input"}), 400
-    expense = {"category": category, "amount": amount, "description": description}
-    mongo.db.trips.update_one({"_id": trip_id}, {"$push": {"budget.expenses": expense}})
-    return jsonify({"message": "Expense added"}), 201
+    members = _trip_members(trip_id)
+    if members is None:
+        return jsonify({"error": "Trip not found"}), 404
+    try:
+        expense = build_expense(trip_id, request.get_json(silent=True), current_user["_id"], members)
+    except InvalidExpense as e:
+        return jsonify({"error": str(e)}), 400
+    inserted, _ = budgets.insert_expenses([expense])
+    if not inserted:
+        return jsonify({"error": "Expense could not be saved"}), 500
+    budgets.record_expenses(trip_id, inserted)
+    publish(trip_id, "expense", serialize_expense(expense))
+    return jsonify({"message": "Expense added", "_id": str(expense["_id"])}), 201
+
+
+@budget_bp.route("/<trip_id>/expenses/bulk", methods=["POST"])
+@token_required
+def add_expenses_bulk(current_user, trip_id):
+    # Accepts a JSON array, or JSON lines (application/x-ndjson) which are
+    # read and inserted chunk by chunk as the body streams in
+    members = _trip_members(trip_id)
+    if members is None:
+        return jsonify({"error": "Trip not found"}), 404
+    if request.mimetype == "application/x-ndjson":
+        submitted = iter_ndjson(request.stream)
+    else:
+        submitted = request.get_json(silent=True)
+        if not isinstance(submitted, list):
+            return jsonify({"error": "Expected a JSON array of expenses"}), 400
+
+    inserted_count = 0
+    errors = []
+    chunk = []
+    positions = []
+
+    def flush():
+        inserted, failures = budgets.insert_expenses(chunk)
+        budgets.record_expenses(trip_id, inserted)
+        errors.extend({"index": positions[i], "error": message} for i, message in failures)
+        chunk.clear()
+        positions.clear()
+        return len(inserted)
+
+    read = 0
+    try:
+        for index, data in enumerate(submitted):
+            read = index + 1
+            try:
+                chunk.append(build_expense(trip_id, data, current_user["_id"], members))
+                positions.append(index)
+            except InvalidExpense as e:
+                errors.append({"index": index, "error": str(e)})
+            if len(chunk) >= INSERT_CHUNK:
+                inserted_count += flush()
+    except UnicodeDecodeError as e:
+        # The lines before it are still inserted, the ones after it are not read
+        errors.append({"index": read, "error": f"Could not read the line, stopped here: {e.reason}"})
+    if chunk:
+        inserted_count += flush()
+
+    if inserted_count:
+        publish(trip_id, "expense", {"inserted": inserted_count})
+    status = 201 if inserted_count else 400
+    return jsonify({"inserted": inserted_count, "errors": errors}), status
+
+
+def _expense_filters(trip_id):
+    return expense_query(
+        trip_id,
+        payer=request.args.get("payer"),
+        category=request.args.get("category"),
+        since=request.args.get("since"),
+        until=request.args.get("until"),
+        after=request.args.get("after"),
+    )
 
 
 @budget_bp.route("/<trip_id>/expenses", methods=["GET"])
 @token_required
 def get_expenses(current_user, trip_id):
-    trip = mongo.db.trips.find_one({"_id": trip_id})
-    return jsonify(trip["budget"]["expenses"]), 200
+    try:
+        limit = max(1, min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+        expenses, next_cursor = budgets.expenses(_expense_filters(trip_id), limit)
+    except (InvalidExpense, InvalidId, ValueError):
+        return jsonify({"error": "Invalid query"}), 400
+    return (
+        jsonify(
+            {
+                "expenses": [serialize_expense(expense) for expense in expenses],
+                "next": next_cursor,
+            }
+        ),
+        200,
+    )
+
+
+@budget_bp.route("/<trip_id>/expenses/export", methods=["GET"])
+@token_required
+def export_expenses(current_user, trip_id):
+    export_format = request.args.get("format", "jsonl")
+    if export_format not in ("jsonl", "csv"):
+        return jsonify({"error": "Unknown format"}), 400
+    try:
+        query = _expense_filters(trip_id)
+    except (InvalidExpense, InvalidId):
+        return jsonify({"error": "Invalid query"}), 400
+    expenses = budgets.iterate_expenses(query)
+    if export_format == "csv":
+        body, mimetype = export_csv(expenses), "text/csv"
+    else:
+        body, mimetype = export_jsonl(expenses), "application/x-ndjson"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=expenses-{trip_id}.{export_format}"
+        },
+    )
+
+
+@budget_bp.route("/<trip_id>/settle", methods=["GET"])
+@token_required
+def get_settlement(current_user, trip_id):
+    # Transfers that settle every balance, at most one fewer than the members
+    try:
+        trip = trips.get(trip_id, {"users": 1})
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    if not trip:
+        return jsonify({"error": "Trip not found"}), 404
+    version, balances, transfers = budgets.settlement(trip_id, trip.get("users", []))
+
+    members = users.load_many(balances)
+
+    def username(user_id):
+        user = members.get(ObjectId(user_id))
+        return user["username"] if user else None
+
+    return (
+        jsonify(
+            {
+                "version": version,
+                "balances": [
+                    {"user_id": user_id, "username": username(user_id), "balance": cents / 100}
+                    for user_id, cents in balances.items()
+                ],
+                "transfers": [
+                    {
+                        "from": debtor,
+                        "from_username": username(debtor),
+                        "to": creditor,
+                        "to_username": username(creditor),
+                        "amount": cents / 100,
+                    }
+                    for debtor, creditor, cents in transfers
+                ],
+            }
+        ),
+        200,
+    )
 
 
 @budget_bp.route("/<trip_id>/updated", methods=["POST"])
@@ -34,7 +246,7 @@ def update_expenses(current_user, trip_id):
     user_id = ObjectId(request.form.get("user_id"))
 
     budget_items = []
-    for field in ["flight", "hotel", "food", "transport", "activities", "spending"]:
+    for field in BUDGET_FIELDS:
         value = request.form.get(field)
         try:
             # Convert to float and ensure two decimal precision
@@ -59,18 +271,7 @@ def update_expenses(current_user, trip_id):
         "activities": activities,
         "spending": spending,
     }
-    result = mongo.db.itineraries.update_one(
-        {"_id": ObjectId(trip_id), "budget.user_id": user_id},
-        {
-            "$set": {
-                "budget.$.flight": updated_budget["flight"],
-                "budget.$.hotel": updated_budget["hotel"],
-                "budget.$.food": updated_budget["food"],
-                "budget.$.transport": updated_budget["transport"],
-                "budget.$.activities": updated_budget["activities"],
-                "budget.$.spending": updated_budget["spending"],
-            }
-        },
-    )
+    if budgets.set_member_budget(trip_id, user_id, updated_budget):
+        publish(trip_id, "budget", {"user_id": str(user_id), **updated_budget})
 
     return redirect(url_for("budget", trip_id=trip_id))
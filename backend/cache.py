@@ -0,0 +1,100 @@
+# Cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Besides the entry count, the cache can be bounded by total weight: pass
+    ``maxweight`` and a ``weigh`` function (e.g. an approximate byte size).
+    Hit, miss and eviction counts are kept so the cache can be scraped from
+    /metrics. ``on_remove(key, value)`` is called whenever an entry leaves
+    the cache other than by being overwritten.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic, maxweight=None, weigh=None, on_remove=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.on_remove = on_remove
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def _remove(self, key, notify=True):
+        value, _ = self._data.pop(key)
+        self.weight -= self._weights.pop(key, 0)
+        if notify and self.on_remove:
+            self.on_remove(key, value)
+
+    def _over_limit(self):
+        if len(self._data) > self.maxsize:
+            return True
+        return self.maxweight is not None and self.weight > self.maxweight
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key, notify=False)
+            self._data[key] = (value, self.clock() + self.ttl)
+            self._weights[key] = weight
+            self.weight += weight
+            # The newest entry is kept even if it alone exceeds maxweight
+            while len(self._data) > 1 and self._over_limit():
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_where(self, predicate):
+        # Linear in the cache size, meant for the rare writes that only know
+        # a secondary key
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(v)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            if self.on_remove:
+                for key, (value, _) in self._data.items():
+                    self.on_remove(key, value)
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "weight": self.weight,
+        }
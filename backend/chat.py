@@ -1,26 +1,49 @@
 # Chat.py
-import logging
 from flask import Blueprint, request, jsonify
-from backend.models import mongo
+from backend.store import store
+from backend.repositories import chats, trips
 from backend.auth import token_required
+from backend.events import publish
+from backend.telemetry import log_event
+from backend.profiling import profiled
+from backend.revisions import conditional
+from backend.indexes import ensure_indexes
 from datetime import datetime
 from bson.objectid import ObjectId
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 chat_bp = Blueprint("chat", __name__)
 
+# Messages live in their own collection, one document per message, instead of
+# an ever growing chat_logs array on the chatroom. Each message gets the next
+# number of its chatroom (seq, see ChatRepository), so (chatroom_id, seq)
+# orders a room's history and doubles as the cursor. ObjectIds are not used
+# for that: their order only follows the clock of the process that made them.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 
 def serialize_chat_log(log):
     if "_id" in log:
         log["_id"] = str(log["_id"])
     log["user_id"] = str(log["user_id"])
     log["timestamp"] = log["timestamp"]
+    log.pop("chatroom_id", None)
+    log.pop("legacy", None)
     return log
 
 
+def _cursor(value):
+    return None if value in (None, "") else int(value)
+
+
+def _page_size(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
 @chat_bp.route("/<trip_id>/messages", methods=["POST"])
 @token_required
 def add_message(current_user, trip_id):
@@ -29,55 +52,117 @@ def add_message(current_user, trip_id):
     if not message:
         return jsonify({"error": "Invalid input"}), 400
 
-    itinerary = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
-    if not itinerary:
+    chatroom_id = trips.chatroom_id(trip_id)
+    if not chatroom_id:
         return jsonify({"error": "Itinerary not found"}), 404
 
-    chatroom_id = itinerary["chatroom_id"]
-
-    # Log the message before adding it to the database
-    logger.info(f"Adding message: {message} for chatroom_id: {chatroom_id}")
-
-    mongo.db.chatrooms.update_one(
-        {"_id": ObjectId(chatroom_id)},
-        {
-            "$push": {
-                "chat_logs": {
-                    "user_id": current_user["_id"],
-                    "username": current_user["username"],
-                    "message": message,
-                    "timestamp": datetime.now(),
-                }
-            }
-        },
-        upsert=True,
+    log = {
+        "chatroom_id": ObjectId(chatroom_id),
+        "user_id": current_user["_id"],
+        "username": current_user["username"],
+        "message": message,
+        "timestamp": datetime.utcnow(),
+    }
+    message_id = chats.add(trip_id, log)
+    publish(trip_id, "message", serialize_chat_log(log))
+    # Never the text itself: chat messages are private to the trip
+    log_event(
+        "chat.message",
+        chatroom_id=chatroom_id,
+        message_id=message_id,
+        user_id=current_user["_id"],
+        seq=log["seq"],
+        length=len(message),
     )
 
-    # Verify the update
-    chatroom = mongo.db.chatrooms.find_one({"_id": ObjectId(chatroom_id)})
-    logger.info(f"Chatroom after update: {chatroom}")
-
     return (
-        jsonify({"message": "Message added", "username": current_user["username"]}),
+        jsonify(
+            {
+                "message": "Message added",
+                "username": current_user["username"],
+                "_id": str(message_id),
+            }
+        ),
         201,
     )
 
 
 @chat_bp.route("/<trip_id>/messages", methods=["GET"])
+@profiled
 @token_required
+@conditional
 def get_messages(current_user, trip_id):
-    itinerary = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
-    if not itinerary:
+    chatroom_id = trips.chatroom_id(trip_id)
+    if not chatroom_id:
         return jsonify({"error": "Itinerary not found"}), 404
 
-    chatroom_id = itinerary["chatroom_id"]
-    chatroom = mongo.db.chatrooms.find_one({"_id": ObjectId(chatroom_id)})
-    if not chatroom:
-        return jsonify({"error": "Chatroom not found"}), 404
+    try:
+        messages, has_more = chats.page(
+            chatroom_id,
+            after=_cursor(request.args.get("after")),
+            before=_cursor(request.args.get("before")),
+            limit=_page_size(request.args.get("limit")),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
 
-    chat_logs = [serialize_chat_log(log) for log in chatroom["chat_logs"]]
+    chat_logs = [serialize_chat_log(log) for log in messages]
+
+    return (
+        jsonify(
+            {
+                "messages": chat_logs,
+                "has_more": has_more,
+                "oldest": chat_logs[0].get("seq") if chat_logs else None,
+                "newest": chat_logs[-1].get("seq") if chat_logs else None,
+            }
+        ),
+        200,
+    )
 
-    # Log the retrieved messages
-    logger.info(f"Retrieved messages for chatroom_id: {chatroom_id} - {chat_logs}")
 
-    return jsonify(chat_logs), 200
+def _legacy_message_id(chatroom_id, position):
+    # Ids stamped with the chatroom's creation time sort before any message
+    # posted after the deploy, and the position keeps the array order
+    raw = chatroom_id.binary
+    marker = bytes(b ^ 0xFF for b in raw[4:9])
+    return ObjectId(raw[:4] + marker + position.to_bytes(3, "big"))
+
+
+def migrate_chat_logs():
+    """Move embedded chatroom chat_logs arrays into the messages collection.
+
+    Messages copied by an interrupted run are tagged ``legacy`` and replaced
+    on the next run, so the migration can be repeated safely. Messages
+    without a seq, moved here or stored before messages were numbered, are
+    then numbered.
+    """
+    ensure_indexes()
+    migrated = 0
+    cursor = store.db.chatrooms.find({"chat_logs": {"$exists": True}})
+    for chatroom in cursor:
+        store.db.messages.delete_many({"chatroom_id": chatroom["_id"], "legacy": True})
+        messages = [
+            {
+                "_id": _legacy_message_id(chatroom["_id"], position),
+                "chatroom_id": chatroom["_id"],
+                "user_id": log.get("user_id"),
+                "username": log.get("username"),
+                "message": log.get("message"),
+                "timestamp": log.get("timestamp"),
+                "legacy": True,
+            }
+            for position, log in enumerate(chatroom["chat_logs"])
+        ]
+        if messages:
+            store.db.messages.insert_many(messages)
+        store.db.chatrooms.update_one(
+            {"_id": chatroom["_id"]}, {"$unset": {"chat_logs": ""}}
+        )
+        store.db.messages.update_many(
+            {"chatroom_id": chatroom["_id"], "legacy": True}, {"$unset": {"legacy": ""}}
+        )
+        migrated += len(messages)
+    for chatroom_id in store.db.messages.distinct("chatroom_id", {"seq": {"$exists": False}}):
+        chats.number_messages(chatroom_id)
+    return migrated
@@ -0,0 +1,88 @@
+# Clusters.py
+import math
+
+# Grid clustering of map markers, hierarchical across zoom levels. At each
+# display zoom, places are bucketed into square cells of CELL_PIXELS screen
+# pixels. Cells at zoom z - 1 are exactly 2 x 2 cells of zoom z, so only the
+# most detailed level is computed from the places; every coarser level merges
+# the one below it.
+
+CELL_PIXELS = 64
+MIN_CLUSTER_ZOOM = 3
+# From this zoom on every place is drawn on its own
+MAX_CLUSTER_ZOOM = 17
+
+
+def world_pixel(lat, lng, zoom):
+    lat = max(min(lat, 85.0511), -85.0511)
+    scale = 256 * 2**zoom
+    x = (lng + 180.0) / 360.0 * scale
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * scale
+    return x, y
+
+
+def build_levels(places, min_zoom=MIN_CLUSTER_ZOOM, max_zoom=MAX_CLUSTER_ZOOM - 1):
+    """Cluster one tile's places for every zoom in [min_zoom, max_zoom].
+
+    Returns {zoom: {cell: [count, lat_sum, lng_sum, place]}}; place is the
+    only place of a one-place cell and None otherwise.
+    """
+    finest = {}
+    for place in places:
+        try:
+            lat, lng = float(place["latitude"]), float(place["longitude"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        x, y = world_pixel(lat, lng, max_zoom)
+        cell = (int(x // CELL_PIXELS), int(y // CELL_PIXELS))
+        entry = finest.get(cell)
+        if entry is None:
+            finest[cell] = [1, lat, lng, place]
+        else:
+            entry[0] += 1
+            entry[1] += lat
+            entry[2] += lng
+            entry[3] = None
+
+    levels = {max_zoom: finest}
+    for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+        levels[zoom] = merge_cells(levels[zoom + 1].items(), shift=1)
+    return levels
+
+
+def merge_cells(cells, shift=0):
+    merged = {}
+    for (cx, cy), (count, lat_sum, lng_sum, place) in cells:
+        cell = (cx >> shift, cy >> shift)
+        entry = merged.get(cell)
+        if entry is None:
+            merged[cell] = [count, lat_sum, lng_sum, place]
+        else:
+            entry[0] += count
+            entry[1] += lat_sum
+            entry[2] += lng_sum
+            entry[3] = None
+    return merged
+
+
+def clusters_for(levels_per_tile, zoom, bbox):
+    """Merge the levels of several tiles at ``zoom`` and keep what is in bbox.
+
+    Returns (clusters, places): clusters are {latitude, longitude, count}
+    dicts for cells holding more than one place, places the lone ones.
+    """
+    bl_lat, tr_lat, bl_lng, tr_lng = bbox
+    cells = merge_cells(
+        cell for levels in levels_per_tile for cell in levels[zoom].items()
+    )
+    clusters = []
+    places = []
+    for count, lat_sum, lng_sum, place in cells.values():
+        lat, lng = lat_sum / count, lng_sum / count
+        if not (bl_lat <= lat <= tr_lat and bl_lng <= lng <= tr_lng):
+            continue
+        if count == 1:
+            places.append(place)
+        else:
+            clusters.append({"latitude": round(lat, 6), "longitude": round(lng, 6), "count": count})
+    return clusters, places
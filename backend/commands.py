@@ -0,0 +1,119 @@
+# Commands.py
+import click
+from flask.cli import with_appcontext
+from backend.seed import initialize_database
+from backend.memberships import migrate_past_trips
+from backend.chat import migrate_chat_logs
+from backend.indexes import IndexBuildError, ensure_indexes, audit_queries
+from backend.repositories import budgets, itinerary_items
+from backend.schedule import migrate_itinerary_items
+from backend.gazetteer import DEFAULT_PATH, build, read_geonames
+from backend.profiling import HEADER, make_token
+
+# CLI commands registered on the app by create_app(), e.g. `flask seed`.
+
+
+@click.command("seed")
+@with_appcontext
+def seed_command():
+    """Create the test users and the test trip if they are missing."""
+    ensure_indexes()
+    initialize_database()
+
+
+@click.command("migrate-past-trips")
+@with_appcontext
+def migrate_past_trips_command():
+    """Replace embedded past_trips snapshots with membership refs."""
+    migrated = migrate_past_trips()
+    print(f"Migrated past trips for {migrated} users")
+
+
+@click.command("migrate-chat-logs")
+@with_appcontext
+def migrate_chat_logs_command():
+    """Move embedded chatroom chat_logs into the messages collection and number them."""
+    migrated = migrate_chat_logs()
+    print(f"Migrated {migrated} chat messages")
+
+
+@click.command("migrate-itinerary-items")
+@with_appcontext
+def migrate_itinerary_items_command():
+    """Move embedded itinerary arrays into the itinerary_items collection.
+
+    Also records each older trip's longest item, which bounds conflict checks.
+    """
+    ensure_indexes()
+    migrated = migrate_itinerary_items()
+    print(f"Migrated {migrated} itinerary items")
+    counted = itinerary_items.count_spans()
+    print(f"Recorded the longest item of {counted} trips")
+
+
+@click.command("rebuild-balances")
+@with_appcontext
+def rebuild_balances_command():
+    """Recompute the running settle-up balances from the expense ledger."""
+    rebuilt = budgets.rebuild_balances()
+    print(f"Rebuilt balances for {rebuilt} trips")
+
+
+@click.command("build-gazetteer")
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", default=DEFAULT_PATH, show_default=True)
+@click.option("--min-population", default=0, show_default=True)
+@click.option("--no-alternates", is_flag=True, help="Index only the main and ASCII names.")
+@with_appcontext
+def build_gazetteer_command(dump, output, min_population, no_alternates):
+    """Build the offline gazetteer from a GeoNames dump (e.g. cities500.txt)."""
+    with open(dump, encoding="utf-8") as f:
+        rows = read_geonames(f, min_population=min_population, alternates=not no_alternates)
+        places, keys = build(rows, output)
+    print(f"Indexed {keys} names for {places} places in {output}")
+
+
+@click.command("profile-token")
+@with_appcontext
+def profile_token_command():
+    """Print a header that makes the profiled views write a profile."""
+    print(f"{HEADER}: {make_token()}")
+
+
+@click.command("ensure-indexes")
+@with_appcontext
+def ensure_indexes_command():
+    """Create every index in the registry (safe to rerun)."""
+    try:
+        names = ensure_indexes()
+    except IndexBuildError as e:
+        for name, error in e.failures:
+            print(f"Index FAILED: {name}: {error}")
+        raise SystemExit(f"{len(e.failures)} index(es) could not be created")
+    for name in names:
+        print(f"Index ready: {name}")
+
+
+@click.command("audit-queries")
+@with_appcontext
+def audit_queries_command():
+    """Explain each query shape and fail if any needs a collection scan."""
+    failures = 0
+    for name, stages, ok in audit_queries():
+        print(f"{'ok' if ok else 'FAIL':<4} {name}: {' <- '.join(stages)}")
+        failures += not ok
+    if failures:
+        raise SystemExit(f"{failures} query shape(s) are not served by an index")
+
+
+commands = [
+    seed_command,
+    migrate_past_trips_command,
+    migrate_chat_logs_command,
+    migrate_itinerary_items_command,
+    rebuild_balances_command,
+    build_gazetteer_command,
+    profile_token_command,
+    ensure_indexes_command,
+    audit_queries_command,
+]
@@ -0,0 +1,277 @@
+# Events.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from bson.errors import InvalidId
+from flask import Blueprint, Response, request, jsonify
+from backend.auth import token_required
+from backend.repositories import EVENT_HISTORY, trip_events, trips
+from backend.telemetry import log_event
+
+# Per-trip event stream. Blueprints publish chat messages, itinerary items
+# and budget changes and open tabs receive them over Server-Sent Events (or
+# long polling) instead of re-fetching every few seconds.
+#
+# Events are appended to the trip's log in the database (trip_events), which
+# numbers them, so every worker sees the same events under the same ids and
+# a stream can resume from Last-Event-ID on any worker. Each process keeps
+# one broker that fans the logs out to its own streams: a pump thread reads
+# the logs of the trips that have listeners here every PUMP_INTERVAL, and
+# events published by this process are handed over straight away. Topics
+# without listeners are dropped after IDLE_TOPIC_SECONDS.
+#
+# Thread budget: an open stream holds a gthread thread until the tab closes
+# or STREAM_SECONDS pass (the browser then reconnects with Last-Event-ID).
+# Idle streams only wait on their topic's condition, so gunicorn.conf.py
+# sizes the pool for them: 288 threads per worker, of which EVENT_STREAMS
+# (256) may stream and the rest stay free for pages and API calls. Further
+# streams are answered 204, on which EventSource gives up and the page
+# polls the messages endpoint instead. With 2 workers that is 512 streaming
+# tabs; GUNICORN_THREADS moves EVENT_STREAMS along with it.
+
+events_bp = Blueprint("events", __name__)
+
+HEARTBEAT_SECONDS = 15
+MAX_POLL_SECONDS = 30
+STREAM_SECONDS = 300
+PUMP_INTERVAL = 0.5
+IDLE_TOPIC_SECONDS = 60
+HISTORY_SIZE = EVENT_HISTORY
+settings = {"max_streams": 256}
+_streams = {"open": 0}
+_streams_lock = threading.Lock()
+
+
+class _Topic:
+    def __init__(self, history):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        self.waiters = 0
+        self.used_at = time.monotonic()
+
+
+class EventBroker:
+    def __init__(self, log=trip_events, history=HISTORY_SIZE, interval=PUMP_INTERVAL):
+        self.log = log
+        self.history = history
+        self.interval = interval
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._pump = None
+
+    def __len__(self):
+        return len(self._topics)
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
+
+    def _topic(self, trip_id):
+        trip_id = str(trip_id)
+        with self._lock:
+            topic = self._topics.get(trip_id)
+            created = topic is None
+            if created:
+                topic = self._topics[trip_id] = _Topic(self.history)
+                # Held until the log is loaded, so nobody sees an empty topic
+                topic.condition.acquire()
+            topic.used_at = time.monotonic()
+        if created:
+            try:
+                self._ingest(topic, self.log.log(trip_id))
+            except Exception:
+                with self._lock:
+                    self._topics.pop(trip_id, None)
+                raise
+            finally:
+                topic.condition.release()
+            self._start_pump()
+        return topic
+
+    def _ingest(self, topic, log):
+        # Logs hold consecutive ids ending at seq, so replaying one is idempotent
+        if not log:
+            return
+        events = log.get("events", [])
+        first = log["seq"] - len(events) + 1
+        with topic.condition:
+            new = [
+                (first + i, event["kind"], event["data"])
+                for i, event in enumerate(events)
+                if first + i > topic.last_id
+            ]
+            if new:
+                topic.events.extend(new)
+                topic.last_id = new[-1][0]
+                topic.condition.notify_all()
+
+    def publish(self, trip_id, kind, data):
+        # Encode once here rather than once per subscriber
+        payload = json.dumps(data, default=str)
+        log = self.log.append(trip_id, kind, payload)
+        topic = self._topics.get(str(trip_id))
+        if topic is not None:
+            self._ingest(topic, log)
+        return log["seq"]
+
+    def last_id(self, trip_id):
+        topic = self._topic(trip_id)
+        with topic.condition:
+            return topic.last_id
+
+    def wait(self, trip_id, after, timeout):
+        """Block until the trip has events newer than ``after``.
+
+        Returns the buffered events after that id, or an empty list when the
+        timeout expires first. Ids older than the buffer are answered with
+        everything that is still buffered.
+        """
+        topic = self._topic(trip_id)
+        with topic.condition:
+            topic.waiters += 1
+            try:
+                topic.condition.wait_for(lambda: topic.last_id > after, timeout)
+            finally:
+                topic.waiters -= 1
+                topic.used_at = time.monotonic()
+            return [event for event in topic.events if event[0] > after]
+
+    def _start_pump(self):
+        with self._lock:
+            # Started lazily, so it runs in the worker and not in a preloading master
+            if self._pump is None or not self._pump.is_alive():
+                self._pump = threading.Thread(target=self._run, name="event-pump", daemon=True)
+                self._pump.start()
+
+    def pump(self):
+        """Drop idle topics and read the logs that moved for the others."""
+        now = time.monotonic()
+        with self._lock:
+            for trip_id, topic in list(self._topics.items()):
+                if not topic.waiters and now - topic.used_at > IDLE_TOPIC_SECONDS:
+                    del self._topics[trip_id]
+            seen = {trip_id: topic.last_id for trip_id, topic in self._topics.items() if topic.waiters}
+        for log in self.log.changed(seen):
+            topic = self._topics.get(str(log["_id"]))
+            if topic is not None:
+                self._ingest(topic, log)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.pump()
+            except Exception as e:
+                log_event("events.pump_failed", level=logging.WARNING, sample_rate=1, error=str(e))
+
+
+broker = EventBroker()
+
+
+def publish(trip_id, kind, data):
+    return broker.publish(trip_id, kind, data)
+
+
+def _trip_exists(trip_id):
+    try:
+        return trips.exists(trip_id)
+    except InvalidId:
+        return False
+
+
+def _start_id(trip_id):
+    # EventSource sends Last-Event-ID when it reconnects
+    value = request.headers.get("Last-Event-ID") or request.args.get("after")
+    latest = broker.last_id(trip_id)
+    try:
+        # Ids are per trip and shared by all workers; one ahead of the log
+        # only comes from a log that was dropped since
+        return min(int(value), latest)
+    except (TypeError, ValueError):
+        return latest
+
+
+def format_sse(event_id, kind, payload):
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+
+
+def _open_stream():
+    with _streams_lock:
+        if _streams["open"] >= settings["max_streams"]:
+            return False
+        _streams["open"] += 1
+        return True
+
+
+def _close_stream():
+    with _streams_lock:
+        _streams["open"] -= 1
+
+
+@events_bp.route("/<trip_id>/stream", methods=["GET"])
+@token_required
+def stream(current_user, trip_id):
+    if not _trip_exists(trip_id):
+        return jsonify({"error": "Trip not found"}), 404
+    if not _open_stream():
+        # EventSource stops reconnecting on a 204; the page falls back to polling
+        return Response(status=204)
+    last_id = _start_id(trip_id)
+
+    def generate():
+        nonlocal last_id
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        closes_at = time.monotonic() + STREAM_SECONDS
+        while time.monotonic() < closes_at:
+            events = broker.wait(trip_id, last_id, HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event_id, kind, payload in events:
+                last_id = event_id
+                yield format_sse(event_id, kind, payload)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Also runs when the client goes away before the first event
+    response.call_on_close(_close_stream)
+    return response
+
+
+@events_bp.route("/<trip_id>/poll", methods=["GET"])
+@token_required
+def poll(current_user, trip_id):
+    if not _trip_exists(trip_id):
+        return jsonify({"error": "Trip not found"}), 404
+    after = _start_id(trip_id)
+    try:
+        timeout = min(float(request.args.get("timeout", MAX_POLL_SECONDS)), MAX_POLL_SECONDS)
+    except ValueError:
+        timeout = MAX_POLL_SECONDS
+    events = broker.wait(trip_id, after, max(timeout, 0))
+    return (
+        jsonify(
+            {
+                "events": [
+                    {"id": event_id, "type": kind, "data": json.loads(payload)}
+                    for event_id, kind, payload in events
+                ],
+                "last_id": events[-1][0] if events else after,
+            }
+        ),
+        200,
+    )
+
+
+def init_app(app):
+    settings["max_streams"] = int(app.config.get("EVENT_STREAMS", os.getenv("EVENT_STREAMS", "256")))
+    # Topics hold events of the previous database after a backend switch
+    broker.clear()
@@ -0,0 +1,337 @@
+# Gazetteer.py
+import mmap
+import os
+import re
+import unicodedata
+import numpy as np
+from flask import Blueprint, request, jsonify
+from backend.auth import token_required
+from backend.metrics import register_collector
+
+# Offline place-name lookups from a GeoNames-style dump, for autocomplete and
+# for turning typed-in itinerary locations into coordinates. `flask
+# build-gazetteer` turns the dump into flat files that are memory-mapped at
+# startup, so millions of names cost a few page-cache pages per query rather
+# than Python objects, and prefork workers share one copy:
+#
+#   keys.bin / key_offsets.npy     normalized names, sorted, back to back
+#   key_places.npy                 place row of each key
+#   key_population.npy             population of that place, in key order
+#   prefixes.bin / ...offsets.npy  every key prefix up to PREFIX_TABLE_LENGTH
+#   prefix_top.npy                 the TOP_K most populous places per prefix
+#   names.bin / name_offsets.npy   display name of each place
+#   places.npy                     geonameid, coordinates, population, country
+#
+# A prefix query is a binary search for the range of keys starting with it;
+# short prefixes match too many keys to rank at query time and are answered
+# from the precomputed table instead.
+
+gazetteer_bp = Blueprint("gazetteer", __name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "data", "gazetteer")
+TOP_K = 10
+MAX_SUGGESTIONS = 50
+PREFIX_TABLE_LENGTH = 3
+NO_PLACE = np.iinfo(np.uint32).max
+MAX_POPULATION = np.iinfo(np.uint32).max
+PLACE_DTYPE = np.dtype(
+    [
+        ("geonameid", "<u4"),
+        ("latitude", "<f4"),
+        ("longitude", "<f4"),
+        ("population", "<u4"),
+        ("country", "S2"),
+    ]
+)
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(name):
+    """Lowercase, strip accents and collapse punctuation into single spaces."""
+    if not name.isascii():
+        name = "".join(
+            c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c)
+        )
+    return _SEPARATORS.sub(" ", name.casefold()).strip()
+
+
+class SortedKeys:
+    """Sorted UTF-8 strings stored back to back, addressed by an offsets array."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[int(self.offsets[i]) : int(self.offsets[i + 1])]
+
+    def bisect(self, key, lo=0):
+        # bisect_left over the keys; written out since bisect's key= needs 3.10
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key):
+        i = self.bisect(key)
+        return i if i < len(self) and self[i] == key else None
+
+
+def _top_places(key_places, key_population, lo, hi, limit):
+    # Most populous distinct places among keys[lo:hi]; ties keep key order.
+    # Both arrays are in key order, so a range is two contiguous reads
+    places = np.asarray(key_places[lo:hi])
+    if not len(places):
+        return []
+    pops = np.asarray(key_population[lo:hi], dtype=np.int64)
+    candidates = min(len(places), max(limit * 8, 64))
+    if candidates < len(places):
+        pick = np.argpartition(-pops, candidates - 1)[:candidates]
+    else:
+        pick = np.arange(len(places))
+    pick = pick[np.lexsort((pick, -pops[pick]))]
+    result = []
+    for place in places[pick].tolist():
+        if place not in result:
+            result.append(place)
+            if len(result) == limit:
+                break
+    return result
+
+
+def read_geonames(lines, min_population=0, alternates=True):
+    """Yield (geonameid, name, alternate names, lat, lng, country, population)
+    from the tab-separated GeoNames dump format."""
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 15:
+            continue
+        try:
+            population = int(fields[14] or 0)
+            row = (
+                int(fields[0]),
+                fields[1],
+                [fields[2]] + (fields[3].split(",") if alternates and fields[3] else []),
+                float(fields[4]),
+                float(fields[5]),
+                fields[8],
+                population,
+            )
+        except ValueError:
+            continue
+        if population >= min_population:
+            yield row
+
+
+def _write_keys(path, name, encoded):
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(key) for key in encoded], out=offsets[1:])
+    with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(path, f"{name}_offsets.npy"), offsets)
+
+
+def build(rows, path):
+    """Write the gazetteer files for ``rows`` (see read_geonames) into path.
+
+    Keys are sorted in memory, so building needs a few hundred bytes per
+    name; loading the result does not. Returns (places, keys) counts.
+    """
+    os.makedirs(path, exist_ok=True)
+    marker = os.path.join(path, "places.npy")
+    if os.path.exists(marker):
+        os.remove(marker)
+    places = []
+    names = []
+    keys = []
+    key_places = []
+    for index, (geonameid, name, alternate_names, lat, lng, country, population) in enumerate(rows):
+        places.append((geonameid, lat, lng, min(population, MAX_POPULATION), country.encode("ascii", "replace")[:2]))
+        names.append(f"{name}, {country}".encode() if country else name.encode())
+        seen = set()
+        for candidate in (name, *alternate_names):
+            key = normalize(candidate)
+            if key and key not in seen:
+                seen.add(key)
+                keys.append(key)
+                key_places.append(index)
+
+    table = np.array(places, dtype=PLACE_DTYPE)
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    keys = [keys[i] for i in order]
+    key_places = np.array(key_places, dtype=np.uint32)[np.array(order, dtype=np.int64)]
+    key_population = table["population"][key_places]
+
+    prefixes = {}
+    for length in range(1, PREFIX_TABLE_LENGTH + 1):
+        lo = 0
+        while lo < len(keys):
+            prefix = keys[lo][:length]
+            hi = lo + 1
+            while hi < len(keys) and keys[hi][:length] == prefix:
+                hi += 1
+            if len(prefix) == length:
+                prefixes[prefix] = _top_places(key_places, key_population, lo, hi, TOP_K)
+            lo = hi
+    prefix_order = sorted(prefixes)
+    top = np.full((len(prefix_order), TOP_K), NO_PLACE, dtype=np.uint32)
+    for i, prefix in enumerate(prefix_order):
+        top[i, : len(prefixes[prefix])] = prefixes[prefix]
+
+    _write_keys(path, "keys", [key.encode() for key in keys])
+    np.save(os.path.join(path, "key_places.npy"), key_places)
+    np.save(os.path.join(path, "key_population.npy"), key_population)
+    _write_keys(path, "prefixes", [prefix.encode() for prefix in prefix_order])
+    np.save(os.path.join(path, "prefix_top.npy"), top)
+    _write_keys(path, "names", names)
+    # Written last: its presence marks a complete build
+    np.save(marker, table)
+    return len(places), len(keys)
+
+
+def _map_blob(filename):
+    with open(filename, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Gazetteer:
+    def __init__(self):
+        self.path = None
+        self.places = None
+        self.lookups = 0
+
+    @property
+    def loaded(self):
+        return self.places is not None
+
+    def __len__(self):
+        return len(self.places) if self.loaded else 0
+
+    def load(self, path):
+        def array(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        def keys(name):
+            return SortedKeys(_map_blob(os.path.join(path, f"{name}.bin")), array(f"{name}_offsets"))
+
+        self.keys = keys("keys")
+        self.key_places = array("key_places")
+        self.key_population = array("key_population")
+        self.prefixes = keys("prefixes")
+        self.prefix_top = array("prefix_top")
+        self.names = keys("names")
+        self.path = path
+        self.places = array("places")
+
+    def place(self, index):
+        row = self.places[index]
+        return {
+            "geonameid": int(row["geonameid"]),
+            "name": self.names[index].decode(),
+            "country": row["country"].decode(),
+            "latitude": round(float(row["latitude"]), 5),
+            "longitude": round(float(row["longitude"]), 5),
+            "population": int(row["population"]),
+        }
+
+    def _range(self, key):
+        encoded = key.encode()
+        lo = self.keys.bisect(encoded)
+        # Normalized keys never contain 0xff, so this sorts after all of them
+        return lo, self.keys.bisect(encoded + b"\xff", lo)
+
+    def suggest(self, query, limit=TOP_K):
+        """Places with a name starting with ``query``, most populous first."""
+        key = normalize(query or "")
+        if not self.loaded or not key:
+            return []
+        self.lookups += 1
+        if len(key) <= PREFIX_TABLE_LENGTH and limit <= TOP_K:
+            i = self.prefixes.find(key.encode())
+            if i is None:
+                return []
+            ids = [place for place in self.prefix_top[i].tolist() if place != NO_PLACE]
+        else:
+            lo, hi = self._range(key)
+            ids = _top_places(self.key_places, self.key_population, lo, hi, limit)
+        return [self.place(place) for place in ids[:limit]]
+
+    def _exact(self, key, limit):
+        encoded = key.encode()
+        lo = self.keys.bisect(encoded)
+        hi = self.keys.bisect(encoded + b"\x00", lo)
+        return _top_places(self.key_places, self.key_population, lo, hi, limit)
+
+    def resolve(self, name):
+        """Best place for free text like "Lyon" or "Paris, FR", or None.
+
+        The whole text is tried as a name first, then the part before the
+        first comma, preferring places in a two-letter country code given
+        after it. Among equal names the most populous place wins.
+        """
+        if not self.loaded or not name:
+            return None
+        self.lookups += 1
+        full = normalize(name)
+        ids = self._exact(full, 1) if full else []
+        if ids:
+            return self.place(ids[0])
+        head, _, rest = name.partition(",")
+        head = normalize(head)
+        if not head or head == full:
+            return None
+        ids = self._exact(head, MAX_SUGGESTIONS)
+        countries = {part.strip().upper() for part in rest.split(",") if len(part.strip()) == 2}
+        for place in ids:
+            if self.places[place]["country"].decode() in countries:
+                return self.place(place)
+        return self.place(ids[0]) if ids else None
+
+    def collect(self):
+        return [
+            ("gazetteer_places", "gauge", "Places in the loaded gazetteer.", {}, len(self)),
+            ("gazetteer_lookups_total", "counter", "Gazetteer autocomplete and resolve lookups.", {}, self.lookups),
+        ]
+
+
+index = Gazetteer()
+register_collector(index.collect)
+
+
+def init_app(app):
+    path = app.config.get("GAZETTEER_PATH", os.getenv("GAZETTEER_PATH", DEFAULT_PATH))
+    # The gazetteer is optional: without a build, lookups find nothing
+    if os.path.exists(os.path.join(path, "places.npy")):
+        index.load(path)
+
+
+@gazetteer_bp.route("/autocomplete", methods=["GET"])
+@token_required
+def autocomplete(current_user):
+    if not index.loaded:
+        return jsonify({"error": "Gazetteer is not loaded"}), 503
+    try:
+        limit = min(int(request.args.get("limit", TOP_K)), MAX_SUGGESTIONS)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    return jsonify({"data": index.suggest(request.args.get("q", ""), max(limit, 1))}), 200
+
+
+@gazetteer_bp.route("/resolve", methods=["GET"])
+@token_required
+def resolve(current_user):
+    if not index.loaded:
+        return jsonify({"error": "Gazetteer is not loaded"}), 503
+    place = index.resolve(request.args.get("q", ""))
+    if place is None:
+        return jsonify({"error": "Place not found"}), 404
+    return jsonify({"data": place}), 200
@@ -0,0 +1,147 @@
+# Geo.py
+import math
+import threading
+from collections import defaultdict
+import numpy as np
+from backend.routing import EARTH_RADIUS_KM
+
+# Radius and k-nearest lookups. Itinerary items carry a GeoJSON point and are
+# queried by the itinerary_items repository through the (trip_id, point
+# 2dsphere) index. Cached Travel Advisor places only live in memory, so they
+# get a GeoIndex: a grid of fixed-size lat/lng cells where a query only looks
+# at the cells its circle touches.
+
+METERS_PER_DEGREE = EARTH_RADIUS_KM * 1000 * math.pi / 180
+MAX_LATITUDE = 85.0
+
+
+def distances_m(lat, lng, lats, lngs):
+    """Haversine distances in metres from one point to many."""
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * 1000 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoIndex:
+    """Thread-safe grid index of points, keyed so entries can be replaced.
+
+    With cells of ``cell_degrees`` (0.01 is about 1 km), a radius query
+    reads only the cells under its bounding box, and a k-nearest query
+    grows a ring of cells until nothing outside it can be closer than the
+    k-th point found.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees
+        self._cells = defaultdict(dict)
+        self._where = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add(self, key, lat, lng, value):
+        cell = self._cell(lat, lng)
+        with self._lock:
+            old = self._where.get(key)
+            if old is not None and old != cell:
+                self._drop(old, key)
+            self._cells[cell][key] = (lat, lng, value)
+            self._where[key] = cell
+
+    def remove(self, key):
+        with self._lock:
+            cell = self._where.pop(key, None)
+            if cell is not None:
+                self._drop(cell, key)
+
+    def _drop(self, cell, key):
+        entries = self._cells[cell]
+        entries.pop(key, None)
+        if not entries:
+            del self._cells[cell]
+
+    def _gather(self, cells):
+        entries = []
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if bucket:
+                entries.extend(bucket.values())
+        return entries
+
+    def _ranked(self, lat, lng, entries):
+        if not entries:
+            return []
+        lats = np.fromiter((e[0] for e in entries), float, len(entries))
+        lngs = np.fromiter((e[1] for e in entries), float, len(entries))
+        dist = distances_m(lat, lng, lats, lngs)
+        order = np.argsort(dist, kind="stable")
+        return [(float(dist[i]), entries[i][2]) for i in order]
+
+    def _lng_cells_per_lat_cell(self, lat):
+        # Cells get narrower towards the poles
+        return 1 / max(math.cos(math.radians(min(abs(lat), MAX_LATITUDE))), 1e-6)
+
+    def within(self, lat, lng, radius_m, limit=None):
+        """Return (distance_m, value) pairs within radius_m, nearest first."""
+        dlat = radius_m / METERS_PER_DEGREE
+        dlng = dlat * self._lng_cells_per_lat_cell(max(abs(lat - dlat), abs(lat + dlat)))
+        lat0, lng0 = self._cell(lat - dlat, lng - dlng)
+        lat1, lng1 = self._cell(lat + dlat, lng + dlng)
+        with self._lock:
+            entries = self._gather(
+                (i, j) for i in range(lat0, lat1 + 1) for j in range(lng0, lng1 + 1)
+            )
+        ranked = [pair for pair in self._ranked(lat, lng, entries) if pair[0] <= radius_m]
+        return ranked[:limit] if limit else ranked
+
+    def _ring(self, ci, cj, ring, stretch):
+        # Cells first reached at this ring: the new top and bottom rows plus
+        # the new columns on both sides, without revisiting the inside
+        width = int(math.ceil(ring * stretch))
+        if ring == 0:
+            return [(ci, cj)]
+        previous = int(math.ceil((ring - 1) * stretch))
+        cells = [(i, j) for i in (ci - ring, ci + ring) for j in range(cj - width, cj + width + 1)]
+        for i in range(ci - ring + 1, ci + ring):
+            for offset in range(previous + 1, width + 1):
+                cells.append((i, cj - offset))
+                cells.append((i, cj + offset))
+        return cells
+
+    def nearest(self, lat, lng, k, max_radius_m=None):
+        """Return the k nearest (distance_m, value) pairs, nearest first."""
+        ci, cj = self._cell(lat, lng)
+        stretch = self._lng_cells_per_lat_cell(lat)
+        # Any point outside ring r is at least this far away
+        cell_m = self.cell_degrees * METERS_PER_DEGREE
+        entries = []
+        ring = 0
+        with self._lock:
+            total = len(self._where)
+            while True:
+                width = int(math.ceil(ring * stretch))
+                if (2 * ring + 1) * (2 * width + 1) > len(self._cells):
+                    # The square has outgrown the occupied cells (a sparse
+                    # index or a far-away query): reading them all is cheaper
+                    entries = self._gather(list(self._cells))
+                    break
+                entries.extend(self._gather(self._ring(ci, cj, ring, stretch)))
+                reach = ring * cell_m
+                if len(entries) >= total:
+                    break
+                if max_radius_m is not None and reach >= max_radius_m:
+                    break
+                if len(entries) >= k:
+                    kth = self._ranked(lat, lng, entries)[k - 1][0]
+                    if kth <= reach:
+                        break
+                ring += 1
+        ranked = self._ranked(lat, lng, entries)
+        if max_radius_m is not None:
+            ranked = [pair for pair in ranked if pair[0] <= max_radius_m]
+        return ranked[:k]
@@ -0,0 +1,180 @@
+# Ical.py
+import re
+from datetime import datetime, timedelta
+
+# Just enough of RFC 5545 to move itinerary items in and out of calendar
+# apps. Parsing is line by line, so an upload is never held in memory.
+# Times are read as wall-clock times: TZID parameters and a trailing Z are
+# dropped, which matches how itinerary times are stored.
+
+DURATION_PATTERN = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+PRODID = "-//TripPlanner421//Itinerary//EN"
+
+
+class InvalidCalendar(ValueError):
+    pass
+
+
+def unfold(lines):
+    """Join RFC 5545 continuation lines, yielding one logical line at a time."""
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line(line):
+    name_part, sep, value = line.partition(":")
+    if not sep:
+        raise InvalidCalendar(f"Malformed line: {line[:40]}")
+    name, *params = name_part.split(";")
+    return name.upper(), dict(p.partition("=")[::2] for p in params), value
+
+
+def unescape(value):
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def escape(value):
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def parse_datetime(value):
+    value = value.rstrip("Z")
+    try:
+        if "T" in value:
+            return datetime.strptime(value, "%Y%m%dT%H%M%S")
+        return datetime.strptime(value, "%Y%m%d")
+    except ValueError:
+        raise InvalidCalendar(f"Invalid date: {value}")
+
+
+def parse_duration(value):
+    match = DURATION_PATTERN.match(value)
+    if not match:
+        raise InvalidCalendar(f"Invalid duration: {value}")
+    parts = {k: int(v) for k, v in match.groupdict().items() if v and k != "sign"}
+    duration = timedelta(**parts)
+    return -duration if match.group("sign") == "-" else duration
+
+
+def parse_events(lines):
+    """Yield each VEVENT as an itinerary item dict ready for build_item().
+
+    Events that cannot be parsed are yielded as an InvalidCalendar instance
+    instead, so the caller can report them by position and carry on.
+    """
+    event = None
+    nested = 0
+    for line in unfold(lines):
+        try:
+            name, params, value = parse_line(line)
+        except InvalidCalendar as e:
+            if event is not None:
+                event = e
+            continue
+        value_upper = value.upper()
+        if event is None:
+            if name == "BEGIN" and value_upper == "VEVENT":
+                event = {}
+                nested = 0
+        elif name == "BEGIN":
+            # Skip VALARM and other components inside the event
+            nested += 1
+        elif name == "END" and nested:
+            nested -= 1
+        elif name == "END" and value_upper == "VEVENT":
+            yield event if isinstance(event, InvalidCalendar) else _to_item(event)
+            event = None
+        elif isinstance(event, dict) and not nested:
+            event[name] = value
+
+
+def _to_item(event):
+    try:
+        start = parse_datetime(event["DTSTART"])
+        if "DTEND" in event:
+            end = parse_datetime(event["DTEND"])
+        elif "DURATION" in event:
+            end = start + parse_duration(event["DURATION"])
+        else:
+            end = start
+    except KeyError:
+        return InvalidCalendar("Event has no DTSTART")
+    except InvalidCalendar as e:
+        return e
+    item = {
+        "activity": unescape(event.get("SUMMARY", "")),
+        "location": unescape(event.get("LOCATION", "")) or "Unknown",
+        "time": start,
+        "end": end,
+        "notes": unescape(event.get("DESCRIPTION", "")) or None,
+        "uid": event.get("UID"),
+    }
+    if "GEO" in event:
+        item["latitude"], _, item["longitude"] = event["GEO"].partition(";")
+    return item
+
+
+def fold(line):
+    # Content lines are limited to 75 octets; continuations start with a space
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Never split inside a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def calendar_header(name):
+    return "".join(
+        fold(line)
+        for line in (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODID}",
+            f"X-WR-CALNAME:{escape(name)}",
+        )
+    )
+
+
+def calendar_footer():
+    return "END:VCALENDAR\r\n"
+
+
+def format_event(uid, start, end, summary, location, description=None, geo=None, stamp=None):
+    stamp = stamp or datetime.utcnow()
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{start.strftime('%Y%m%dT%H%M%S')}",
+        f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}",
+        f"SUMMARY:{escape(summary)}",
+        f"LOCATION:{escape(location)}",
+    ]
+    if description:
+        lines.append(f"DESCRIPTION:{escape(description)}")
+    if geo:
+        lines.append(f"GEO:{geo[0]};{geo[1]}")
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
@@ -0,0 +1,161 @@
+# Indexes.py
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+from backend.models import mongo
+from backend.store import store
+from backend.schedule import ITEM_ORDER, conflicts_query, items_query, nearby_pipeline, next_placed_query
+
+# Every index the app relies on, applied idempotently by ensure_indexes() at
+# startup and by `flask ensure-indexes`. Unique indexes back the places where
+# the code assumes uniqueness.
+INDEXES = [
+    ("users", [("username", ASCENDING)], {"name": "username_unique", "unique": True}),
+    ("users", [("profile.trips.trip_id", ASCENDING)], {"name": "profile_trips_trip_id"}),
+    ("itineraries", [("invite_code", ASCENDING)], {"name": "invite_code_unique", "unique": True}),
+    ("itineraries", [("trip_name", ASCENDING)], {"name": "trip_name_unique", "unique": True}),
+    (
+        "messages",
+        [("chatroom_id", ASCENDING), ("seq", ASCENDING)],
+        {"name": "chatroom_seq_unique", "unique": True, "partialFilterExpression": {"seq": {"$exists": True}}},
+    ),
+    (
+        "expenses",
+        [("trip_id", ASCENDING), ("created_at", ASCENDING), ("payer_id", ASCENDING)],
+        {"name": "trip_time_payer"},
+    ),
+    (
+        "itinerary_items",
+        [("trip_id", ASCENDING), ("day", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)],
+        {"name": "trip_day_time"},
+    ),
+    (
+        "itinerary_items",
+        [("trip_id", ASCENDING), ("uid", ASCENDING)],
+        {"name": "trip_uid_unique", "unique": True, "partialFilterExpression": {"uid": {"$exists": True}}},
+    ),
+    (
+        "itinerary_items",
+        [("trip_id", ASCENDING), ("point", GEOSPHERE)],
+        {"name": "trip_point"},
+    ),
+]
+
+# The query shapes the blueprints issue, with sample values. `flask
+# audit-queries` explains each of them and fails if any needs a COLLSCAN.
+# update_expenses filters on {_id, budget.user_id}; the _id index already
+# narrows that to one document, so budget.user_id needs no index of its own.
+# The itinerary item shapes come from the builders the repository queries
+# with, sorted by ITEM_ORDER, so they cannot drift from the real queries.
+QUERY_SHAPES = [
+    ("auth: user by username", "users", {"username": "sample"}, None),
+    ("users: users by ids", "users", {"_id": {"$in": [ObjectId()]}}, None),
+    ("memberships: add ref", "users", {"_id": ObjectId(), "profile.trips.trip_id": {"$ne": ObjectId()}}, None),
+    ("views: trip by id", "itineraries", {"_id": ObjectId()}, None),
+    ("memberships: trips by ids", "itineraries", {"_id": {"$in": [ObjectId()]}}, None),
+    ("itinerary: join by invite code", "itineraries", {"invite_code": "ABC123"}, None),
+    ("itinerary: trip by name", "itineraries", {"trip_name": "sample"}, None),
+    ("budget: update member budget", "itineraries", {"_id": ObjectId(), "budget.user_id": ObjectId()}, None),
+    ("chat: latest messages", "messages", {"chatroom_id": ObjectId()}, [("seq", -1)]),
+    ("chat: messages after cursor", "messages", {"chatroom_id": ObjectId(), "seq": {"$gt": 0}}, [("seq", 1)]),
+    ("ledger: expenses page", "expenses", {"trip_id": ObjectId()}, [("created_at", 1), ("_id", 1)]),
+    ("schedule: items in a range", "itinerary_items", items_query(ObjectId(), datetime(2024, 5, 1), datetime(2024, 5, 2)), ITEM_ORDER),
+    ("schedule: re-imported item by uid", "itinerary_items", {"trip_id": ObjectId(), "uid": "sample@example.com"}, None),
+    ("settle: running balances", "balances", {"_id": ObjectId()}, None),
+    ("ledger: expenses by payer", "expenses", {"trip_id": ObjectId(), "payer_id": ObjectId()}, [("created_at", 1), ("_id", 1)]),
+    ("users: ids by usernames", "users", {"username": {"$in": ["sample"]}}, None),
+    ("schedule: next placed item", "itinerary_items", next_placed_query(ObjectId(), datetime(2024, 5, 1)), ITEM_ORDER),
+    ("schedule: conflicting items", "itinerary_items", conflicts_query(ObjectId(), datetime(2024, 5, 1), datetime(2024, 5, 1, 2), timedelta(days=1), ObjectId()), ITEM_ORDER),
+    ("schedule: conflicting items, uncounted trip", "itinerary_items", conflicts_query(ObjectId(), datetime(2024, 5, 1), datetime(2024, 5, 1, 2)), ITEM_ORDER),
+    ("events: logs past a seq", "trip_events", {"$or": [{"_id": ObjectId(), "seq": {"$gt": 0}}]}, None),
+]
+
+# aggregate() shapes, as (name, collection, pipeline)
+AGGREGATE_SHAPES = [
+    ("schedule: nearest items", "itinerary_items", nearby_pipeline(ObjectId(), 48.8584, 2.2945, 5000, exclude=ObjectId())),
+]
+
+# distinct() shapes, as (name, collection, key, query)
+DISTINCT_SHAPES = [
+    ("schedule: trip days", "itinerary_items", "day", {"trip_id": ObjectId()}),
+]
+
+
+class IndexBuildError(Exception):
+    """Some registered indexes could not be created; the others were."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__("; ".join(f"{name}: {error}" for name, error in failures))
+
+
+def ensure_indexes(db=None):
+    """Create every registered index and return their names.
+
+    An index the server refuses, e.g. a unique index over existing
+    duplicates, does not stop the others; IndexBuildError lists the refused
+    ones once the rest are in place.
+    """
+    db = db if db is not None else store.db
+    created = []
+    failures = []
+    for collection, keys, options in INDEXES:
+        try:
+            created.append(db[collection].create_index(keys, **options))
+        except OperationFailure as e:
+            failures.append((options["name"], e))
+    if failures:
+        raise IndexBuildError(failures)
+    return created
+
+
+def plan_stages(plan):
+    # Walk a winningPlan tree and yield every stage name in it
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if "stage" in node:
+            yield node["stage"]
+        for key in ("inputStage", "queryPlan"):
+            if key in node:
+                stack.append(node[key])
+        stack.extend(node.get("inputStages", []))
+
+
+def query_planner(explain):
+    # Aggregate explains put the planner of a pushed-down first stage, like
+    # $geoNear, under that stage instead of at the top
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]
+    for stage in explain.get("stages", []):
+        for value in stage.values():
+            if isinstance(value, dict) and "queryPlanner" in value:
+                return value["queryPlanner"]
+    raise KeyError("queryPlanner")
+
+
+def audit_queries(db=None):
+    """Explain every registered query shape.
+
+    Returns (name, stages, ok) tuples. A shape fails when its winning plan
+    contains a COLLSCAN, or when the collection does not exist yet (EOF),
+    since then nothing was actually checked.
+    """
+    db = db if db is not None else mongo.db
+    explained = []
+    for name, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained.append((name, cursor.explain()))
+    for name, collection, key, query in DISTINCT_SHAPES:
+        explained.append((name, db.command("explain", {"distinct": collection, "key": key, "query": query})))
+    for name, collection, pipeline in AGGREGATE_SHAPES:
+        explained.append((name, db.command("aggregate", collection, pipeline=pipeline, explain=True)))
+    results = []
+    for name, explain in explained:
+        stages = list(plan_stages(query_planner(explain)["winningPlan"]))
+        ok = "COLLSCAN" not in stages and stages != ["EOF"]
+        results.append((name, stages, ok))
+    return results
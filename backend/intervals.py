@@ -0,0 +1,25 @@
+# Intervals.py
+import heapq
+
+# Overlap detection for half-open [start, end) intervals. Intervals that only
+# touch (one ends when the next starts) do not overlap, and zero-length
+# intervals never do.
+
+
+def find_overlaps(intervals):
+    """Yield (a, b) key pairs of every overlapping pair of intervals.
+
+    ``intervals`` are (start, end, key) tuples in any order. A sort followed
+    by one sweep that keeps the intervals still open in a heap by end time:
+    O(n log n + k) for k overlapping pairs, instead of comparing every pair.
+    """
+    active = []
+    for start, end, key in sorted(intervals, key=lambda interval: interval[:2]):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        if end <= start:
+            continue
+        for _, other in active:
+            yield other, key
+        heapq.heappush(active, (end, key))
+
@@ -1,99 +1,245 @@
 # Itinerary.py
-from flask import Blueprint, request, jsonify, redirect, url_for, flash
-from backend.models import mongo
+from flask import Blueprint, Response, request, jsonify, redirect, url_for, flash, stream_with_context
 from backend.auth import token_required
-from datetime import datetime
-from bson.objectid import ObjectId
-import uuid
-import random
-import string
+from backend.events import publish
+from backend.repositories import itinerary_items, trips, users
+from backend.routing import order_stops
+from backend.schedule import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidItem,
+    build_item,
+    coordinates,
+    export_csv,
+    export_ics,
+    find_conflicts,
+    group_by_day,
+    items_query,
+    parse_time,
+    read_csv,
+    read_ics,
+    serialize_item,
+)
+from datetime import timedelta
+from bson.errors import InvalidId
+import csv
 
 itinerary_bp = Blueprint("itinerary", __name__)
 
+MAX_INVITES = 500
+
 
 @itinerary_bp.route("/<trip_id>/items", methods=["POST"])
 @token_required
 def add_itinerary_item(current_user, trip_id):
-    data = request.form
-    activity = data.get("activity")
-    location = data.get("location")
-    time = data.get("time")
-    notes = data.get("notes")
-    if not activity or not location or not time:
-        return jsonify({"error": "Invalid input"}), 400
-    item = {
-        "activity": activity,
-        "location": location,
-        "time": datetime.fromisoformat(time),
-        "notes": notes,
-    }
-    itinerary = mongo.db.itineraries.find_one({"_id": ObjectId(trip_id)})
-    if not itinerary:
+    # The trip page posts a form; API clients may post JSON and get the
+    # item and its conflicts back instead of a redirect
+    data = request.get_json(silent=True) if request.is_json else request.form
+    try:
+        item = build_item(trip_id, data)
+    except InvalidItem as e:
+        return jsonify({"error": str(e)}), 400
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    if not trips.exists(item["trip_id"]):
         return jsonify({"error": "Trip not found"}), 404
 
-    mongo.db.itineraries.update_one(
-        {"_id": ObjectId(trip_id)}, {"$push": {"itinerary": item}}, upsert=True
+    conflicts = itinerary_items.conflicts_for(item)
+    itinerary_items.add(item)
+    publish(trip_id, "itinerary", serialize_item(item))
+
+    if request.is_json:
+        return (
+            jsonify(
+                {
+                    "item": serialize_item(item),
+                    "conflicts": [serialize_item(other) for other in conflicts],
+                }
+            ),
+            201,
+        )
+    if conflicts:
+        names = ", ".join(other["activity"] for other in conflicts)
+        flash(f"{item['activity']} overlaps with {names}", "warning")
+    return redirect(url_for("itinerary", trip_id=trip_id, day=item["day"]))
+
+
+@itinerary_bp.route("/<trip_id>/items", methods=["GET"])
+@token_required
+def get_itinerary_items(current_user, trip_id):
+    # ?from=2024-05-01&to=2024-05-02 (to is exclusive), or ?day=2024-05-01
+    day = request.args.get("day")
+    try:
+        if day:
+            start = parse_time(day)
+            end = start + timedelta(days=1)
+        else:
+            start = request.args.get("from")
+            end = request.args.get("to")
+            start = parse_time(start) if start else None
+            end = parse_time(end) if end else None
+        limit = max(1, min(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+        query = items_query(trip_id, start, end, after=request.args.get("after"))
+    except (InvalidItem, InvalidId, ValueError):
+        return jsonify({"error": "Invalid query"}), 400
+    items, next_cursor = itinerary_items.page(query, limit)
+    days = [
+        {"day": group["day"], "items": [serialize_item(item) for item in group["items"]]}
+        for group in group_by_day(items)
+    ]
+    return jsonify({"days": days, "next": next_cursor}), 200
+
+
+@itinerary_bp.route("/<trip_id>/conflicts", methods=["GET"])
+@token_required
+def get_conflicts(current_user, trip_id):
+    # Overlapping pairs in ?from=&to= (the whole trip by default), found with
+    # one sweep over the items in time order
+    try:
+        start = request.args.get("from")
+        end = request.args.get("to")
+        query = items_query(
+            trip_id, parse_time(start) if start else None, parse_time(end) if end else None
+        )
+    except (InvalidItem, InvalidId):
+        return jsonify({"error": "Invalid query"}), 400
+    items = itinerary_items.iterate(query)
+    return (
+        jsonify(
+            {
+                "conflicts": [
+                    [serialize_item(a), serialize_item(b)] for a, b in find_conflicts(items)
+                ]
+            }
+        ),
+        200,
     )
-    return redirect(url_for("itinerary", trip_id=trip_id))
 
 
-def generate_invite_code():
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
+@itinerary_bp.route("/<trip_id>/optimize", methods=["GET"])
+@token_required
+def optimize_day(current_user, trip_id):
+    # Suggests a visiting order for one day; nothing is rewritten. The
+    # day's first stop stays first, stops without coordinates are left out
+    day = request.args.get("day")
+    try:
+        parse_time(day or "")
+        items = itinerary_items.on_day(trip_id, day)
+    except (InvalidItem, InvalidId):
+        return jsonify({"error": "Pass ?day=YYYY-MM-DD"}), 400
+    placed = [item for item in items if coordinates(item)]
+    unplaced = [item for item in items if not coordinates(item)]
+
+    distance = original = 0.0
+    if len(placed) > 1:
+        lat, lng = zip(*(coordinates(item) for item in placed))
+        order, distance, original = order_stops(lat, lng)
+        placed = [placed[i] for i in order]
+    return (
+        jsonify(
+            {
+                "day": day,
+                "stops": [serialize_item(item) for item in placed],
+                "unplaced": [serialize_item(item) for item in unplaced],
+                "distance_km": round(distance, 3),
+                "original_km": round(original, 3),
+            }
+        ),
+        200,
+    )
+
 
+def _import_format(upload):
+    # ?format= wins, then the file extension, then the content type
+    name = (upload.filename or "") if upload else ""
+    content_type = upload.mimetype if upload else request.mimetype
+    requested = request.args.get("format")
+    if requested:
+        return requested
+    if name.lower().endswith(".ics") or content_type == "text/calendar":
+        return "ics"
+    if name.lower().endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    return None
 
-@itinerary_bp.route("/new", methods=["POST"])
+
+def _until_unreadable(entries, failure):
+    # Stops at bytes that are not UTF-8 or a malformed CSV line; the entries
+    # read before it are still imported
+    try:
+        yield from entries
+    except (UnicodeDecodeError, csv.Error) as e:
+        failure.append(f"Could not read the file: {e}")
+
+
+@itinerary_bp.route("/<trip_id>/import", methods=["POST"])
 @token_required
-def create_itinerary(current_user):
-    trip_name = request.form.get("trip_name")
-    temp_users = [current_user]
+def import_itinerary(current_user, trip_id):
+    # Accepts a multipart upload ("file") or the raw file as the body
+    try:
+        if not trips.exists(trip_id):
+            return jsonify({"error": "Trip not found"}), 404
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    upload = request.files.get("file")
+    import_format = _import_format(upload)
+    if import_format not in ("ics", "csv"):
+        return jsonify({"error": "Upload an .ics or .csv file"}), 400
+    stream = upload.stream if upload else request.stream
+    entries = read_ics(stream) if import_format == "ics" else read_csv(stream)
 
-    user_ids = []
+    failure = []
+    written, errors = itinerary_items.import_items(trip_id, _until_unreadable(entries, failure))
+    if written:
+        publish(trip_id, "itinerary", {"imported": written})
+    if failure:
+        return jsonify({"error": failure[0], "imported": written, "errors": errors}), 400
+    return jsonify({"imported": written, "errors": errors}), 201 if written else 400
 
-    for user in temp_users:
-        existing_user = mongo.db.users.find_one({"username": user["username"]})
-        user_ids.append(existing_user["_id"])
 
+@itinerary_bp.route("/<trip_id>/export", methods=["GET"])
+@token_required
+def export_itinerary(current_user, trip_id):
+    export_format = request.args.get("format", "ics")
+    if export_format not in ("ics", "csv"):
+        return jsonify({"error": "Unknown format"}), 400
+    try:
+        trip = trips.get(trip_id, {"trip_name": 1})
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    if not trip:
+        return jsonify({"error": "Trip not found"}), 404
+    items = itinerary_items.iterate(items_query(trip_id))
+    if export_format == "ics":
+        body, mimetype = export_ics(items, trip["trip_name"]), "text/calendar"
+    else:
+        body, mimetype = export_csv(items), "text/csv"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=itinerary-{trip_id}.{export_format}"
+        },
+    )
+
+
+@itinerary_bp.route("/new", methods=["POST"])
+@token_required
+def create_itinerary(current_user):
+    trip_name = request.form.get("trip_name")
     if not trip_name:
         return jsonify({"error": "Invalid input"}), 400
 
-    existing_itinerary = mongo.db.itineraries.find_one({"trip_name": trip_name})
-    if existing_itinerary:
+    try:
+        trip_id, created = trips.create(trip_name, current_user["_id"])
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 500
+    if not created:
         flash("Trip already exists!", "warning")
-        return redirect(url_for("trip_detail", trip_id=existing_itinerary["_id"]))
-
-    # Create chatroom
-    chatroom_id = mongo.db.chatrooms.insert_one({"chat_logs": []}).inserted_id
-    budget = [
-        {
-            "user_id": user_id,
-            "flight": 0,
-            "hotel": 0,
-            "food": 0,
-            "transport": 0,
-            "activities": 0,
-            "spending": 0,
-        }
-        for user_id in user_ids
-    ]
-    invite_code = generate_invite_code()
-    itinerary = {
-        "trip_name": trip_name,
-        "users": [ObjectId(user_id) for user_id in user_ids],
-        "chatroom_id": chatroom_id,
-        "itinerary": [],
-        "budget": budget,
-        "invite_code": invite_code,
-    }
-
-    itinerary_id = mongo.db.itineraries.insert_one(itinerary).inserted_id
-
-    # Update each user with the new itinerary
-    for user_id in user_ids:
-        mongo.db.users.update_one(
-            {"_id": ObjectId(user_id)}, {"$push": {"profile.past_trips": itinerary}}
-        )
+        return redirect(url_for("trip_detail", trip_id=trip_id))
+
     flash("Trip created successfully!", "success")
-    return redirect(url_for("trip_detail", trip_id=itinerary_id))
+    return redirect(url_for("trip_detail", trip_id=trip_id))
 
 
 @itinerary_bp.route("/join/", methods=["POST"])
@@ -105,35 +251,53 @@ def join_itinerary_by_invite(current_user):
         flash("Please log in to join the itinerary.", "warning")
         return redirect(url_for("auth.login", next=request.url))
 
-    itinerary = mongo.db.itineraries.find_one({"invite_code": invite_code})
+    back = request.referrer or url_for("mainpage", username=current_user["username"])
+    itinerary, joined = trips.join(invite_code, current_user["_id"])
     if not itinerary:
         flash("Invalid invite code", "danger")
-        return redirect(request.url)
-
-    if ObjectId(current_user["_id"]) not in itinerary["users"]:
-        # Update the itinerary with the new user
-        mongo.db.itineraries.update_one(
-            {"_id": itinerary["_id"]},
-            {"$push": {"users": ObjectId(current_user["_id"])}},
-        )
-        # Fetch the updated itinerary
-        updated_itinerary = mongo.db.itineraries.find_one({"_id": itinerary["_id"]})
+        return redirect(back)
+    if not joined:
+        flash("You are already part of this itinerary", "info")
+        return redirect(back)
 
-        # Add the updated itinerary to the new user's past trips
-        mongo.db.users.update_one(
-            {"_id": ObjectId(current_user["_id"])},
-            {"$push": {"profile.past_trips": updated_itinerary}},
-        )
+    flash("You have been added to the itinerary", "success")
+    return redirect(url_for("itinerary", trip_id=itinerary["_id"]))
 
-        # Update all existing users' past trips to include the new user
-        for user_id in itinerary["users"]:
-            mongo.db.users.update_one(
-                {"_id": user_id, "profile.past_trips._id": itinerary["_id"]},
-                {"$set": {"profile.past_trips.$": updated_itinerary}},
-            )
 
-        flash("You have been added to the itinerary", "success")
-        return redirect(url_for("itinerary", trip_id=itinerary["_id"]))
+@itinerary_bp.route("/<trip_id>/members", methods=["POST"])
+@token_required
+def invite_members(current_user, trip_id):
+    # {"usernames": [...]} or a comma separated "usernames" form field
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        usernames = data.get("usernames") if isinstance(data, dict) else None
     else:
-        flash("You are already part of this itinerary", "info")
-        return redirect(request.url)
+        usernames = [name.strip() for name in request.form.get("usernames", "").split(",")]
+    if not isinstance(usernames, list):
+        return jsonify({"error": "Expected a list of usernames"}), 400
+    usernames = [name for name in dict.fromkeys(usernames) if isinstance(name, str) and name]
+    if not usernames or len(usernames) > MAX_INVITES:
+        return jsonify({"error": f"Pass between 1 and {MAX_INVITES} usernames"}), 400
+
+    found_users = users.ids_for(usernames)
+    try:
+        trip, added = trips.add_members(trip_id, current_user["_id"], found_users)
+    except InvalidId:
+        return jsonify({"error": "Invalid trip id"}), 400
+    if trip is None:
+        return jsonify({"error": "Trip not found"}), 404
+
+    found = set(found_users.values())
+    added_names = [found_users[user_id] for user_id in added]
+    if added:
+        publish(trip_id, "members", {"added": added_names})
+    return (
+        jsonify(
+            {
+                "added": added_names,
+                "already_members": [name for name in usernames if name in found and name not in added_names],
+                "unknown": [name for name in usernames if name not in found],
+            }
+        ),
+        200,
+    )
@@ -0,0 +1,149 @@
+# Ledger.py
+import csv
+import io
+import json
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+
+# Append-only expense ledger. Each expense is its own document in the
+# expenses collection, indexed by (trip_id, created_at, payer_id), so a
+# trip's history can be paged, filtered and exported without loading it.
+
+INSERT_CHUNK = 1000
+EXPORT_BATCH = 1000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_FIELDS = ["_id", "created_at", "payer_id", "category", "amount", "description"]
+EXPENSE_ORDER = [("created_at", ASCENDING), ("_id", ASCENDING)]
+
+
+class InvalidExpense(ValueError):
+    pass
+
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        raise InvalidExpense(f"Invalid time: {value}")
+
+
+def build_expense(trip_id, data, default_payer, members=None):
+    """Validate one submitted expense and return the document to store.
+
+    With ``members`` (the trip's user ids), a payer outside the trip is refused.
+    """
+    if not isinstance(data, dict):
+        raise InvalidExpense("Expense must be an object")
+    category = data.get("category")
+    description = data.get("description")
+    if not category or not isinstance(category, str):
+        raise InvalidExpense("Missing category")
+    if not description or not isinstance(description, str):
+        raise InvalidExpense("Missing description")
+    try:
+        amount = float(data.get("amount"))
+    except (TypeError, ValueError):
+        raise InvalidExpense("Invalid amount")
+    if not amount > 0:
+        raise InvalidExpense("Amount must be positive")
+    try:
+        payer_id = ObjectId(data.get("payer_id") or default_payer)
+    except (InvalidId, TypeError):
+        raise InvalidExpense("Invalid payer_id")
+    if members is not None and payer_id not in members:
+        raise InvalidExpense("Payer is not a member of the trip")
+    created_at = data.get("created_at")
+    return {
+        "trip_id": ObjectId(trip_id),
+        "payer_id": payer_id,
+        "category": category,
+        "description": description,
+        "amount": round(amount, 2),
+        "created_at": _parse_time(created_at) if created_at else datetime.utcnow(),
+    }
+
+
+def encode_cursor(expense):
+    return f"{expense['created_at'].isoformat()}_{expense['_id']}"
+
+
+def decode_cursor(cursor):
+    created_at, _, expense_id = cursor.rpartition("_")
+    try:
+        return _parse_time(created_at), ObjectId(expense_id)
+    except (InvalidExpense, InvalidId):
+        raise InvalidExpense("Invalid cursor")
+
+
+def expense_query(trip_id, payer=None, category=None, since=None, until=None, after=None):
+    query = {"trip_id": ObjectId(trip_id)}
+    time_range = {}
+    if since:
+        time_range["$gte"] = _parse_time(since)
+    if until:
+        time_range["$lt"] = _parse_time(until)
+    if time_range:
+        query["created_at"] = time_range
+    if payer:
+        try:
+            query["payer_id"] = ObjectId(payer)
+        except InvalidId:
+            raise InvalidExpense("Invalid payer")
+    if category:
+        query["category"] = category
+    if after:
+        created_at, expense_id = decode_cursor(after)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": expense_id}},
+        ]
+    return query
+
+
+def serialize_expense(expense):
+    return {
+        "_id": str(expense["_id"]),
+        "trip_id": str(expense["trip_id"]),
+        "payer_id": str(expense["payer_id"]),
+        "category": expense["category"],
+        "description": expense["description"],
+        "amount": expense["amount"],
+        "created_at": expense["created_at"].isoformat(),
+    }
+
+
+def export_jsonl(expenses):
+    # One line per expense, written as the cursor is read
+    for expense in expenses:
+        yield json.dumps(serialize_expense(expense)) + "\n"
+
+
+def export_csv(expenses):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for expense in expenses:
+        writer.writerow(serialize_expense(expense))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(stream):
+    # Yields parsed lines of a JSON-lines body without reading it all first.
+    # Lines are decoded one at a time, so a line that is not UTF-8 raises
+    # UnicodeDecodeError after every line before it has been yielded.
+    for raw in stream:
+        line = raw.decode("utf-8").strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
@@ -0,0 +1,92 @@
+# Memberships.py
+import random
+import string
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from backend.store import store
+from backend.indexes import ensure_indexes
+
+# Users keep a compact reference per trip in profile.trips instead of a full
+# copy of the itinerary. trip_name is kept so the navigation bar can list
+# trips without another query; trips are never renamed.
+TRIP_PROJECTION = {"trip_name": 1, "users": 1}
+# Each member's planned spending, kept in the trip's budget array
+BUDGET_FIELDS = ["flight", "hotel", "food", "transport", "activities", "spending"]
+
+
+def membership_ref(trip_id, trip_name, role="member", joined_at=None):
+    return {
+        "trip_id": ObjectId(trip_id),
+        "trip_name": trip_name,
+        "role": role,
+        "joined_at": joined_at or datetime.utcnow(),
+    }
+
+
+def blank_budget(user_id):
+    return {"user_id": ObjectId(user_id), **{field: 0 for field in BUDGET_FIELDS}}
+
+
+def generate_invite_code():
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+def _refs_from_snapshots(user_id, snapshots, existing_ids):
+    refs = []
+    for snapshot in snapshots:
+        trip_id = snapshot.get("_id")
+        if trip_id is None or trip_id in existing_ids:
+            continue
+        existing_ids.add(trip_id)
+        members = snapshot.get("users", [])
+        role = "owner" if members and members[0] == user_id else "member"
+        # The snapshot does not record when the user joined, the trip's
+        # creation time is the closest thing we have
+        refs.append(
+            membership_ref(
+                trip_id,
+                snapshot.get("trip_name", ""),
+                role,
+                ObjectId(trip_id).generation_time.replace(tzinfo=None),
+            )
+        )
+    return refs
+
+
+def migrate_past_trips(batch_size=500):
+    """Convert embedded profile.past_trips snapshots into profile.trips refs.
+
+    Safe to run while the app is serving: new code only writes profile.trips,
+    refs that are already present are skipped, and each user is updated with
+    a conditional write so a rerun is a no-op.
+    """
+    ensure_indexes()
+    migrated = 0
+    batch = []
+    cursor = store.db.users.find(
+        {"profile.past_trips": {"$exists": True}},
+        {"profile.past_trips": 1, "profile.trips": 1},
+        batch_size=batch_size,
+    )
+    for user in cursor:
+        profile = user.get("profile", {})
+        existing_ids = {ref["trip_id"] for ref in profile.get("trips", [])}
+        refs = _refs_from_snapshots(
+            user["_id"], profile.get("past_trips", []), existing_ids
+        )
+        batch.append(
+            UpdateOne(
+                {"_id": user["_id"], "profile.past_trips": {"$exists": True}},
+                {
+                    "$push": {"profile.trips": {"$each": refs}},
+                    "$unset": {"profile.past_trips": ""},
+                },
+            )
+        )
+        if len(batch) >= batch_size:
+            migrated += store.db.users.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        migrated += store.db.users.bulk_write(batch, ordered=False).modified_count
+    return migrated
@@ -0,0 +1,128 @@
+# Metrics.py
+import bisect
+import threading
+from flask import Blueprint, Response
+
+# Exposes counters in the Prometheus text format. Modules register a
+# collector, a callable returning (name, type, help, labels, value) samples,
+# and /metrics renders every registered collector on each scrape. Counter
+# and Histogram keep one series per label values tuple and are collectors
+# themselves; a histogram sample's value is {"buckets", "sum", "count"}.
+
+metrics_bp = Blueprint("metrics", __name__)
+
+PREFIX = "tripplanner_"
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+    return collector
+
+
+def cache_collector(name, cache):
+    def collect():
+        stats = cache.stats()
+        labels = {"cache": name}
+        return [
+            ("cache_hits_total", "counter", "Cache lookups served from memory.", labels, stats["hits"]),
+            ("cache_misses_total", "counter", "Cache lookups that went to the backend.", labels, stats["misses"]),
+            ("cache_evictions_total", "counter", "Entries dropped to stay within the size bound.", labels, stats["evictions"]),
+            ("cache_entries", "gauge", "Entries currently cached.", labels, stats["size"]),
+        ]
+
+    return register_collector(collect)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def __call__(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            (self.name, "counter", self.help_text, dict(zip(self.label_names, labels)), value)
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def __call__(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        samples = []
+        for labels, counts, total in series:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                cumulative.append((bound, running))
+            value = {"buckets": cumulative, "sum": total, "count": running}
+            samples.append((self.name, "histogram", self.help_text, dict(zip(self.label_names, labels)), value))
+        return samples
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+def render():
+    families = {}
+    for collector in _collectors:
+        for name, kind, help_text, labels, value in collector():
+            family = families.setdefault(name, (kind, help_text, []))
+            family[2].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels, value in samples:
+            if kind != "histogram":
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+                continue
+            for bound, count in value["buckets"]:
+                le = "+Inf" if bound == float("inf") else format(bound, "g")
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(dict(labels, le=le))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
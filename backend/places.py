@@ -0,0 +1,413 @@
+# Places.py
+import json
+import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Blueprint, request, jsonify
+from backend.auth import token_required
+from backend.cache import TTLCache
+from backend.geo import GeoIndex
+from backend.clusters import MAX_CLUSTER_ZOOM, MIN_CLUSTER_ZOOM, build_levels, clusters_for
+from backend.metrics import cache_collector, register_collector
+
+# Server-side proxy for the Travel Advisor "list-in-boundary" endpoints. The
+# requested bounding box is snapped to slippy map tiles and every tile is
+# fetched and cached on its own, so people looking at the same city share
+# upstream calls. The RapidAPI key never leaves the server.
+
+places_bp = Blueprint("places", __name__)
+
+CATEGORIES = ("restaurants", "attractions", "hotels")
+DEFAULT_BASE_URL = "https://travel-advisor.p.rapidapi.com"
+MAX_ZOOM = 16
+MAX_TILES_PER_AXIS = 2
+# Upstream fetches one request can cause, per category
+MAX_TILES = MAX_TILES_PER_AXIS**2
+DEFAULT_DEADLINE = 3.0
+MAX_DEADLINE = 10.0
+# Only the fields the trip page reads are kept, which keeps cached tiles small
+PLACE_FIELDS = (
+    "location_id",
+    "name",
+    "web_url",
+    "price_level",
+    "rating",
+    "latitude",
+    "longitude",
+    "location_string",
+)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def tile_for(lat, lng, zoom):
+    # Standard web-mercator (slippy map) tile numbering
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2**zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x, y, zoom):
+    """Return (bl_latitude, tr_latitude, bl_longitude, tr_longitude)."""
+    n = 2**zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, north, west, east
+
+
+def tiles_for_bbox(bl_lat, tr_lat, bl_lng, tr_lng, max_zoom=MAX_ZOOM):
+    """Snap a bounding box to the tiles that cover it.
+
+    Picks the most detailed zoom at which the box spans at most
+    MAX_TILES_PER_AXIS tiles in each direction, so any viewport maps to a
+    handful of tiles that other viewports of the same area reuse. Large boxes
+    get coarse tiles rather than many tiles: the whole world is 2 x 2 tiles
+    at zoom 1.
+    """
+    zoom = min(max_zoom, MAX_ZOOM)
+    while zoom > 0:
+        x0, y0 = tile_for(tr_lat, bl_lng, zoom)
+        x1, y1 = tile_for(bl_lat, tr_lng, zoom)
+        if x1 - x0 < MAX_TILES_PER_AXIS and y1 - y0 < MAX_TILES_PER_AXIS:
+            break
+        zoom -= 1
+    x0, y0 = tile_for(tr_lat, bl_lng, zoom)
+    x1, y1 = tile_for(bl_lat, tr_lng, zoom)
+    return [(x, y, zoom) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def slim_place(place):
+    slim = {field: place[field] for field in PLACE_FIELDS if field in place}
+    try:
+        slim["photo"] = place["photo"]["images"]["small"]["url"]
+    except (KeyError, TypeError):
+        pass
+    return slim
+
+
+def _approximate_size(places):
+    return len(json.dumps(places))
+
+
+class PlacesClient:
+    def __init__(self):
+        self.base_url = DEFAULT_BASE_URL
+        self.api_key = None
+        self.timeout = 10
+        self.cache = TTLCache(
+            maxsize=5000,
+            ttl=3600,
+            maxweight=64 * 1024 * 1024,
+            weigh=_approximate_size,
+            on_remove=self._unindex_tile,
+        )
+        # Every cached place, for "near this stop" lookups; follows the cache
+        self.index = GeoIndex()
+        # Marker clusters per cached tile, built on first use
+        self.cluster_cache = TTLCache(maxsize=5000, ttl=24 * 3600)
+        self.session = self._new_session()
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Shared by all requests; tiles that miss a request's deadline keep
+        # loading here and land in the cache for the next request
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="places")
+
+    def _index_tile(self, key, places):
+        category = key[0]
+        for place in places:
+            try:
+                lat, lng = float(place["latitude"]), float(place["longitude"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.index.add(_index_key(category, place), lat, lng, dict(place, category=category))
+
+    def _unindex_tile(self, key, places):
+        for place in places:
+            self.index.remove(_index_key(key[0], place))
+        self.cluster_cache.invalidate(key)
+
+    def tile_levels(self, category, x, y, zoom):
+        places = self.fetch_tile(category, x, y, zoom)
+        key = (category, zoom, x, y)
+        levels = self.cluster_cache.get(key)
+        if levels is None:
+            levels = build_levels(places)
+            self.cluster_cache.set(key, levels)
+        return levels
+
+    def clusters_in_bbox(self, category, zoom, bl_lat, tr_lat, bl_lng, tr_lng):
+        """Return (clusters, places) to draw for a viewport at a map zoom."""
+        bbox = (bl_lat, tr_lat, bl_lng, tr_lng)
+        if zoom >= MAX_CLUSTER_ZOOM:
+            return [], self.places_in_bbox(category, *bbox)
+        zoom = max(zoom, MIN_CLUSTER_ZOOM)
+        # Tiles no finer than the map: a zoomed out viewport is a few coarse
+        # tiles, never the detailed tiles of everything it shows
+        levels = [
+            self.tile_levels(category, x, y, tile_zoom)
+            for x, y, tile_zoom in tiles_for_bbox(*bbox, max_zoom=zoom)
+        ]
+        return clusters_for(levels, zoom, bbox)
+
+    def nearby(self, lat, lng, radius_m, limit):
+        """Cached places around a point as (distance_m, place), nearest first."""
+        return self.index.nearest(lat, lng, limit, max_radius_m=radius_m)
+
+    def _new_session(self, pool_size=20):
+        # One pooled session per process keeps TLS connections to the API warm
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(CATEGORIES),
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504)),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def configure(self, base_url=None, api_key=None, ttl=None, max_entries=None, max_bytes=None, pool_size=None):
+        if base_url:
+            self.base_url = base_url.rstrip("/")
+        if api_key is not None:
+            self.api_key = api_key
+        if ttl is not None:
+            self.cache.ttl = ttl
+        if max_entries is not None:
+            self.cache.maxsize = max_entries
+        if max_bytes is not None:
+            self.cache.maxweight = max_bytes
+        if pool_size is not None:
+            self.session = self._new_session(pool_size)
+
+    def _fetch_upstream(self, category, x, y, zoom):
+        bl_lat, tr_lat, bl_lng, tr_lng = tile_bounds(x, y, zoom)
+        with self._lock:
+            self.upstream_calls += 1
+        try:
+            response = self.session.get(
+                f"{self.base_url}/{category}/list-in-boundary",
+                params={
+                    "bl_latitude": bl_lat,
+                    "tr_latitude": tr_lat,
+                    "bl_longitude": bl_lng,
+                    "tr_longitude": tr_lng,
+                },
+                headers={
+                    "x-rapidapi-key": self.api_key or "",
+                    "x-rapidapi-host": "travel-advisor.p.rapidapi.com",
+                },
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json().get("data") or []
+        except (requests.RequestException, ValueError) as e:
+            with self._lock:
+                self.upstream_errors += 1
+            raise UpstreamError(str(e)) from e
+        # Listings without a name are ads
+        return [slim_place(place) for place in data if place.get("name")]
+
+    def fetch_tile(self, category, x, y, zoom):
+        """Return the places of one tile, from the cache when possible.
+
+        Concurrent misses for the same tile are coalesced: the first caller
+        fetches upstream and the others wait for its result.
+        """
+        key = (category, zoom, x, y)
+        places = self.cache.get(key)
+        if places is not None:
+            return places
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return future.result(timeout=self.timeout * 2)
+            except FutureTimeout as e:
+                raise UpstreamError("Timed out waiting for an identical request") from e
+
+        try:
+            places = self._fetch_upstream(category, x, y, zoom)
+            self._index_tile(key, places)
+            self.cache.set(key, places)
+            future.set_result(places)
+            return places
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def places_in_bbox(self, category, bl_lat, tr_lat, bl_lng, tr_lng):
+        places = []
+        seen = set()
+        for x, y, zoom in tiles_for_bbox(bl_lat, tr_lat, bl_lng, tr_lng):
+            for place in self.fetch_tile(category, x, y, zoom):
+                key = place.get("location_id") or place.get("name")
+                if key in seen or not _inside(place, bl_lat, tr_lat, bl_lng, tr_lng):
+                    continue
+                seen.add(key)
+                places.append(place)
+        return places
+
+    def all_places_in_bbox(self, bl_lat, tr_lat, bl_lng, tr_lng, deadline=DEFAULT_DEADLINE):
+        """Fetch every category for a box concurrently, within ``deadline``.
+
+        Returns (places, missing): places are merged across categories and
+        deduplicated by location_id, each carrying the list of categories it
+        was found in; missing lists the categories that failed or did not
+        finish in time.
+        """
+        tiles = tiles_for_bbox(bl_lat, tr_lat, bl_lng, tr_lng)
+        futures = {
+            self.executor.submit(self.fetch_tile, category, x, y, zoom): category
+            for category in CATEGORIES
+            for x, y, zoom in tiles
+        }
+        done, not_done = wait(futures, timeout=deadline)
+
+        missing = {futures[future] for future in not_done}
+        missing.update(futures[future] for future in done if future.exception())
+
+        merged = {}
+        for future in done:
+            category = futures[future]
+            if category in missing:
+                continue
+            for place in future.result():
+                if not _inside(place, bl_lat, tr_lat, bl_lng, tr_lng):
+                    continue
+                key = place.get("location_id") or place.get("name")
+                entry = merged.get(key)
+                if entry is None:
+                    entry = merged[key] = dict(place, categories=[])
+                if category not in entry["categories"]:
+                    entry["categories"].append(category)
+        return list(merged.values()), [c for c in CATEGORIES if c in missing]
+
+    def collect(self):
+        return [
+            ("places_upstream_calls_total", "counter", "Requests sent to Travel Advisor.", {}, self.upstream_calls),
+            ("places_upstream_errors_total", "counter", "Failed Travel Advisor requests.", {}, self.upstream_errors),
+            ("places_coalesced_total", "counter", "Tile fetches that waited on an identical in-flight request.", {}, self.coalesced),
+            ("places_cache_bytes", "gauge", "Approximate size of the cached tiles.", {}, self.cache.weight),
+            ("places_indexed", "gauge", "Cached places in the geo index.", {}, len(self.index)),
+        ]
+
+
+def _index_key(category, place):
+    return category, place.get("location_id") or place.get("name")
+
+
+def _inside(place, bl_lat, tr_lat, bl_lng, tr_lng):
+    try:
+        lat = float(place["latitude"])
+        lng = float(place["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return bl_lat <= lat <= tr_lat and bl_lng <= lng <= tr_lng
+
+
+client = PlacesClient()
+cache_collector("places_tiles", client.cache)
+cache_collector("places_clusters", client.cluster_cache)
+register_collector(client.collect)
+
+
+def init_app(app):
+    client.configure(
+        base_url=app.config.get("TRAVEL_ADVISOR_URL", os.getenv("TRAVEL_ADVISOR_URL")),
+        api_key=app.config.get("RAPIDAPI_KEY", os.getenv("RAPIDAPI_KEY")),
+        ttl=float(app.config.get("PLACES_CACHE_TTL", os.getenv("PLACES_CACHE_TTL", "3600"))),
+        max_bytes=int(
+            app.config.get("PLACES_CACHE_BYTES", os.getenv("PLACES_CACHE_BYTES", str(64 * 1024 * 1024)))
+        ),
+    )
+
+
+def parse_bbox(args):
+    try:
+        bbox = tuple(
+            float(args[name])
+            for name in ("bl_latitude", "tr_latitude", "bl_longitude", "tr_longitude")
+        )
+    except (KeyError, ValueError):
+        return None
+    bl_lat, tr_lat, bl_lng, tr_lng = bbox
+    if bl_lat > tr_lat or bl_lng > tr_lng:
+        return None
+    return bbox
+
+
+@places_bp.route("/all", methods=["GET"])
+@token_required
+def list_all_places(current_user):
+    bbox = parse_bbox(request.args)
+    if bbox is None:
+        return jsonify({"error": "Invalid bounding box"}), 400
+    try:
+        deadline = min(float(request.args.get("deadline", DEFAULT_DEADLINE)), MAX_DEADLINE)
+    except ValueError:
+        deadline = DEFAULT_DEADLINE
+    places, missing = client.all_places_in_bbox(*bbox, deadline=deadline)
+    return (
+        jsonify({"data": places, "partial": bool(missing), "missing": missing}),
+        200,
+    )
+
+
+@places_bp.route("/<category>/clusters", methods=["GET"])
+@token_required
+def list_place_clusters(current_user, category):
+    # ?zoom= is the map's zoom; below MAX_CLUSTER_ZOOM nearby places come
+    # back merged into {latitude, longitude, count} clusters
+    if category not in CATEGORIES:
+        return jsonify({"error": "Unknown category"}), 404
+    bbox = parse_bbox(request.args)
+    if bbox is None:
+        return jsonify({"error": "Invalid bounding box"}), 400
+    try:
+        zoom = int(request.args["zoom"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Invalid zoom"}), 400
+    try:
+        clusters, places = client.clusters_in_bbox(category, zoom, *bbox)
+    except UpstreamError:
+        return jsonify({"error": "Places are unavailable right now"}), 502
+    return jsonify({"zoom": zoom, "clusters": clusters, "places": places}), 200
+
+
+@places_bp.route("/<category>", methods=["GET"])
+@token_required
+def list_places(current_user, category):
+    if category not in CATEGORIES:
+        return jsonify({"error": "Unknown category"}), 404
+    bbox = parse_bbox(request.args)
+    if bbox is None:
+        return jsonify({"error": "Invalid bounding box"}), 400
+    try:
+        places = client.places_in_bbox(category, *bbox)
+    except UpstreamError:
+        return jsonify({"error": "Places are unavailable right now"}), 502
+    return jsonify({"data": places}), 200
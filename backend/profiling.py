@@ -0,0 +1,136 @@
+# Profiling.py
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from backend.telemetry import log_event
+
+# On-demand profiling of selected views. A request is profiled when
+# PROFILE_SAMPLE_RATE picks it, or when it carries an X-Profile-Token header
+# minted by `flask profile-token` (signed with SECRET_KEY, so only
+# operators can turn it on). Each profiled request writes two files to
+# PROFILE_DIR, named <route>-<ms>ms-<time>-<pid>:
+#
+#   .pstats     cProfile output, for `python -m pstats` or snakeviz
+#   .collapsed  stacks sampled every PROFILE_INTERVAL seconds, one
+#               "frame;frame;frame count" line each, for flamegraph.pl
+#               or speedscope
+#
+# Only one request per process is profiled at a time. When profiling is off
+# the wrapper costs a settings lookup and a WSGI environ lookup (about 2us).
+
+HEADER = "X-Profile-Token"
+ENVIRON_KEY = "HTTP_X_PROFILE_TOKEN"
+TOKEN_SALT = "profile"
+settings = {
+    "sample_rate": 0.0,
+    "directory": "profiles",
+    "interval": 0.001,
+    "token_max_age": 3600,
+}
+_busy = threading.Lock()
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=TOKEN_SALT)
+
+
+def make_token():
+    return _serializer().dumps("profile")
+
+
+def _wanted():
+    rate = settings["sample_rate"]
+    if rate > 0 and random.random() < rate:
+        return True
+    token = request.environ.get(ENVIRON_KEY)
+    if token is None:
+        return False
+    try:
+        _serializer().loads(token, max_age=settings["token_max_age"])
+    except BadSignature:
+        return False
+    return True
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack, below ``root``, until stopped."""
+
+    def __init__(self, thread_id, root, interval):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _write(route, elapsed, profile, stacks):
+    directory = settings["directory"]
+    os.makedirs(directory, exist_ok=True)
+    name = f"{re.sub(r'[^A-Za-z0-9_.]', '_', route)}-{elapsed * 1000:.0f}ms-{int(time.time())}-{os.getpid()}"
+    base = os.path.join(directory, name)
+    profile.dump_stats(base + ".pstats")
+    with open(base + ".collapsed", "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{route};{stack} {count}\n")
+    return base
+
+
+def profiled(view):
+    """Profile this view when sampled or asked to by a signed header."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _wanted() or not _busy.acquire(blocking=False):
+            return view(*args, **kwargs)
+        try:
+            sampler = StackSampler(threading.get_ident(), sys._getframe(), settings["interval"])
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            sampler.start()
+            profile.enable()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                profile.disable()
+                sampler.stop()
+                elapsed = time.perf_counter() - started
+                base = _write(request.endpoint or view.__name__, elapsed, profile, sampler.stacks)
+                log_event(
+                    "profile", sample_rate=1, endpoint=request.endpoint, ms=round(elapsed * 1000, 1), path=base
+                )
+        finally:
+            _busy.release()
+
+    return wrapper
+
+
+def init_app(app):
+    settings.update(
+        sample_rate=float(app.config.get("PROFILE_SAMPLE_RATE", os.getenv("PROFILE_SAMPLE_RATE", "0"))),
+        directory=app.config.get("PROFILE_DIR", os.getenv("PROFILE_DIR", "profiles")),
+        interval=float(app.config.get("PROFILE_INTERVAL", os.getenv("PROFILE_INTERVAL", "0.001"))),
+    )
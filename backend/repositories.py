@@ -0,0 +1,836 @@
+# Repositories.py
+import copy
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from flask import g, has_app_context
+from pymongo import ASCENDING, DESCENDING, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from backend.cache import TTLCache
+from backend.indexes import INDEXES
+from backend.metrics import cache_collector
+from backend.models import mongo
+from backend.store import store
+from backend.telemetry import command_metrics
+from backend.ledger import EXPENSE_ORDER, EXPORT_BATCH as EXPENSE_EXPORT_BATCH, INSERT_CHUNK
+from backend.ledger import encode_cursor as expense_cursor
+from backend.memberships import (
+    BUDGET_FIELDS,
+    TRIP_PROJECTION,
+    blank_budget,
+    generate_invite_code,
+    membership_ref,
+)
+from backend.schedule import (
+    EXPORT_BATCH as ITEM_EXPORT_BATCH,
+    IMPORT_CHUNK,
+    ITEM_ORDER,
+    MAX_PAGE_SIZE,
+    InvalidItem,
+    build_item,
+    conflicts_query,
+    item_end,
+    item_seconds,
+    items_query,
+    nearby_pipeline,
+    next_placed_query,
+)
+from backend.schedule import encode_cursor as item_cursor
+from backend.settle import net_balances, simplify_debts, to_cents
+
+# Every read and write of the app's data goes through the repositories
+# below: users, trips, chats, itinerary_items and budgets. They decide the
+# projections, batch the writes and own the caches, so query shapes can be
+# changed here without touching the views. They sit on backend.store, which
+# is MongoDB or, with DATA_BACKEND=memory, an in-process database with the
+# same semantics for tests and benchmarks. Aggregates are written once, as
+# pipelines, and run on both.
+
+# Fields the views need when rendering another member of a trip
+USER_PROJECTION = {"username": 1}
+# Resolved principals, keyed by username. Only the fields handlers and
+# templates read are loaded; the password hash never enters the cache.
+PRINCIPAL_PROJECTION = {"username": 1, "profile": 1}
+CREDENTIALS_PROJECTION = {"username": 1, "password": 1}
+INVITE_CODE_ATTEMPTS = 5
+# Events kept in each trip's log for streams that reconnect
+EVENT_HISTORY = 200
+# How long a chat page waits for a message whose number was taken first
+MESSAGE_GAP_SECONDS = 10
+
+# Invalidation only reaches this process's cache: another worker keeps its
+# copy of a changed user until AUTH_CACHE_TTL runs out, so keep that short.
+principal_cache = TTLCache(ttl=30)
+cache_collector("auth_principals", principal_cache)
+# A trip's chatroom never changes, so chat reads skip the trip lookup
+chatroom_cache = TTLCache(maxsize=4096, ttl=3600)
+cache_collector("chatrooms", chatroom_cache)
+# Settlements, keyed by (trip, balances version, member count)
+settle_cache = TTLCache(maxsize=1024, ttl=600)
+cache_collector("settle", settle_cache)
+
+
+class Repository:
+    collection_name = None
+
+    @property
+    def db(self):
+        return store.db
+
+    @property
+    def collection(self):
+        return store.db[self.collection_name]
+
+
+class UserRepository(Repository):
+    collection_name = "users"
+
+    def principal(self, username):
+        user = principal_cache.get(username)
+        if user is None:
+            user = self.collection.find_one({"username": username}, PRINCIPAL_PROJECTION)
+            if not user:
+                return user
+            principal_cache.set(username, user)
+        # Handlers get their own copy, so changing it cannot leak into the cache
+        return copy.deepcopy(user)
+
+    def invalidate(self, usernames=(), user_ids=()):
+        # Writes that change a user's document drop the cached copy
+        for username in usernames:
+            principal_cache.invalidate(username)
+        user_ids = set(user_ids)
+        if user_ids:
+            principal_cache.invalidate_where(lambda user: user["_id"] in user_ids)
+
+    def exists(self, username):
+        return self.collection.count_documents({"username": username}, limit=1) > 0
+
+    def credentials(self, username):
+        return self.collection.find_one({"username": username}, CREDENTIALS_PROJECTION)
+
+    def create(self, username, password_hash, email, name=""):
+        user_id = self.collection.insert_one(
+            {
+                "username": username,
+                "password": password_hash,
+                "email": email,
+                "profile": {"name": name, "trips": []},
+            }
+        ).inserted_id
+        self.invalidate(usernames=[username])
+        return user_id
+
+    def ids_for(self, usernames):
+        """Map the ids of the users with these names to their usernames."""
+        return {
+            user["_id"]: user["username"]
+            for user in self.collection.find({"username": {"$in": list(usernames)}}, USER_PROJECTION)
+        }
+
+    def _identity_map(self):
+        # One map per application context, i.e. per request
+        if not has_app_context():
+            return {}
+        if "user_directory" not in g:
+            g.user_directory = {}
+        return g.user_directory
+
+    def load_many(self, user_ids):
+        """Resolve many user ids with a single $in query.
+
+        Users already loaded during this request are served from the identity
+        map, so each user is fetched at most once per request. Returns a dict
+        keyed by ObjectId; unknown ids are left out.
+        """
+        identity_map = self._identity_map()
+        wanted = {ObjectId(user_id) for user_id in user_ids}
+        missing = [user_id for user_id in wanted if user_id not in identity_map]
+
+        if missing:
+            for user in self.collection.find({"_id": {"$in": missing}}, USER_PROJECTION):
+                identity_map[user["_id"]] = user
+            # Remember misses too so a dangling id is not looked up again
+            for user_id in missing:
+                identity_map.setdefault(user_id, None)
+
+        return {
+            user_id: identity_map[user_id]
+            for user_id in wanted
+            if identity_map[user_id] is not None
+        }
+
+    def usernames(self, user_ids, users=None):
+        # Keep the member order of the trip, skipping users that no longer exist
+        if users is None:
+            users = self.load_many(user_ids)
+        names = []
+        for user_id in user_ids:
+            user = users.get(ObjectId(user_id))
+            if user:
+                names.append(user["username"])
+        return names
+
+    def add_memberships(self, refs):
+        """Write (user_id, ref) pairs with one bulk_write, skipping duplicates."""
+        refs = list(refs)
+        operations = [
+            UpdateOne(
+                {"_id": ObjectId(user_id), "profile.trips.trip_id": {"$ne": ref["trip_id"]}},
+                {"$push": {"profile.trips": ref}},
+            )
+            for user_id, ref in refs
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            self.invalidate(user_ids=[ObjectId(user_id) for user_id, _ in refs])
+
+
+class TripRepository(Repository):
+    collection_name = "itineraries"
+
+    def get(self, trip_id, projection=None):
+        return self.collection.find_one({"_id": ObjectId(trip_id)}, projection)
+
+    def exists(self, trip_id):
+        return self.collection.count_documents({"_id": ObjectId(trip_id)}, limit=1) > 0
+
+    def by_name(self, trip_name, projection=None):
+        return self.collection.find_one({"trip_name": trip_name}, projection)
+
+    def revision(self, trip_id):
+        """The trip's revision, or None if it does not exist."""
+        trip = self.collection.find_one({"_id": ObjectId(trip_id)}, {"revision": 1})
+        return trip.get("revision", 0) if trip else None
+
+    def touch(self, trip_id, item_seconds=None):
+        # Called after a write to another collection has landed, see revisions.py.
+        # Item writes also pass the length of their longest item, see conflicts_for.
+        update = {"$inc": {"revision": 1}}
+        if item_seconds is not None:
+            update["$max"] = {"max_item_seconds": item_seconds}
+        self.collection.update_one({"_id": ObjectId(trip_id)}, update)
+
+    def chatroom_id(self, trip_id):
+        trip_id = ObjectId(trip_id)
+        chatroom_id = chatroom_cache.get(trip_id)
+        if chatroom_id is None:
+            trip = self.collection.find_one({"_id": trip_id}, {"chatroom_id": 1})
+            if not trip:
+                return None
+            chatroom_id = trip["chatroom_id"]
+            chatroom_cache.set(trip_id, chatroom_id)
+        return chatroom_id
+
+    def create(self, trip_name, owner_id, member_ids=()):
+        """Create a trip with its chatroom and a blank budget per member.
+
+        Returns (trip_id, created). When a trip of that name exists, its id
+        is returned with created False.
+        """
+        existing = self.by_name(trip_name, {"_id": 1})
+        if existing:
+            return existing["_id"], False
+        owner_id = ObjectId(owner_id)
+        user_ids = list(dict.fromkeys([owner_id, *(ObjectId(user_id) for user_id in member_ids)]))
+        chatroom_id = self.db.chatrooms.insert_one({"created_at": datetime.utcnow()}).inserted_id
+        trip = {
+            "trip_name": trip_name,
+            "users": user_ids,
+            "chatroom_id": chatroom_id,
+            "budget": [blank_budget(user_id) for user_id in user_ids],
+            "revision": 0,
+            "max_item_seconds": 0,
+            "item_spans_complete": True,
+        }
+
+        # trip_name and invite_code are unique indexes: retry on an invite
+        # code collision, and treat a name collision like an existing trip
+        for _ in range(INVITE_CODE_ATTEMPTS):
+            trip["invite_code"] = generate_invite_code()
+            trip.pop("_id", None)
+            try:
+                trip_id = self.collection.insert_one(trip).inserted_id
+                break
+            except DuplicateKeyError as e:
+                if "trip_name" in str(e):
+                    self.db.chatrooms.delete_one({"_id": chatroom_id})
+                    return self.by_name(trip_name, {"_id": 1})["_id"], False
+        else:
+            self.db.chatrooms.delete_one({"_id": chatroom_id})
+            raise RuntimeError("Could not generate an invite code")
+
+        users.add_memberships(
+            (user_id, membership_ref(trip_id, trip_name, "owner" if user_id == owner_id else "member"))
+            for user_id in user_ids
+        )
+        return trip_id, True
+
+    def join(self, invite_code, user_id):
+        """Add a user to the trip with this invite code.
+
+        The membership check and the write are one conditional update, so
+        concurrent joins cannot add the same user twice. Returns (trip, joined),
+        or (None, False) for an unknown code.
+        """
+        user_id = ObjectId(user_id)
+        trip = self.collection.find_one_and_update(
+            {"invite_code": invite_code, "users": {"$ne": user_id}},
+            {
+                "$addToSet": {"users": user_id},
+                "$push": {"budget": blank_budget(user_id)},
+                "$inc": {"revision": 1},
+            },
+            projection={"trip_name": 1},
+        )
+        if trip is None:
+            trip = self.collection.find_one({"invite_code": invite_code}, {"trip_name": 1})
+            return trip, False
+        users.add_memberships([(user_id, membership_ref(trip["_id"], trip["trip_name"]))])
+        return trip, True
+
+    def add_members(self, trip_id, inviter_id, user_ids, attempts=5):
+        """Add many users to a trip the inviter belongs to.
+
+        Returns (trip, added_ids), or (None, []) if the trip does not exist or
+        the inviter is not a member. The update is guarded on none of the new
+        users being members yet; if a concurrent join wins the race, the new
+        members are recomputed and the update retried.
+        """
+        trip_id = ObjectId(trip_id)
+        inviter_id = ObjectId(inviter_id)
+        wanted = list(dict.fromkeys(ObjectId(user_id) for user_id in user_ids))
+        for _ in range(attempts):
+            trip = self.collection.find_one(
+                {"_id": trip_id, "users": inviter_id}, {"trip_name": 1, "users": 1}
+            )
+            if trip is None:
+                return None, []
+            members = set(trip["users"])
+            added = [user_id for user_id in wanted if user_id not in members]
+            if not added:
+                return trip, []
+            result = self.collection.update_one(
+                {"_id": trip_id, "users": {"$nin": added}},
+                {
+                    "$push": {
+                        "users": {"$each": added},
+                        "budget": {"$each": [blank_budget(user_id) for user_id in added]},
+                    },
+                    "$inc": {"revision": 1},
+                },
+            )
+            if result.modified_count:
+                users.add_memberships(
+                    (user_id, membership_ref(trip_id, trip["trip_name"])) for user_id in added
+                )
+                return trip, added
+        raise RuntimeError("Trip membership kept changing, try again")
+
+    def for_user(self, user):
+        """Load the trips referenced by a user's membership index.
+
+        Returns itinerary documents (trip_name and users only) in the order the
+        user joined them.
+        """
+        refs = user.get("profile", {}).get("trips", [])
+        if not refs:
+            return []
+        trip_ids = [ref["trip_id"] for ref in refs]
+        trips = {
+            trip["_id"]: trip
+            for trip in self.collection.find({"_id": {"$in": trip_ids}}, TRIP_PROJECTION)
+        }
+        return [trips[trip_id] for trip_id in trip_ids if trip_id in trips]
+
+
+class ChatRepository(Repository):
+    # Messages are numbered per chatroom by a counter on the chatroom
+    # document, and the number is the paging cursor. A number is taken just
+    # before its message is inserted, so for a moment a later message can be
+    # visible while an earlier one is not; pages stop at such a gap until it
+    # fills, or until the message after it is MESSAGE_GAP_SECONDS old (the
+    # insert that took the number failed).
+    collection_name = "messages"
+
+    def page(self, chatroom_id, after=None, before=None, limit=50):
+        """Return one page of a chatroom's messages, oldest first.
+
+        ``after`` pages forward from a message seq (used when polling for new
+        messages), ``before`` pages back through history. Without a cursor the
+        most recent page is returned.
+        """
+        query = {"chatroom_id": ObjectId(chatroom_id)}
+        if after is not None:
+            query["seq"] = {"$gt": after}
+            cursor = self.collection.find(query).sort("seq", ASCENDING)
+            messages = _until_gap(list(cursor.limit(limit + 1)), after + 1)
+            has_more = len(messages) > limit
+            return messages[:limit], has_more
+
+        if before is not None:
+            query["seq"] = {"$lt": before}
+        cursor = self.collection.find(query).sort("seq", DESCENDING)
+        messages = list(cursor.limit(limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+        if before is None:
+            messages = _until_gap(messages)
+        return messages, has_more
+
+    def add(self, trip_id, message):
+        room = self.db.chatrooms.find_one_and_update(
+            {"_id": message["chatroom_id"]},
+            {"$inc": {"message_seq": 1}},
+            projection={"message_seq": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        message["seq"] = room["message_seq"]
+        message_id = self.collection.insert_one(message).inserted_id
+        trips.touch(trip_id)
+        return message_id
+
+    def number_messages(self, chatroom_id):
+        """Number a chatroom's messages that predate seq, below the numbered ones."""
+        chatroom_id = ObjectId(chatroom_id)
+        lowest = self.collection.find_one(
+            {"chatroom_id": chatroom_id, "seq": {"$exists": True}}, {"seq": 1}, sort=[("seq", ASCENDING)]
+        )
+        unnumbered = list(
+            self.collection.find({"chatroom_id": chatroom_id, "seq": {"$exists": False}}, {"_id": 1}).sort(
+                "_id", ASCENDING
+            )
+        )
+        if not unnumbered:
+            return 0
+        # The counter starts new messages at 1, so older ones end at 0
+        first = (lowest["seq"] if lowest else 1) - len(unnumbered)
+        self.collection.bulk_write(
+            [UpdateOne({"_id": message["_id"]}, {"$set": {"seq": first + i}}) for i, message in enumerate(unnumbered)],
+            ordered=False,
+        )
+        return len(unnumbered)
+
+
+def _until_gap(messages, expected=None):
+    # Messages in seq order, up to the first gap that may still fill
+    settled = datetime.utcnow() - timedelta(seconds=MESSAGE_GAP_SECONDS)
+    for i, message in enumerate(messages):
+        seq = message.get("seq")
+        if expected is not None and seq != expected and message["timestamp"] > settled:
+            return messages[:i]
+        expected = None if seq is None else seq + 1
+    return messages
+
+
+class EventRepository(Repository):
+    """Per-trip event logs shared by every worker, one document per trip.
+
+    Each append increments ``seq`` and pushes the event in one update, so a
+    log read at any moment holds events seq - len(events) + 1 .. seq with no
+    gaps, whichever worker wrote them.
+    """
+
+    collection_name = "trip_events"
+
+    def append(self, trip_id, kind, payload):
+        """Append an event; returns the log as of this write."""
+        return self.collection.find_one_and_update(
+            {"_id": ObjectId(trip_id)},
+            {
+                "$inc": {"seq": 1},
+                "$push": {"events": {"$each": [{"kind": kind, "data": payload}], "$slice": -EVENT_HISTORY}},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def log(self, trip_id):
+        return self.collection.find_one({"_id": ObjectId(trip_id)})
+
+    def changed(self, seen):
+        """Logs of the trips whose seq is past ``seen`` ({trip_id: seq})."""
+        if not seen:
+            return []
+        query = {"$or": [{"_id": ObjectId(trip_id), "seq": {"$gt": seq}} for trip_id, seq in seen.items()]}
+        return list(self.collection.find(query))
+
+
+class ItineraryItemRepository(Repository):
+    collection_name = "itinerary_items"
+
+    def page(self, query, limit):
+        """Return (items, next_cursor), in time order."""
+        items = list(self.collection.find(query).sort(ITEM_ORDER).limit(limit + 1))
+        next_cursor = item_cursor(items[limit - 1]) if len(items) > limit else None
+        return items[:limit], next_cursor
+
+    def on_day(self, trip_id, day, limit=MAX_PAGE_SIZE):
+        start = datetime.fromisoformat(day)
+        items, _ = self.page(items_query(trip_id, start, start + timedelta(days=1)), limit)
+        return items
+
+    def days(self, trip_id):
+        # Served from the index keys alone
+        return sorted(self.collection.distinct("day", {"trip_id": ObjectId(trip_id)}))
+
+    def get(self, trip_id, item_id):
+        return self.collection.find_one({"_id": ObjectId(item_id), "trip_id": ObjectId(trip_id)})
+
+    def next_placed(self, trip_id, after):
+        """The first item from ``after`` on whose place is known."""
+        return self.collection.find_one(next_placed_query(trip_id, after), sort=ITEM_ORDER)
+
+    def iterate(self, query):
+        # In time order, a cursor batch at a time, for conflicts and exports
+        return self.collection.find(query).sort(ITEM_ORDER).batch_size(ITEM_EXPORT_BATCH)
+
+    def add(self, item):
+        item_id = self.collection.insert_one(item).inserted_id
+        trips.touch(item["trip_id"], item_seconds(item))
+        return item_id
+
+    def _lookback(self, trip_id):
+        # Every item write $max-es its length into the trip's max_item_seconds.
+        # item_spans_complete says items stored before that are counted too;
+        # without it the whole trip has to be read.
+        trip = trips.get(trip_id, {"max_item_seconds": 1, "item_spans_complete": 1})
+        if not trip or not trip.get("item_spans_complete"):
+            return None
+        return timedelta(seconds=trip.get("max_item_seconds", 0))
+
+    def conflicts_for(self, item):
+        """Return the stored items of the trip that overlap ``item``.
+
+        Only items starting within the trip's longest item before it can reach
+        into it, so this is one bounded range scan of the (trip_id, day, time)
+        index.
+        """
+        start, end = item["time"], item_end(item)
+        if end <= start:
+            return []
+        query = conflicts_query(item["trip_id"], start, end, self._lookback(item["trip_id"]), item.get("_id"))
+        return list(self.collection.find(query).sort(ITEM_ORDER))
+
+    def _write_chunk(self, operations, positions, errors):
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            return result.inserted_count + result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                errors.append({"index": positions[error["index"]], "error": error["errmsg"]})
+            details = e.details
+            return details["nInserted"] + details["nUpserted"] + details["nModified"]
+
+    def import_items(self, trip_id, entries, chunk_size=IMPORT_CHUNK):
+        """Validate and store a stream of submitted items, one bulk_write per chunk.
+
+        ``entries`` may hold dicts or exceptions for entries the parser could
+        not read. Items with a uid are upserted on (trip_id, uid). Returns
+        (written, errors), errors being {"index", "error"} dicts.
+        """
+        written = 0
+        longest = 0
+        errors = []
+        operations = []
+        positions = []
+        try:
+            for index, entry in enumerate(entries):
+                try:
+                    if isinstance(entry, Exception):
+                        raise InvalidItem(str(entry))
+                    item = build_item(trip_id, entry)
+                except InvalidItem as e:
+                    errors.append({"index": index, "error": str(e)})
+                    continue
+                longest = max(longest, item_seconds(item))
+                if "uid" in item:
+                    operations.append(
+                        UpdateOne({"trip_id": item["trip_id"], "uid": item["uid"]}, {"$set": item}, upsert=True)
+                    )
+                else:
+                    operations.append(InsertOne(item))
+                positions.append(index)
+                if len(operations) >= chunk_size:
+                    written += self._write_chunk(operations, positions, errors)
+                    operations, positions = [], []
+            if operations:
+                written += self._write_chunk(operations, positions, errors)
+        finally:
+            # Chunks written before an unreadable entry stay written
+            if written:
+                trips.touch(trip_id, longest)
+        return written, errors
+
+    def count_spans(self):
+        """Record the longest item of each trip whose earlier items are not counted.
+
+        For trips from before max_item_seconds; item writes meanwhile count
+        their own items, so this can run while the app takes writes.
+        """
+        counted = 0
+        for trip in trips.collection.find({"item_spans_complete": {"$ne": True}}, {"_id": 1}):
+            longest = 0
+            for item in self.collection.find({"trip_id": trip["_id"]}, {"time": 1, "end": 1}):
+                longest = max(longest, item_seconds(item))
+            trips.collection.update_one(
+                {"_id": trip["_id"]},
+                {"$max": {"max_item_seconds": longest}, "$set": {"item_spans_complete": True}},
+            )
+            counted += 1
+        return counted
+
+    def nearby(self, trip_id, lat, lng, radius_m=None, limit=20, exclude=None):
+        """Items of a trip nearest to a point, via $geoNear.
+
+        Each returned item has a ``distance_m`` field.
+        """
+        pipeline = nearby_pipeline(trip_id, lat, lng, radius_m, limit, exclude)
+        return list(self.collection.aggregate(pipeline))
+
+
+def summary_pipeline(trip_ids):
+    # Per-member rows with their usernames and totals, then per-trip sums,
+    # all computed by the server in a single aggregate
+    member_total = {"$add": [{"$ifNull": [f"$budget.{field}", 0]} for field in BUDGET_FIELDS]}
+    return [
+        {"$match": {"_id": {"$in": trip_ids}}},
+        {"$project": {"trip_name": 1, "budget": 1}},
+        {"$unwind": "$budget"},
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "budget.user_id",
+                "foreignField": "_id",
+                "as": "member",
+            }
+        },
+        # Budgets of users that no longer exist are skipped
+        {"$match": {"member.0": {"$exists": True}}},
+        {
+            "$project": {
+                "trip_name": 1,
+                "row": {
+                    "user_id": "$budget.user_id",
+                    "username": {"$arrayElemAt": ["$member.username", 0]},
+                    **{field: {"$ifNull": [f"$budget.{field}", 0]} for field in BUDGET_FIELDS},
+                    "total": member_total,
+                },
+            }
+        },
+        {
+            "$group": {
+                "_id": "$_id",
+                "trip_name": {"$first": "$trip_name"},
+                "members": {"$push": "$row"},
+                **{field: {"$sum": f"$row.{field}"} for field in BUDGET_FIELDS},
+                "total": {"$sum": "$row.total"},
+                "member_count": {"$sum": 1},
+            }
+        },
+    ]
+
+
+def _finish_summary(doc):
+    count = doc.pop("member_count")
+    doc["categories"] = {field: doc.pop(field) for field in BUDGET_FIELDS}
+    doc["average"] = {
+        field: total / count for field, total in doc["categories"].items()
+    }
+    doc["average"]["total"] = doc["total"] / count
+    return doc
+
+
+def _empty_summary(trip):
+    # What _finish_summary gives a trip without member budgets
+    categories = {field: 0 for field in BUDGET_FIELDS}
+    return {
+        "_id": trip["_id"],
+        "trip_name": trip.get("trip_name"),
+        "members": [],
+        "total": 0,
+        "categories": categories,
+        "average": dict(categories, total=0),
+    }
+
+
+def _balances_pipeline():
+    return [
+        {
+            "$group": {
+                "_id": {"trip_id": "$trip_id", "payer_id": "$payer_id"},
+                "cents": {"$sum": {"$round": [{"$multiply": ["$amount", 100]}, 0]}},
+            }
+        },
+        {
+            "$group": {
+                "_id": "$_id.trip_id",
+                "paid": {"$push": {"k": {"$toString": "$_id.payer_id"}, "v": {"$toLong": "$cents"}}},
+                "total": {"$sum": {"$toLong": "$cents"}},
+            }
+        },
+    ]
+
+
+class BudgetRepository(Repository):
+    # Member budgets live on the trip document; the expense ledger and the
+    # running balances (see backend.settle) have collections of their own
+    collection_name = "expenses"
+
+    def summaries(self, trip_ids):
+        """Summarize the budgets of several trips, keyed by trip id.
+
+        Trips without any member budget are missing from the result.
+        """
+        trip_ids = [ObjectId(trip_id) for trip_id in trip_ids]
+
+        return {
+            doc["_id"]: _finish_summary(doc)
+            for doc in self.db.itineraries.aggregate(summary_pipeline(trip_ids))
+        }
+
+    def summary(self, trip_id):
+        """One trip's summary, empty when no member has a budget; None if there is no such trip."""
+        trip_id = ObjectId(trip_id)
+        summary = self.summaries([trip_id]).get(trip_id)
+        if summary is None:
+            trip = trips.get(trip_id, {"trip_name": 1})
+            if trip:
+                summary = _empty_summary(trip)
+        return summary
+
+    def set_member_budget(self, trip_id, user_id, budget):
+        """Overwrite one member's budget fields; False if they have none on this trip."""
+        user_id = ObjectId(user_id)
+        result = self.db.itineraries.update_one(
+            {"_id": ObjectId(trip_id), "budget.user_id": user_id},
+            {
+                "$set": {f"budget.$.{field}": value for field, value in budget.items()},
+                "$inc": {"revision": 1},
+            },
+        )
+        if result.matched_count:
+            users.invalidate(user_ids=[user_id])
+        return bool(result.matched_count)
+
+    def insert_expenses(self, docs):
+        """Insert validated expenses in unordered chunks.
+
+        Returns (inserted_docs, failures); a failure is (position, message) for
+        documents the server rejected.
+        """
+        inserted = []
+        failures = []
+        for start in range(0, len(docs), INSERT_CHUNK):
+            chunk = docs[start : start + INSERT_CHUNK]
+            try:
+                self.collection.insert_many(chunk, ordered=False)
+                inserted.extend(chunk)
+            except BulkWriteError as e:
+                failed = {error["index"] for error in e.details["writeErrors"]}
+                for error in e.details["writeErrors"]:
+                    failures.append((start + error["index"], error["errmsg"]))
+                inserted.extend(doc for i, doc in enumerate(chunk) if i not in failed)
+        return inserted, failures
+
+    def expenses(self, query, limit):
+        """Return (expenses, next_cursor), oldest first."""
+        expenses = list(self.collection.find(query).sort(EXPENSE_ORDER).limit(limit + 1))
+        next_cursor = expense_cursor(expenses[limit - 1]) if len(expenses) > limit else None
+        return expenses[:limit], next_cursor
+
+    def iterate_expenses(self, query):
+        # Only the current cursor batch is held in memory
+        return self.collection.find(query).sort(EXPENSE_ORDER).batch_size(EXPENSE_EXPORT_BATCH)
+
+    def record_expenses(self, trip_id, expenses):
+        """Add freshly inserted expenses of one trip to its running balances."""
+        paid = defaultdict(int)
+        for expense in expenses:
+            paid[str(expense["payer_id"])] += to_cents(expense["amount"])
+        if not paid:
+            return
+        increments = {f"paid.{payer}": cents for payer, cents in paid.items()}
+        increments["total"] = sum(paid.values())
+        increments["version"] = 1
+        self.db.balances.update_one({"_id": ObjectId(trip_id)}, {"$inc": increments}, upsert=True)
+        trips.touch(trip_id)
+
+    def settlement(self, trip_id, members):
+        """Return (version, balances, transfers) for a trip with these members."""
+        state = self.db.balances.find_one({"_id": ObjectId(trip_id)}) or {}
+        version = state.get("version", 0)
+        members = [str(user_id) for user_id in members]
+        # Members only ever join, so the count tells membership versions apart
+        key = (str(trip_id), version, len(members))
+        result = settle_cache.get(key)
+        if result is None:
+            balances = net_balances(members, state.get("paid", {}), state.get("total", 0))
+            result = (version, balances, simplify_debts(balances))
+            settle_cache.set(key, result)
+        return result
+
+    def rebuild_balances(self, batch_size=500):
+        """Recompute every trip's running balances from the expense ledger.
+
+        For backfilling and for repairing a trip whose counters missed a write.
+        Expenses inserted while this runs may be counted twice or not at all, so
+        run it while the app is not taking expense writes.
+        """
+
+        operations = []
+        rebuilt = 0
+        for trip in self.collection.aggregate(_balances_pipeline(), allowDiskUse=True):
+            operations.append(
+                UpdateOne(
+                    {"_id": trip["_id"]},
+                    {
+                        "$set": {"paid": {p["k"]: p["v"] for p in trip["paid"]}, "total": trip["total"]},
+                        "$inc": {"version": 1},
+                    },
+                    upsert=True,
+                )
+            )
+            if len(operations) >= batch_size:
+                self.db.balances.bulk_write(operations, ordered=False)
+                rebuilt += len(operations)
+                operations = []
+        if operations:
+            self.db.balances.bulk_write(operations, ordered=False)
+            rebuilt += len(operations)
+        settle_cache.clear()
+        return rebuilt
+
+
+users = UserRepository()
+trips = TripRepository()
+chats = ChatRepository()
+trip_events = EventRepository()
+itinerary_items = ItineraryItemRepository()
+budgets = BudgetRepository()
+
+
+def init_app(app):
+    # The backend and cache sizes are read when the app is created, after
+    # .env is loaded. Switching backends starts from empty caches.
+    backend = app.config.get("DATA_BACKEND", os.getenv("DATA_BACKEND", "mongo"))
+    if backend == "memory" and not app.testing:
+        # Nothing is persisted and each worker would have its own data
+        raise ValueError("DATA_BACKEND=memory is for tests and benchmarks, set TESTING to use it")
+    if backend == "mongo":
+        # connect=False defers the connection and its monitor threads to the
+        # first query, so a prefork server can preload the app before forking
+        mongo.init_app(app, connect=False, event_listeners=[command_metrics])
+    store.use(backend, INDEXES)
+    principal_cache.maxsize = int(
+        app.config.get("AUTH_CACHE_SIZE", os.getenv("AUTH_CACHE_SIZE", "1024"))
+    )
+    # Per process, see principal_cache
+    principal_cache.ttl = float(
+        app.config.get("AUTH_CACHE_TTL", os.getenv("AUTH_CACHE_TTL", "30"))
+    )
+    for cache in (principal_cache, chatroom_cache, settle_cache):
+        cache.clear()
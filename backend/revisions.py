@@ -0,0 +1,68 @@
+# Revisions.py
+import hashlib
+import os
+import secrets
+from functools import wraps
+from bson.errors import InvalidId
+from flask import make_response, request, session
+from backend.repositories import trips
+
+# Conditional GETs for the trip views. Every write to a trip (members,
+# budgets, expenses, itinerary items, chat messages) increments the trip's
+# `revision` once the write has landed, and the views below read the revision
+# before anything else. A request whose If-None-Match carries the current tag
+# is answered 304 after that one _id lookup, without rendering; otherwise the
+# view runs and its response is tagged. Reading first means a page can only
+# be newer than its tag, never older, so a racing write costs one extra
+# refresh rather than a stale page.
+#
+# The pages also show the user's own trip list, so the tag mixes in the user
+# and their memberships. ETAG_SALT changes every tag at once; it defaults to a
+# value picked at startup so a deploy with new templates is never answered
+# from an old tag. Pin it (e.g. to the release) when several hosts serve the
+# same users.
+
+CACHE_CONTROL = "private, no-cache"
+settings = {"salt": ""}
+
+
+def etag(user, trip_id, revision):
+    refs = user.get("profile", {}).get("trips", [])
+    key = "|".join(
+        [settings["salt"], str(user["_id"]), str(trip_id), *(str(ref["trip_id"]) for ref in refs)]
+    )
+    return f"{revision}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"
+
+
+def conditional(view):
+    """Answer If-None-Match for a trip view; wrap it inside token_required."""
+
+    @wraps(view)
+    def wrapper(current_user, trip_id, *args, **kwargs):
+        # Pending flash messages are shown by the next page rendered
+        if request.method != "GET" or "_flashes" in session:
+            return view(current_user, trip_id, *args, **kwargs)
+        try:
+            revision = trips.revision(trip_id)
+        except InvalidId:
+            revision = None
+        if revision is None:
+            # Let the view answer unknown or malformed trip ids
+            return view(current_user, trip_id, *args, **kwargs)
+
+        tag = etag(current_user, trip_id, revision)
+        if request.if_none_match.contains_weak(tag):
+            response = make_response("", 304)
+        else:
+            response = make_response(view(current_user, trip_id, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(tag, weak=True)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    return wrapper
+
+
+def init_app(app):
+    settings["salt"] = app.config.get("ETAG_SALT", os.getenv("ETAG_SALT")) or secrets.token_hex(8)
@@ -0,0 +1,77 @@
+# Routing.py
+import numpy as np
+
+# Orders a day's stops into a short walking/driving route. Distances are
+# great-circle (haversine) kilometres; the route is an open path that starts
+# at the day's first stop and may end anywhere.
+
+EARTH_RADIUS_KM = 6371.0088
+MAX_TWO_OPT_PASSES = 50
+
+
+def haversine_matrix(lat, lng):
+    """Pairwise distances in km, computed for all pairs in one pass."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lng = np.radians(np.asarray(lng, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def route_length(order, dist):
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def nearest_neighbour(dist, start=0):
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[order[-1]])
+        nxt = int(row.argmin())
+        order.append(nxt)
+        visited[nxt] = True
+    return np.array(order)
+
+
+def two_opt(order, dist, max_passes=MAX_TWO_OPT_PASSES):
+    """Improve an open path by reversing segments while that shortens it.
+
+    The first stop stays in place. For each segment start every possible
+    segment end is scored in one vectorized step, and the best improving
+    reversal is applied.
+    """
+    order = np.array(order)
+    n = len(order)
+    if n < 4:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            js = np.arange(i + 1, n)
+            c = order[js]
+            delta = dist[a, c] - dist[a, b]
+            # Reversing order[i..j] also swaps the edge leaving the segment,
+            # except when the segment runs to the end of the path
+            inner = js < n - 1
+            after = order[js[inner] + 1]
+            delta[inner] += dist[b, after] - dist[c[inner], after]
+            best = int(delta.argmin())
+            if delta[best] < -1e-9:
+                j = js[best]
+                order[i : j + 1] = order[i : j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def order_stops(lat, lng):
+    """Return (order, length_km, original_km) for stops given in time order."""
+    dist = haversine_matrix(lat, lng)
+    order = two_opt(nearest_neighbour(dist), dist)
+    return order, route_length(order, dist), route_length(np.arange(len(dist)), dist)
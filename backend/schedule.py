@@ -0,0 +1,314 @@
+# Schedule.py
+import csv
+import io
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+from backend.store import store
+from backend.intervals import find_overlaps
+from backend.ical import calendar_footer, calendar_header, format_event, parse_events
+
+# Itinerary items live in the itinerary_items collection, one document per
+# activity, instead of an array on the trip:
+#
+#   {trip_id, activity, location, notes, time, end, day: "YYYY-MM-DD",
+#    point: {type: "Point", coordinates: [lng, lat]}, geonameid}
+#
+# point is GeoJSON and only present when the place's coordinates are known.
+# geonameid is set when the location text was resolved by the gazetteer, so
+# items naming the same place can be grouped however it was typed.
+# Times are the trip's local wall-clock time, stored as naive datetimes. The
+# (trip_id, day, time, _id) index returns a day or a time range already in
+# order, and lists a trip's days without touching the items. Items may last
+# any time (an overnight train, a hotel stay); the trip keeps the length of
+# its longest item, which bounds how far back an overlapping item can start.
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+ITEM_ORDER = [("day", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)]
+IMPORT_CHUNK = 1000
+EXPORT_BATCH = 1000
+EXPORT_FIELDS = ["activity", "location", "time", "end", "notes", "latitude", "longitude", "uid"]
+DEFAULT_DURATION = timedelta(hours=1)
+
+
+class InvalidItem(ValueError):
+    pass
+
+
+def parse_time(value):
+    # Accepts datetimes, "2024-05-01T10:00" from datetime-local inputs, full
+    # ISO timestamps and plain dates (midnight)
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        raise InvalidItem(f"Invalid time: {value}")
+
+
+def day_of(time):
+    return time.date().isoformat()
+
+
+def build_item(trip_id, data):
+    """Validate one submitted item and return the document to store."""
+    if not data:
+        raise InvalidItem("Item must be an object")
+    activity = data.get("activity")
+    location = data.get("location")
+    if not activity or not location or not data.get("time"):
+        raise InvalidItem("Invalid input")
+    time = parse_time(data.get("time"))
+    if data.get("end"):
+        end = parse_time(data.get("end"))
+    elif data.get("duration") not in (None, ""):
+        try:
+            end = time + timedelta(minutes=float(data.get("duration")))
+        except (TypeError, ValueError):
+            raise InvalidItem("Invalid duration")
+    else:
+        end = time + DEFAULT_DURATION
+    if end < time:
+        raise InvalidItem("The end must not be before the start")
+    item = {
+        "trip_id": ObjectId(trip_id),
+        "activity": activity,
+        "location": location,
+        "time": time,
+        "end": end,
+        "day": day_of(time),
+        "notes": data.get("notes"),
+    }
+    point = parse_point(data.get("latitude"), data.get("longitude"))
+    if point is None:
+        # Typed-in locations are geocoded offline when a gazetteer is loaded.
+        # Imported here: the gazetteer blueprint needs auth, which needs the
+        # repositories, which need this module.
+        from backend import gazetteer
+
+        place = gazetteer.index.resolve(location)
+        if place:
+            point = parse_point(place["latitude"], place["longitude"])
+            item["geonameid"] = place["geonameid"]
+    if point:
+        item["point"] = point
+    # Calendar UIDs let a re-import update items instead of duplicating them
+    if data.get("uid"):
+        item["uid"] = str(data.get("uid"))
+    return item
+
+
+def parse_point(latitude, longitude):
+    if latitude in (None, "") or longitude in (None, ""):
+        return None
+    try:
+        lat, lng = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise InvalidItem("Invalid coordinates")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise InvalidItem("Invalid coordinates")
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def coordinates(item):
+    """Return (lat, lng), or None for items without a known place."""
+    point = item.get("point")
+    if not point:
+        return None
+    lng, lat = point["coordinates"]
+    return lat, lng
+
+
+def item_end(item):
+    # Items stored before durations existed take no time
+    return item.get("end") or item["time"]
+
+
+def item_seconds(item):
+    return (item_end(item) - item["time"]).total_seconds()
+
+
+def encode_cursor(item):
+    return f"{item['time'].isoformat()}_{item['_id']}"
+
+
+def decode_cursor(cursor):
+    time, _, item_id = cursor.rpartition("_")
+    try:
+        return parse_time(time), ObjectId(item_id)
+    except (InvalidItem, InvalidId):
+        raise InvalidItem("Invalid cursor")
+
+
+def items_query(trip_id, start=None, end=None, after=None):
+    """Build the filter for a trip's items in [start, end), after a cursor.
+
+    The day bounds are implied by the time bounds but let the index skip
+    straight to the first day instead of scanning the trip from the top.
+    """
+    query = {"trip_id": ObjectId(trip_id)}
+    if after:
+        after_time, after_id = decode_cursor(after)
+        start = max(start, after_time) if start else after_time
+        query["$or"] = [
+            {"time": {"$gt": after_time}},
+            {"time": after_time, "_id": {"$gt": after_id}},
+        ]
+    days = {}
+    times = {}
+    if start:
+        days["$gte"] = day_of(start)
+        times["$gte"] = start
+    if end:
+        days["$lte"] = day_of(end - timedelta(microseconds=1))
+        times["$lt"] = end
+    if days:
+        query["day"] = days
+        query["time"] = times
+    return query
+
+
+def next_placed_query(trip_id, after):
+    # The first item from ``after`` on whose place is known, in ITEM_ORDER
+    query = items_query(trip_id, after)
+    query["point"] = {"$exists": True}
+    return query
+
+
+def conflicts_query(trip_id, start, end, lookback=None, exclude=None):
+    """Build the filter for a trip's items overlapping [start, end).
+
+    Only items starting within ``lookback`` before ``start`` can reach into
+    it; without one every earlier item of the trip is a candidate.
+    """
+    query = items_query(trip_id, None if lookback is None else start - lookback, end)
+    query["end"] = {"$gt": start}
+    if exclude:
+        query["_id"] = {"$ne": exclude}
+    return query
+
+
+def nearby_pipeline(trip_id, lat, lng, radius_m=None, limit=20, exclude=None):
+    # $geoNear over the 2dsphere index on point, nearest first
+    query = {"trip_id": ObjectId(trip_id)}
+    if exclude is not None:
+        query["_id"] = {"$ne": exclude}
+    near = {
+        "near": {"type": "Point", "coordinates": [lng, lat]},
+        "key": "point",
+        "distanceField": "distance_m",
+        "spherical": True,
+        "query": query,
+    }
+    if radius_m is not None:
+        near["maxDistance"] = radius_m
+    return [{"$geoNear": near}, {"$limit": limit}]
+
+
+def find_conflicts(items):
+    """Return (item, item) pairs that overlap, in O(n log n + k)."""
+    items = list(items)
+    by_id = {item["_id"]: item for item in items}
+    pairs = find_overlaps((item["time"], item_end(item), item["_id"]) for item in items)
+    return [(by_id[a], by_id[b]) for a, b in pairs]
+
+
+def conflicting_ids(items):
+    return {item["_id"] for pair in find_conflicts(items) for item in pair}
+
+
+def group_by_day(items):
+    days = []
+    for item in items:
+        if not days or days[-1]["day"] != item["day"]:
+            days.append({"day": item["day"], "items": []})
+        days[-1]["items"].append(item)
+    return days
+
+
+def serialize_item(item):
+    serialized = {
+        "_id": str(item["_id"]),
+        "trip_id": str(item["trip_id"]),
+        "activity": item["activity"],
+        "location": item["location"],
+        "time": item["time"].isoformat(),
+        "end": item_end(item).isoformat(),
+        "day": item["day"],
+        "notes": item.get("notes"),
+    }
+    if item.get("uid"):
+        serialized["uid"] = item["uid"]
+    if item.get("geonameid"):
+        serialized["geonameid"] = item["geonameid"]
+    if item.get("point"):
+        serialized["latitude"], serialized["longitude"] = coordinates(item)
+    return serialized
+
+
+def export_csv(items):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for item in items:
+        writer.writerow(serialize_item(item))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_ics(items, calendar_name):
+    yield calendar_header(calendar_name)
+    stamp = datetime.utcnow()
+    for item in items:
+        yield format_event(
+            item.get("uid") or f"{item['_id']}@tripplanner421",
+            item["time"],
+            item_end(item),
+            item["activity"],
+            item["location"],
+            item.get("notes"),
+            coordinates(item),
+            stamp,
+        )
+    yield calendar_footer()
+
+
+def read_csv(stream):
+    # Rows of an uploaded CSV as dicts, decoded as the upload streams in
+    return csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+
+
+def read_ics(stream):
+    return parse_events(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+
+
+def migrate_itinerary_items():
+    """Move embedded itinerary arrays into the itinerary_items collection.
+
+    String times from older seeds are parsed on the way. Items copied by an
+    interrupted run are tagged ``legacy`` and replaced on the next run.
+    """
+    migrated = 0
+    for trip in store.db.itineraries.find({"itinerary": {"$exists": True}}, {"itinerary": 1}):
+        store.db.itinerary_items.delete_many({"trip_id": trip["_id"], "legacy": True})
+        items = []
+        for entry in trip["itinerary"] or []:
+            try:
+                item = build_item(trip["_id"], entry)
+            except InvalidItem:
+                continue
+            item["legacy"] = True
+            items.append(item)
+        if items:
+            store.db.itinerary_items.insert_many(items)
+        store.db.itineraries.update_one({"_id": trip["_id"]}, {"$unset": {"itinerary": ""}})
+        store.db.itinerary_items.update_many(
+            {"trip_id": trip["_id"], "legacy": True}, {"$unset": {"legacy": ""}}
+        )
+        migrated += len(items)
+    return migrated
@@ -0,0 +1,139 @@
+# Seed.py
+from werkzeug.security import generate_password_hash
+from datetime import datetime
+from backend.store import store
+from backend.repositories import users
+from backend.schedule import build_item
+from backend.memberships import generate_invite_code, membership_ref
+
+# Test data for local development, loaded with `flask seed`.
+
+
+def initialize_database():
+    test_users = [
+        {
+            "username": "testuser1",
+            "password": "testpassword1",
+            "email": "testuser1@example.com",
+        },
+        {
+            "username": "testuser2",
+            "password": "testpassword2",
+            "email": "testuser2@example.com",
+        },
+    ]
+
+    user_ids = []
+    for user in test_users:
+        existing_user = store.db.users.find_one({"username": user["username"]})
+        if not existing_user:
+            hashed_password = generate_password_hash(user["password"])
+            user_id = store.db.users.insert_one(
+                {
+                    "username": user["username"],
+                    "password": hashed_password,
+                    "email": user["email"],
+                    "profile": {
+                        "name": f"Test User {user['username'][-1]}",
+                        "trips": [],
+                    },
+                }
+            ).inserted_id
+            user_ids.append(user_id)
+            print(f"Test user {user['username']} created with user_id: {user_id}")
+        else:
+            user_ids.append(existing_user["_id"])
+
+    # check if the itinerary already exists
+    existing_itinerary = store.db.itineraries.find_one({"trip_name": "Test Trip"})
+    if not existing_itinerary:
+        # create a dummy chatroom in the chatrooms collection
+        chatroom_id = store.db.chatrooms.insert_one(
+            {"created_at": datetime.utcnow(), "message_seq": 2}
+        ).inserted_id
+        store.db.messages.insert_many(
+            [
+                {
+                    "chatroom_id": chatroom_id,
+                    "user_id": user_ids[0],
+                    "username": "testuser1",
+                    "seq": 1,
+                    "message": "Looking forward to the trip!",
+                    "timestamp": datetime.utcnow(),
+                },
+                {
+                    "chatroom_id": chatroom_id,
+                    "user_id": user_ids[1],
+                    "username": "testuser2",
+                    "seq": 2,
+                    "message": "Don't forget to pack comfortable shoes.",
+                    "timestamp": datetime.utcnow(),
+                },
+            ]
+        )
+
+        # create a dummy itinerary in the itineraries collection
+        itinerary_id = store.db.itineraries.insert_one(
+            {
+                "trip_name": "Test Trip",
+                "users": user_ids,
+                "chatroom_id": chatroom_id,
+                "budget": [
+                    {
+                        "user_id": user_ids[0],
+                        "flight": 300,
+                        "hotel": 400,
+                        "food": 200,
+                        "transport": 150,
+                        "activities": 200,
+                        "spending": 100,
+                    },
+                    {
+                        "user_id": user_ids[1],
+                        "flight": 200,
+                        "hotel": 300,
+                        "food": 100,
+                        "transport": 50,
+                        "activities": 100,
+                        "spending": 80,
+                    },
+                ],
+                "invite_code": generate_invite_code(),
+            }
+        ).inserted_id
+
+        store.db.itinerary_items.insert_many(
+            [
+                build_item(
+                    itinerary_id,
+                    {
+                        "activity": "Visit Eiffel Tower",
+                        "location": "Paris",
+                        "time": datetime(2022, 7, 15, 10, 0),
+                        "notes": "Buy tickets online",
+                    },
+                ),
+                build_item(
+                    itinerary_id,
+                    {
+                        "activity": "Lunch at Le Jules Verne",
+                        "location": "Paris",
+                        "time": datetime(2022, 7, 15, 13, 0),
+                        "notes": "Reservation at 1 PM",
+                    },
+                ),
+            ]
+        )
+
+        # add the itinerary to each user's membership index
+        users.add_memberships(
+            (user_id, membership_ref(itinerary_id, "Test Trip", "owner" if user_id == user_ids[0] else "member"))
+            for user_id in user_ids
+        )
+
+        print(
+            f"Dummy itinerary added to past trips for both test users with itinerary_id: {itinerary_id}"
+        )
+    else:
+        # chatroom_id = existing_itinerary["chatroom_id"]
+        print("Dummy itinerary already exists with chatroom_id")
@@ -0,0 +1,64 @@
+# Settle.py
+import heapq
+
+# Who owes whom. Every expense is split equally between the members of its
+# trip. Instead of replaying the ledger, each trip keeps a running document in
+# the balances collection:
+#
+#   {_id: trip_id, version, total, paid: {<user_id>: cents}}
+#
+# which every expense write bumps with $inc. Amounts are integer cents so the
+# running sums never drift. The budgets repository keeps those documents up
+# to date and caches settlements per (trip, version).
+#
+# The transfers settle n members in at most n - 1 payments, not in the
+# fewest possible: that needs the balances split into as many zero-sum
+# groups as possible, which is NP-hard. The greedy match is O(n log n).
+
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def net_balances(members, paid, total):
+    """Return {user_id: cents}, positive for members who are owed money.
+
+    The total is split equally; the leftover cents go one each to the first
+    members in id order, so the balances always add up to zero. Payers who
+    are no longer members keep their credit but owe no share.
+    """
+    members = sorted(members)
+    balances = {user_id: paid.get(user_id, 0) for user_id in members}
+    if members:
+        share, leftover = divmod(total, len(members))
+        for index, user_id in enumerate(members):
+            balances[user_id] -= share + (1 if index < leftover else 0)
+    for user_id, cents in paid.items():
+        if user_id not in balances:
+            balances[user_id] = cents
+    return balances
+
+
+def simplify_debts(balances):
+    """Turn net balances into (debtor, creditor, cents) transfers.
+
+    Greedily matches the largest debtor with the largest creditor. Each
+    transfer settles at least one of them, so n members need at most n - 1
+    transfers and the whole pass is O(n log n).
+    """
+    creditors = [(-cents, user_id) for user_id, cents in balances.items() if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in balances.items() if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
@@ -0,0 +1,1082 @@
+# Store.py
+import functools
+import itertools
+import operator
+import threading
+from bson.objectid import ObjectId
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+from backend.geo import distances_m
+from backend.models import mongo
+
+# The database behind the repositories. DATA_BACKEND=mongo (the default) is
+# the flask_pymongo connection; DATA_BACKEND=memory keeps every collection in
+# this process, for tests and benchmarks that should not need a mongod, and
+# is refused unless the app is TESTING.
+#
+# MemoryDatabase implements the part of the pymongo Collection API the app
+# uses, with the same semantics: filters with $in/$nin/$ne/$gt(e)/$lt(e)/
+# $exists/$or on dotted paths and array members, projections, sorts, the
+# $set/$unset/$inc/$max/$push($slice)/$addToSet/$pull updates including the positional
+# "$", upserts, bulk_write, and unique (optionally partial) indexes raising
+# DuplicateKeyError. Documents are copied in and out, as over the wire. Each
+# index's leading field is kept in a hash map, so equality and $in lookups
+# on it do not scan the collection. aggregate() runs the pipeline stages the
+# repositories use ($match, $project, $unwind, $lookup, $group, $sort, $skip,
+# $limit, $geoNear) with the expression operators in EXPRESSION_OPERATORS, so
+# the tests run the same pipelines MongoDB does. Filters, updates and
+# pipelines using anything else are refused with an OperationFailure before
+# any document is read or written, as a server refuses an unknown operator.
+
+
+def _copy(value):
+    # ObjectIds, datetimes and strings are immutable, only containers need copying
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _freeze(value):
+    # Hashable stand-in for an index key
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def resolve(doc, path):
+    """Values at a dotted path, descending into arrays like MongoDB does."""
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = found
+    return values
+
+
+def _candidates(values):
+    # A field matches if its value, or any element of an array value, does
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _comparable(a, b):
+    numbers = (int, float)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b)
+    return (isinstance(a, numbers) and isinstance(b, numbers)) or type(a) is type(b)
+
+
+def _compare(values, op, target):
+    for value in _candidates(values):
+        if value is None or not _comparable(value, target):
+            continue
+        if (
+            (op == "$gt" and value > target)
+            or (op == "$gte" and value >= target)
+            or (op == "$lt" and value < target)
+            or (op == "$lte" and value <= target)
+        ):
+            return True
+    return False
+
+
+def _equals(values, target):
+    if target is None and not values:
+        return True
+    return any(value == target for value in _candidates(values))
+
+
+QUERY_OPERATORS = {"$eq", "$ne", "$in", "$nin", "$exists", "$gt", "$gte", "$lt", "$lte", "$elemMatch"}
+UPDATE_OPERATORS = {"$set", "$setOnInsert", "$unset", "$inc", "$max", "$push", "$addToSet", "$pull"}
+
+
+def _unsupported(kind, name, code=2):
+    return OperationFailure(f"{kind} {name} is not supported by the memory backend", code)
+
+
+def _is_operator(condition):
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def check_query(query):
+    """Refuse a filter that uses operators this backend does not implement."""
+    for key, condition in query.items():
+        if key in ("$or", "$and", "$nor"):
+            for clause in condition:
+                check_query(clause)
+        elif key.startswith("$"):
+            raise _unsupported("Query operator", key)
+        elif _is_operator(condition):
+            for op, target in condition.items():
+                if op not in QUERY_OPERATORS:
+                    raise _unsupported("Query operator", op)
+                if op == "$elemMatch":
+                    check_query(target)
+
+
+def check_update(update):
+    if not update or not all(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+    for op, fields in update.items():
+        if op not in UPDATE_OPERATORS:
+            raise _unsupported("Update operator", op, code=9)
+        if op == "$pull":
+            for condition in fields.values():
+                if _is_operator(condition):
+                    check_query({"value": condition})
+
+
+def _matches_condition(values, condition):
+    if not _is_operator(condition):
+        return _equals(values, condition)
+    for op, target in condition.items():
+        if op == "$eq":
+            ok = _equals(values, target)
+        elif op == "$ne":
+            ok = not _equals(values, target)
+        elif op == "$in":
+            ok = any(_equals(values, option) for option in target)
+        elif op == "$nin":
+            ok = not any(_equals(values, option) for option in target)
+        elif op == "$exists":
+            ok = bool(values) == bool(target)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = _compare(values, op, target)
+        elif op == "$elemMatch":
+            ok = any(
+                isinstance(value, list) and any(isinstance(item, dict) and matches(item, target) for item in value)
+                for value in values
+            )
+        else:
+            raise _unsupported("Query operator", op)
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    """Whether a document matches a MongoDB filter."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, clause) for clause in condition):
+                return False
+        elif not _matches_condition(resolve(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return _copy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    included = [path for path, flag in projection.items() if flag and path != "_id"]
+    if not included:
+        result = _copy(doc)
+        for path, flag in projection.items():
+            if not flag:
+                _unset(result, path)
+        return result
+    result = {}
+    if projection.get("_id", 1) and "_id" in doc:
+        result["_id"] = doc["_id"]
+    for path in included:
+        source, target = doc, result
+        parts = path.split(".")
+        for part in parts[:-1]:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = _copy(source[parts[-1]])
+    return result
+
+
+def _sort_value(doc, field):
+    values = resolve(doc, field)
+    value = values[0] if values else None
+    # Missing and null sort first, as in MongoDB
+    return (0,) if value is None else (1, value)
+
+
+def sort_documents(docs, sort):
+    docs = list(docs)
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda doc: _sort_value(doc, field), reverse=direction < 0)
+    return docs
+
+
+def _normalize_sort(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return [(field, value) for field, value in key_or_list]
+
+
+def _container(doc, path, create):
+    # (parent, last key) of a dotted path, creating dicts along the way
+    parts = path.split(".")
+    node = doc
+    for part in parts[:-1]:
+        if isinstance(node, list):
+            node = node[int(part)]
+            continue
+        if part not in node or node[part] is None:
+            if not create:
+                return None, parts[-1]
+            node[part] = {}
+        node = node[part]
+    return node, parts[-1]
+
+
+def _get(node, key):
+    if isinstance(node, list):
+        return node[int(key)] if int(key) < len(node) else None
+    return node.get(key)
+
+
+def _put(node, key, value):
+    if isinstance(node, list):
+        node[int(key)] = value
+    else:
+        node[key] = value
+
+
+def _unset(doc, path):
+    node, key = _container(doc, path, create=False)
+    if isinstance(node, dict):
+        node.pop(key, None)
+
+
+def _positional(doc, path, query):
+    # budget.$.food: "$" is the first array element the filter matched on
+    if ".$" not in path:
+        return path
+    prefix, _, rest = path.partition(".$")
+    array = resolve(doc, prefix)
+    array = array[0] if array and isinstance(array[0], list) else []
+    element_query = {
+        key[len(prefix) + 1 :]: condition for key, condition in query.items() if key.startswith(prefix + ".")
+    }
+    for index, element in enumerate(array):
+        if element_query and isinstance(element, dict) and matches(element, element_query):
+            return f"{prefix}.{index}{rest}"
+        if prefix in query and _matches_condition([element], query[prefix]):
+            return f"{prefix}.{index}{rest}"
+    raise ValueError(f"The positional operator did not find the match needed from the query: {path}")
+
+
+def _each(value):
+    if isinstance(value, dict) and "$each" in value:
+        return list(value["$each"])
+    return [value]
+
+
+def apply_update(doc, update, query, inserting=False):
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            path = _positional(doc, path, query)
+            if op in ("$set", "$setOnInsert"):
+                node, key = _container(doc, path, create=True)
+                _put(node, key, _copy(value))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                node, key = _container(doc, path, create=True)
+                _put(node, key, (_get(node, key) or 0) + value)
+            elif op == "$max":
+                node, key = _container(doc, path, create=True)
+                current = _get(node, key)
+                if current is None or value > current:
+                    _put(node, key, _copy(value))
+            elif op in ("$push", "$addToSet"):
+                node, key = _container(doc, path, create=True)
+                array = _get(node, key)
+                if array is None:
+                    array = []
+                    _put(node, key, array)
+                for item in _each(value):
+                    if op == "$push" or item not in array:
+                        array.append(_copy(item))
+                if op == "$push" and isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]
+                    array[:] = array[limit:] if limit < 0 else array[:limit]
+            elif op == "$pull":
+                node, key = _container(doc, path, create=False)
+                array = _get(node, key) if node is not None else None
+                if isinstance(array, list):
+                    array[:] = [
+                        item for item in array if not _matches_condition([item], value)
+                    ]
+            else:
+                raise _unsupported("Update operator", op, code=9)
+    return doc
+
+
+def _upsert_seed(query):
+    # An upsert starts from the filter's equality conditions
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" not in condition:
+                continue
+            condition = condition["$eq"]
+        node, last = _container(doc, key, create=True)
+        node[last] = _copy(condition)
+    return doc
+
+
+# Aggregation. compile_pipeline() checks every stage and expression and
+# returns one function per stage; each takes the documents of the previous
+# stage (None before the first, meaning the whole collection) and never
+# changes them, so stored documents are only copied once, on the way out.
+
+_MISSING = object()
+
+
+def _is_null(value):
+    return value is None or value is _MISSING
+
+
+def _field(value, parts):
+    # "$a.b" in an expression; over an array it is the array of each element's b
+    for i, part in enumerate(parts):
+        if isinstance(value, list):
+            found = (_field(item, parts[i:]) for item in value)
+            return [item for item in found if item is not _MISSING]
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _arithmetic(combine):
+    def run(values):
+        if any(_is_null(value) for value in values):
+            return None
+        return functools.reduce(combine, values)
+
+    return run
+
+
+def _unary(convert):
+    def run(values):
+        return None if _is_null(values[0]) else convert(*values)
+
+    return run
+
+
+def _array_elem_at(values):
+    array, index = values
+    if _is_null(array):
+        return None
+    return array[index] if -len(array) <= index < len(array) else _MISSING
+
+
+EXPRESSION_OPERATORS = {
+    "$add": _arithmetic(operator.add),
+    "$multiply": _arithmetic(operator.mul),
+    "$ifNull": lambda values: next((value for value in values[:-1] if not _is_null(value)), values[-1]),
+    "$arrayElemAt": _array_elem_at,
+    "$round": _unary(lambda number, places=0: round(number, places)),
+    "$toString": _unary(str),
+    "$toLong": _unary(int),
+}
+ACCUMULATORS = {"$sum", "$first", "$push"}
+
+
+def _check_expression(expression):
+    if isinstance(expression, str) and expression.startswith("$$"):
+        raise _unsupported("Variable", expression, code=17276)
+    if isinstance(expression, list):
+        for item in expression:
+            _check_expression(item)
+    elif isinstance(expression, dict):
+        operators = [key for key in expression if key.startswith("$")]
+        if not operators:
+            _check_expression(list(expression.values()))
+        elif len(expression) != 1 or operators[0] not in EXPRESSION_OPERATORS:
+            raise _unsupported("Expression", operators[0], code=168)
+        else:
+            _check_expression(expression[operators[0]])
+
+
+def _evaluate(expression, doc):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _field(doc, expression[1:].split("."))
+    if isinstance(expression, list):
+        return [None if value is _MISSING else value for value in (_evaluate(item, doc) for item in expression)]
+    if isinstance(expression, dict):
+        if len(expression) == 1 and next(iter(expression)).startswith("$"):
+            op, args = next(iter(expression.items()))
+            args = args if isinstance(args, list) else [args]
+            return EXPRESSION_OPERATORS[op]([_evaluate(arg, doc) for arg in args])
+        values = {key: _evaluate(value, doc) for key, value in expression.items()}
+        return {key: value for key, value in values.items() if value is not _MISSING}
+    return expression
+
+
+def _output_field(name, stage):
+    if not isinstance(name, str) or not name or name.startswith("$") or "." in name:
+        raise _unsupported(f"{stage} output field", repr(name), code=40352)
+    return name
+
+
+def _documents(docs, collection, query=None):
+    if docs is None:
+        return collection._matching(query) if query else list(collection._docs.values())
+    return [doc for doc in docs if matches(doc, query)] if query else docs
+
+
+def _match_stage(spec):
+    check_query(spec)
+    return lambda docs, collection: _documents(docs, collection, spec)
+
+
+def _project_stage(spec):
+    computed = {}
+    for name, value in spec.items():
+        if isinstance(value, (bool, int)):
+            if not value and name != "_id":
+                raise _unsupported("$project exclusion of", name, code=31254)
+        else:
+            _check_expression(value)
+            computed[_output_field(name, "$project")] = value
+    included = [name for name, value in spec.items() if name != "_id" and name not in computed]
+    keep_id = spec.get("_id", 1) not in (0, False)
+
+    def run(docs, collection):
+        projected = []
+        for doc in _documents(docs, collection):
+            result = {"_id": doc["_id"]} if keep_id and "_id" in doc else {}
+            for name in included:
+                value = _field(doc, name.split("."))
+                if value is not _MISSING:
+                    result[name] = value
+            for name, expression in computed.items():
+                value = _evaluate(expression, doc)
+                if value is not _MISSING:
+                    result[name] = value
+            projected.append(result)
+        return projected
+
+    return run
+
+
+def _unwind_stage(spec):
+    path = spec.get("path") if isinstance(spec, dict) and set(spec) == {"path"} else spec
+    if not isinstance(path, str) or not path.startswith("$"):
+        raise _unsupported("$unwind", repr(spec), code=28812)
+    name = _output_field(path[1:], "$unwind")
+
+    def run(docs, collection):
+        unwound = []
+        for doc in _documents(docs, collection):
+            value = doc.get(name)
+            if isinstance(value, list):
+                unwound.extend({**doc, name: item} for item in value)
+            elif value is not None:
+                unwound.append(doc)
+        return unwound
+
+    return run
+
+
+def _lookup_stage(spec):
+    if set(spec) != {"from", "localField", "foreignField", "as"}:
+        raise _unsupported("$lookup", "with " + ", ".join(sorted(spec)), code=40321)
+    local = spec["localField"].split(".")
+    target = _output_field(spec["as"], "$lookup")
+
+    def run(docs, collection):
+        foreign = collection.database[spec["from"]]
+        joined = []
+        for doc in _documents(docs, collection):
+            value = _field(doc, local)
+            values = [None] if value is _MISSING else value if isinstance(value, list) else [value]
+            joined.append({**doc, target: foreign._matching({spec["foreignField"]: {"$in": values}})})
+        return joined
+
+    return run
+
+
+def _group_stage(spec):
+    if "_id" not in spec:
+        raise OperationFailure("a group specification must include an _id", 15955)
+    _check_expression(spec["_id"])
+    accumulators = {}
+    for name, accumulator in spec.items():
+        if name == "_id":
+            continue
+        if not isinstance(accumulator, dict) or len(accumulator) != 1:
+            raise _unsupported("$group field", repr(name), code=40234)
+        (op, expression), = accumulator.items()
+        if op not in ACCUMULATORS:
+            raise _unsupported("Accumulator", op, code=15952)
+        _check_expression(expression)
+        accumulators[_output_field(name, "$group")] = (op, expression)
+
+    def run(docs, collection):
+        groups = {}
+        for doc in _documents(docs, collection):
+            key = _evaluate(spec["_id"], doc)
+            key = None if key is _MISSING else key
+            group = groups.get(_freeze(key))
+            if group is None:
+                group = groups[_freeze(key)] = {"_id": key}
+                for name, (op, expression) in accumulators.items():
+                    if op == "$first":
+                        value = _evaluate(expression, doc)
+                        group[name] = None if value is _MISSING else value
+                    else:
+                        group[name] = [] if op == "$push" else 0
+            for name, (op, expression) in accumulators.items():
+                if op == "$first":
+                    continue
+                value = _evaluate(expression, doc)
+                if op == "$push":
+                    if value is not _MISSING:
+                        group[name].append(value)
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    group[name] += value
+        return list(groups.values())
+
+    return run
+
+
+def _sort_stage(spec):
+    order = _normalize_sort(list(spec.items()))
+    return lambda docs, collection: sort_documents(_documents(docs, collection), order)
+
+
+def _skip_stage(spec):
+    return lambda docs, collection: _documents(docs, collection)[spec:]
+
+
+def _limit_stage(spec):
+    return lambda docs, collection: _documents(docs, collection)[:spec]
+
+
+def _geo_near_stage(spec):
+    if not set(spec) <= {"near", "key", "distanceField", "spherical", "query", "maxDistance"} or "key" not in spec:
+        raise _unsupported("$geoNear", "with " + ", ".join(sorted(spec)), code=2)
+    near = spec["near"]
+    if not (isinstance(near, dict) and near.get("type") == "Point"):
+        raise _unsupported("$geoNear near", repr(near), code=2)
+    lng, lat = near["coordinates"]
+    key = spec["key"].split(".")
+    target = _output_field(spec["distanceField"], "$geoNear")
+    query = spec.get("query") or {}
+    check_query(query)
+    limit = spec.get("maxDistance")
+
+    def run(docs, collection):
+        placed = []
+        for doc in _documents(docs, collection, query):
+            point = _field(doc, key)
+            if isinstance(point, dict) and point.get("type") == "Point":
+                placed.append((doc, point["coordinates"]))
+        if not placed:
+            return []
+        distances = distances_m(lat, lng, [c[1] for _, c in placed], [c[0] for _, c in placed])
+        return [
+            {**placed[i][0], target: float(distances[i])}
+            for i in sorted(range(len(placed)), key=lambda i: distances[i])
+            if limit is None or distances[i] <= limit
+        ]
+
+    return run
+
+
+PIPELINE_STAGES = {
+    "$match": _match_stage,
+    "$project": _project_stage,
+    "$unwind": _unwind_stage,
+    "$lookup": _lookup_stage,
+    "$group": _group_stage,
+    "$sort": _sort_stage,
+    "$skip": _skip_stage,
+    "$limit": _limit_stage,
+    "$geoNear": _geo_near_stage,
+}
+
+
+def compile_pipeline(pipeline):
+    """Check a whole pipeline before running it; returns one function per stage."""
+    stages = []
+    for position, stage in enumerate(pipeline):
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise OperationFailure("A pipeline stage specification object must contain exactly one field.", 40323)
+        (name, spec), = stage.items()
+        if name not in PIPELINE_STAGES:
+            raise _unsupported("Pipeline stage", name, code=40324)
+        if name == "$geoNear" and position:
+            raise OperationFailure("$geoNear is only valid as the first stage in a pipeline", 40602)
+        stages.append(PIPELINE_STAGES[name](spec))
+    return stages
+
+
+class MemoryIndex:
+    def __init__(self, name, fields, unique=False, partial=None):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.partial = partial
+        self.keys = {}
+
+    def key(self, doc):
+        if self.partial and not matches(doc, self.partial):
+            return None
+        key = []
+        for field in self.fields:
+            values = resolve(doc, field)
+            key.append(_freeze(values[0]) if values else None)
+        return tuple(key)
+
+
+class MemoryCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        docs = self._collection._select(self._query, self._sort, self._skip, self._limit, self._projection)
+        return iter(docs)
+
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._lock = database.lock
+        self._docs = {}
+        self._order = {}
+        self._sequence = itertools.count()
+        self._indexes = {}
+        # field -> {frozen value: {_id, ...}} for the leading field of each index
+        self._lookups = {}
+
+    def __repr__(self):
+        return f"MemoryCollection({self.name!r})"
+
+    # Indexes
+
+    def create_index(self, keys, name=None, unique=False, partialFilterExpression=None, **options):
+        keys = _normalize_sort(keys)
+        fields = [field for field, _ in keys]
+        name = name or "_".join(f"{field}_{kind}" for field, kind in keys)
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = MemoryIndex(name, fields, unique, partialFilterExpression)
+            for doc in self._docs.values():
+                key = index.key(doc)
+                if unique and key is not None:
+                    if key in index.keys:
+                        raise DuplicateKeyError(self._duplicate_message(index, key), 11000)
+                    index.keys[key] = doc["_id"]
+            self._indexes[name] = index
+            if fields[0] not in self._lookups:
+                lookup = self._lookups[fields[0]] = {}
+                for doc in self._docs.values():
+                    self._add_lookup(fields[0], lookup, doc)
+        return name
+
+    def index_information(self):
+        return {name: {"key": [(f, 1) for f in index.fields], "unique": index.unique} for name, index in self._indexes.items()}
+
+    def _duplicate_message(self, index, key):
+        fields = ", ".join(f"{field}: {value!r}" for field, value in zip(index.fields, key))
+        return f"E11000 duplicate key error collection: {self.database.name}.{self.name} index: {index.name} dup key: {{ {fields} }}"
+
+    def _add_lookup(self, field, lookup, doc):
+        for value in set(_freeze(v) for v in _candidates(resolve(doc, field))):
+            lookup.setdefault(value, set()).add(doc["_id"])
+
+    def _remove_lookup(self, field, lookup, doc):
+        for value in set(_freeze(v) for v in _candidates(resolve(doc, field))):
+            ids = lookup.get(value)
+            if ids is not None:
+                ids.discard(doc["_id"])
+                if not ids:
+                    del lookup[value]
+
+    def _check_unique(self, doc):
+        for index in self._indexes.values():
+            if not index.unique:
+                continue
+            key = index.key(doc)
+            if key is None:
+                continue
+            owner = index.keys.get(key)
+            if owner is not None and owner != doc["_id"]:
+                raise DuplicateKeyError(self._duplicate_message(index, key), 11000)
+
+    def _index(self, doc):
+        for index in self._indexes.values():
+            key = index.key(doc)
+            if index.unique and key is not None:
+                index.keys[key] = doc["_id"]
+        for field, lookup in self._lookups.items():
+            self._add_lookup(field, lookup, doc)
+
+    def _unindex(self, doc):
+        for index in self._indexes.values():
+            key = index.key(doc)
+            if index.unique and key is not None and index.keys.get(key) == doc["_id"]:
+                del index.keys[key]
+        for field, lookup in self._lookups.items():
+            self._remove_lookup(field, lookup, doc)
+
+    # Reads
+
+    def _ids_for(self, query):
+        # Narrow a query to a set of ids through _id or an indexed field
+        for field, condition in query.items():
+            if field == "_id" or field in self._lookups:
+                if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+                    if set(condition) != {"$in"}:
+                        continue
+                    options = condition["$in"]
+                else:
+                    options = [condition]
+                if field == "_id":
+                    return {value for value in options if _freeze(value) in self._docs}
+                lookup = self._lookups[field]
+                ids = set()
+                for value in options:
+                    ids |= lookup.get(_freeze(value), set())
+                return ids
+        return None
+
+    def _matching(self, query):
+        query = query or {}
+        check_query(query)
+        ids = self._ids_for(query)
+        if ids is None:
+            docs = self._docs.values()
+        else:
+            docs = [self._docs[_freeze(i)] for i in sorted(ids, key=lambda i: self._order[_freeze(i)])]
+        return [doc for doc in docs if matches(doc, query)]
+
+    def _select(self, query, sort=None, skip=0, limit=0, projection=None):
+        with self._lock:
+            docs = self._matching(query)
+            if sort:
+                docs = sort_documents(docs, sort)
+            if skip:
+                docs = docs[skip:]
+            if limit:
+                docs = docs[:limit]
+            return [project(doc, projection) for doc in docs]
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, batch_size=None):
+        cursor = MemoryCursor(self, filter or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        docs = self._select(filter or {}, _normalize_sort(sort) if sort else None, 0, 1, projection)
+        return docs[0] if docs else None
+
+    def count_documents(self, filter, limit=0, skip=0):
+        with self._lock:
+            count = max(0, len(self._matching(filter)) - skip)
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self):
+        return len(self._docs)
+
+    def distinct(self, key, filter=None):
+        values = {}
+        with self._lock:
+            for doc in self._matching(filter):
+                for value in _candidates(resolve(doc, key)):
+                    if not isinstance(value, list):
+                        values.setdefault(_freeze(value), value)
+        return list(values.values())
+
+    def aggregate(self, pipeline, **options):
+        # Options such as allowDiskUse mean nothing in memory
+        stages = compile_pipeline(pipeline)
+        with self._lock:
+            docs = None
+            for stage in stages:
+                docs = stage(docs, self)
+            return iter([_copy(doc) for doc in _documents(docs, self)])
+
+    # Writes
+
+    def _insert(self, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        key = _freeze(doc["_id"])
+        if key in self._docs:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.database.name}.{self.name} index: _id_ dup key: {{ _id: {doc['_id']!r} }}",
+                11000,
+            )
+        stored = _copy(doc)
+        self._check_unique(stored)
+        self._docs[key] = stored
+        self._order[key] = next(self._sequence)
+        self._index(stored)
+        return doc["_id"]
+
+    def _replace(self, old, new):
+        self._check_unique(new)
+        self._unindex(old)
+        self._docs[_freeze(old["_id"])] = new
+        self._index(new)
+
+    def _update(self, query, update, upsert=False, many=False, return_document=None, projection=None, sort=None):
+        # Returns (matched, modified, upserted_id, document)
+        check_update(update)
+        docs = self._matching(query)
+        if sort:
+            docs = sort_documents(docs, _normalize_sort(sort))
+        if not many:
+            docs = docs[:1]
+        if not docs:
+            if not upsert:
+                return 0, 0, None, None
+            new = apply_update(_upsert_seed(query), update, query, inserting=True)
+            upserted_id = self._insert(new)
+            stored = self._docs[_freeze(upserted_id)]
+            document = project(stored, projection) if return_document else None
+            return 0, 0, upserted_id, document
+        modified = 0
+        document = None
+        for old in docs:
+            new = apply_update(_copy(old), update, query)
+            if return_document is ReturnDocument.BEFORE:
+                document = project(old, projection)
+            if new != old:
+                self._replace(old, new)
+                modified += 1
+            if return_document is ReturnDocument.AFTER:
+                document = project(new, projection)
+        return len(docs), modified, None, document
+
+    def insert_one(self, document):
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents, ordered=True):
+        inserted = []
+        errors = []
+        with self._lock:
+            for index, doc in enumerate(documents):
+                try:
+                    inserted.append(self._insert(doc))
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError(_bulk_details(len(inserted), 0, 0, 0, [], errors))
+        return InsertManyResult(inserted, True)
+
+    def update_one(self, filter, update, upsert=False):
+        with self._lock:
+            matched, modified, upserted_id, _ = self._update(filter, update, upsert)
+        return UpdateResult(_update_raw(matched, modified, upserted_id), True)
+
+    def update_many(self, filter, update, upsert=False):
+        with self._lock:
+            matched, modified, upserted_id, _ = self._update(filter, update, upsert, many=True)
+        return UpdateResult(_update_raw(matched, modified, upserted_id), True)
+
+    def find_one_and_update(
+        self, filter, update, projection=None, sort=None, upsert=False, return_document=ReturnDocument.BEFORE
+    ):
+        with self._lock:
+            _, _, _, document = self._update(
+                filter, update, upsert, return_document=return_document, projection=projection, sort=sort
+            )
+        return document
+
+    def delete_one(self, filter):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter):
+        return self._delete(filter, many=True)
+
+    def _delete(self, filter, many):
+        with self._lock:
+            docs = self._matching(filter)
+            if not many:
+                docs = docs[:1]
+            for doc in docs:
+                self._unindex(doc)
+                key = _freeze(doc["_id"])
+                del self._docs[key]
+                del self._order[key]
+        return DeleteResult({"n": len(docs)}, True)
+
+    def bulk_write(self, requests, ordered=True):
+        inserted = matched = modified = 0
+        upserted = []
+        errors = []
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                check_query(request._filter)
+                check_update(request._doc)
+            elif not isinstance(request, InsertOne):
+                raise _unsupported("Bulk write request", type(request).__name__)
+        with self._lock:
+            for index, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        self._insert(request._doc)
+                        inserted += 1
+                    else:
+                        n, m, upserted_id, _ = self._update(request._filter, request._doc, request._upsert)
+                        matched += n
+                        modified += m
+                        if upserted_id is not None:
+                            upserted.append({"index": index, "_id": upserted_id})
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": request._doc})
+                    if ordered:
+                        break
+        details = _bulk_details(inserted, matched, modified, len(upserted), upserted, errors)
+        if errors:
+            raise BulkWriteError(details)
+        return BulkWriteResult(details, True)
+
+    def drop(self):
+        with self._lock:
+            self._docs.clear()
+            self._order.clear()
+            self._indexes.clear()
+            self._lookups.clear()
+
+
+def _update_raw(matched, modified, upserted_id):
+    raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified}
+    if upserted_id is not None:
+        raw["upserted"] = upserted_id
+    return raw
+
+
+def _bulk_details(inserted, matched, modified, upserted_count, upserted, errors):
+    return {
+        "writeErrors": errors,
+        "writeConcernErrors": [],
+        "nInserted": inserted,
+        "nUpserted": upserted_count,
+        "nMatched": matched,
+        "nModified": modified,
+        "nRemoved": 0,
+        "upserted": upserted,
+    }
+
+
+class MemoryDatabase:
+    """Collections kept in this process; see the note at the top."""
+
+    def __init__(self, name="memory"):
+        self.name = name
+        # One lock for the whole database makes every operation atomic,
+        # which is what find_one_and_update and the guarded updates rely on
+        self.lock = threading.RLock()
+        self._collections = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    def drop_collection(self, name):
+        self[name].drop()
+
+
+class Store:
+    """The database the repositories read and write."""
+
+    def __init__(self):
+        self.backend = "mongo"
+        self.memory = None
+
+    @property
+    def db(self):
+        return mongo.db if self.memory is None else self.memory
+
+    def use(self, backend, indexes=()):
+        """Switch to ``mongo`` or to a fresh, empty ``memory`` database."""
+        if backend == "memory":
+            memory = MemoryDatabase()
+            for collection, keys, options in indexes:
+                memory[collection].create_index(keys, **options)
+            self.memory = memory
+        elif backend == "mongo":
+            self.memory = None
+        else:
+            raise ValueError(f"Unknown DATA_BACKEND {backend!r}, expected mongo or memory")
+        self.backend = backend
+
+
+store = Store()
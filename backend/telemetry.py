@@ -0,0 +1,180 @@
+# Telemetry.py
+import json
+import logging
+import os
+import random
+import time
+from flask import g, has_request_context, request
+from pymongo import monitoring
+from backend.metrics import Counter, Histogram, register_collector
+
+# Request and MongoDB instrumentation, exported through /metrics:
+#
+#   http_request_duration_seconds{blueprint, endpoint, method}   histogram
+#   http_requests_total{blueprint, endpoint, method, status}      counter
+#   mongo_command_duration_seconds{collection, command, route}    histogram
+#   mongo_documents_total{collection, command, route}             counter
+#   mongo_command_failures_total{collection, command, route}      counter
+#
+# Labels are Flask endpoint names, never raw paths or ids, so the number of
+# series stays bounded. Streamed responses are timed until their headers.
+#
+# log_event() replaces ad-hoc prints: one JSON line per event, sampled and
+# with every string field capped, so a busy endpoint cannot flood the logs.
+
+logger = logging.getLogger("tripplanner")
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+settings = {
+    "sample_rate": 0.01,
+    "field_chars": 200,
+    "slow_request_seconds": 1.0,
+}
+
+request_seconds = register_collector(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time to produce a response.",
+        ("blueprint", "endpoint", "method"),
+        REQUEST_BUCKETS,
+    )
+)
+requests_total = register_collector(
+    Counter("http_requests_total", "Responses sent.", ("blueprint", "endpoint", "method", "status"))
+)
+command_seconds = register_collector(
+    Histogram(
+        "mongo_command_duration_seconds",
+        "MongoDB command round trips.",
+        ("collection", "command", "route"),
+        COMMAND_BUCKETS,
+    )
+)
+documents_total = register_collector(
+    Counter(
+        "mongo_documents_total",
+        "Documents returned, counted or written by MongoDB commands.",
+        ("collection", "command", "route"),
+    )
+)
+command_failures = register_collector(
+    Counter("mongo_command_failures_total", "MongoDB commands that failed.", ("collection", "command", "route"))
+)
+log_events = register_collector(
+    Counter("log_events_total", "Structured log events, by whether they were written.", ("event", "written"))
+)
+
+
+def _cap(value, limit):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + f"...(+{len(value) - limit} chars)"
+    return value
+
+
+def log_event(event, level=logging.INFO, sample_rate=None, **fields):
+    """Write ``event`` as one JSON line, keeping a sample_rate share of them.
+
+    sample_rate defaults to the LOG_SAMPLE_RATE setting; pass 1 for events
+    that must always be written.
+    """
+    rate = settings["sample_rate"] if sample_rate is None else sample_rate
+    written = rate >= 1 or random.random() < rate
+    log_events.inc(event, "true" if written else "false")
+    if not written or not logger.isEnabledFor(level):
+        return
+    record = {"event": event}
+    record.update((key, _cap(value, settings["field_chars"])) for key, value in fields.items())
+    logger.log(level, json.dumps(record, default=str))
+
+
+def _labels():
+    return request.blueprint or "app", request.endpoint or "unmatched", request.method
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_request(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    labels = _labels()
+    request_seconds.observe(elapsed, *labels)
+    requests_total.inc(*labels, str(response.status_code))
+    # Errors and slow requests are always logged, the rest sampled
+    always = response.status_code >= 500 or elapsed >= settings["slow_request_seconds"]
+    log_event(
+        "request",
+        sample_rate=1 if always else None,
+        endpoint=labels[1],
+        method=labels[2],
+        path=request.path,
+        status=response.status_code,
+        ms=round(elapsed * 1000, 1),
+    )
+    return response
+
+
+def _route():
+    return (request.endpoint or "unmatched") if has_request_context() else "none"
+
+
+def _returned(reply):
+    # Documents in a cursor batch, or the n of counts and writes
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    if "values" in reply:
+        return len(reply["values"])
+    if "value" in reply:
+        return int(reply["value"] is not None)
+    n = reply.get("n", 0)
+    return n if isinstance(n, int) else 0
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Per collection and route MongoDB timings, passed to the MongoClient."""
+
+    def __init__(self):
+        # started() runs on the request's thread, the others may not, so
+        # the route is carried over by request and connection id
+        self._pending = {}
+
+    def _labels(self, event):
+        return self._pending.pop((event.connection_id, event.request_id), ("-", event.command_name, "none"))
+
+    def started(self, event):
+        name = "collection" if event.command_name == "getMore" else event.command_name
+        collection = event.command.get(name)
+        if not isinstance(collection, str):
+            collection = "-"
+        self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name, _route())
+
+    def succeeded(self, event):
+        labels = self._labels(event)
+        command_seconds.observe(event.duration_micros / 1e6, *labels)
+        documents_total.inc(*labels, amount=_returned(event.reply))
+
+    def failed(self, event):
+        labels = self._labels(event)
+        command_seconds.observe(event.duration_micros / 1e6, *labels)
+        command_failures.inc(*labels)
+
+
+command_metrics = CommandMetrics()
+
+
+def init_app(app):
+    settings.update(
+        sample_rate=float(app.config.get("LOG_SAMPLE_RATE", os.getenv("LOG_SAMPLE_RATE", "0.01"))),
+        field_chars=int(app.config.get("LOG_FIELD_CHARS", os.getenv("LOG_FIELD_CHARS", "200"))),
+        slow_request_seconds=float(
+            app.config.get("SLOW_REQUEST_SECONDS", os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+        ),
+    )
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
@@ -1,23 +1,50 @@
-import pytest
-from flask import json
-from app import app as flask_app
-from models import mongo
-
-
-@pytest.fixture
-def app():
-    flask_app.config["TESTING"] = True
-    flask_app.config["MONGO_URI"] = "mongodb://localhost:27017/testdb"
-    mongo.init_app(flask_app)
-
-    with flask_app.app_context():
-        # Setup database
-        mongo.db.users.drop()
-        mongo.db.trips.drop()
-        mongo.db.itineraries.drop()
-        mongo.db.chatrooms.drop()
-        mongo.db.budgets.drop()
+import json
+import logging
 
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from app import create_app
+from backend import events, telemetry
+from backend.indexes import IndexBuildError
+from backend.repositories import itinerary_items, trips
+from backend.store import store
+
+MONGO_URI = "mongodb://localhost:27017/tripplanner_test_app"
+PASSWORD = "Testpassword1"
+
+
+def mongo_available():
+    try:
+        MongoClient(MONGO_URI, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except ServerSelectionTimeoutError:
+        return False
+
+
+@pytest.fixture(
+    params=[
+        "memory",
+        pytest.param("mongo", marks=pytest.mark.skipif(not mongo_available(), reason="needs a local mongod")),
+    ]
+)
+def app(request, monkeypatch):
+    # auth reads the signing key from the environment
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    flask_app = create_app(
+        {
+            "TESTING": True,
+            "DATA_BACKEND": request.param,
+            "MONGO_URI": MONGO_URI,
+            "SECRET_KEY": "test-secret",
+            "ENSURE_INDEXES": False,
+        }
+    )
+    if request.param == "mongo":
+        with flask_app.app_context():
+            store.db.client.drop_database(store.db.name)
     yield flask_app
 
 
@@ -26,266 +53,283 @@ def client(app):
     return app.test_client()
 
 
-def register_user(client, username, password, email):
+def signup(client, username, password=PASSWORD, email=None):
     return client.post(
-        "/auth/register",
-        data=json.dumps({"username": username, "password": password, "email": email}),
-        content_type="application/json",
+        "/auth/signup",
+        data={"username": username, "password": password, "email": email or f"{username}@example.com"},
     )
 
 
-def login_user(client, username, password):
-    return client.post(
-        "/auth/login",
-        data=json.dumps({"username": username, "password": password}),
-        content_type="application/json",
-    )
+def login(client, username, password=PASSWORD):
+    return client.post("/auth/admit", data={"username": username, "password": password})
 
 
-def test_register(client):
-    rv = register_user(client, "testuser", "testpassword", "test@example.com")
-    assert rv.status_code == 201
-    json_data = rv.get_json()
-    assert "user_id" in json_data
+def create_trip(client, name="Test Trip"):
+    response = client.post("/itinerary/new", data={"trip_name": name})
+    assert response.status_code == 302
+    return response.headers["Location"].rstrip("/").rsplit("/", 1)[1]
+
+
+def test_signup_sets_the_token_cookie(client):
+    rv = signup(client, "testuser")
+
+    assert rv.status_code == 302
+    assert rv.headers["Location"].endswith("/mainpage/testuser")
+    assert client.get_cookie("x-access-token") is not None
 
 
-def test_login(client):
-    register_user(client, "testuser", "testpassword", "test@example.com")
-    rv = login_user(client, "testuser", "testpassword")
+def test_signup_rejects_a_weak_password(app, client):
+    rv = signup(client, "testuser", password="weak")
+
     assert rv.status_code == 200
-    json_data = rv.get_json()
-    assert "token" in json_data
+    assert client.get_cookie("x-access-token") is None
+    with app.app_context():
+        assert store.db.users.count_documents({}) == 0
+
+
+def test_login(app):
+    signup(app.test_client(), "testuser")
+    client = app.test_client()
+
+    assert login(client, "testuser", "Wrongpassword1").status_code == 200
+    assert client.get_cookie("x-access-token") is None
+
+    rv = login(client, "testuser")
+    assert rv.status_code == 302
+    assert client.get_cookie("x-access-token") is not None
+    assert client.get("/mainpage/testuser").status_code == 200
+
+
+def test_pages_need_the_cookie(app, client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+
+    assert client.get(f"/trip/{trip_id}").status_code == 200
+    assert app.test_client().get(f"/trip/{trip_id}").status_code == 401
 
 
 def test_add_message(client):
-    register_user(client, "testuser", "testpassword", "test@example.com")
-    login_response = login_user(client, "testuser", "testpassword")
-    token = login_response.get_json()["token"]
-    trip_id = mongo.db.trips.insert_one(
-        {
-            "trip_name": "Test Trip",
-            "trip_owner": mongo.db.users.find_one({"username": "testuser"})["_id"],
-            "members": [],
-            "itinerary_id": None,
-            "chatroom_id": None,
-            "budget_id": None,
-        }
-    ).inserted_id
+    signup(client, "testuser")
+    trip_id = create_trip(client)
 
-    rv = client.post(
-        f"/chat/{trip_id}/messages",
-        headers={"x-access-token": token},
-        data=json.dumps({"message": "Hello, this is a test message."}),
-        content_type="application/json",
-    )
+    rv = client.post(f"/chat/{trip_id}/messages", data={"message": "Hello, this is a test message."})
 
     assert rv.status_code == 201
-    json_data = rv.get_json()
-    assert json_data["message"] == "Message added"
+    assert rv.get_json()["message"] == "Message added"
+    page = client.get(f"/chat/{trip_id}/messages").get_json()
+    assert [m["message"] for m in page["messages"]] == ["Hello, this is a test message."]
+    assert client.get(f"/chat/{trip_id}/messages?after={page['newest']}").get_json()["messages"] == []
+    assert client.get(f"/chat/{trip_id}/messages?after=abc").status_code == 400
 
 
-def test_create_poll(client):
-    register_user(client, "testuser", "testpassword", "test@example.com")
-    login_response = login_user(client, "testuser", "testpassword")
-    token = login_response.get_json()["token"]
-    trip_id = mongo.db.trips.insert_one(
-        {
-            "trip_name": "Test Trip",
-            "trip_owner": mongo.db.users.find_one({"username": "testuser"})["_id"],
-            "members": [],
-            "itinerary_id": None,
-            "chatroom_id": None,
-            "budget_id": None,
-        }
-    ).inserted_id
+def test_chat_messages_are_logged_without_their_text(client, caplog, monkeypatch):
+    monkeypatch.setitem(telemetry.settings, "sample_rate", 1)
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    caplog.set_level(logging.INFO, logger="tripplanner")
 
-    rv = client.post(
-        f"/chat/{trip_id}/polls",
-        headers={"x-access-token": token},
-        data=json.dumps({"question": "Test poll?", "options": ["Yes", "No"]}),
-        content_type="application/json",
-    )
+    client.post(f"/chat/{trip_id}/messages", data={"message": "Door code is 4711"})
 
-    assert rv.status_code == 201
-    json_data = rv.get_json()
-    assert json_data["message"] == "Poll created"
+    records = [json.loads(r.getMessage()) for r in caplog.records if r.name == "tripplanner"]
+    logged = [r for r in records if r["event"] == "chat.message"]
+    assert [(r["seq"], r["length"]) for r in logged] == [(1, 17)]
+    assert not any("4711" in json.dumps(r) for r in records)
 
 
 def test_add_itinerary_item(client):
-    register_user(client, "testuser", "testpassword", "test@example.com")
-    login_response = login_user(client, "testuser", "testpassword")
-    token = login_response.get_json()["token"]
-    trip_id = mongo.db.trips.insert_one(
-        {
-            "trip_name": "Test Trip",
-            "trip_owner": mongo.db.users.find_one({"username": "testuser"})["_id"],
-            "members": [],
-            "itinerary_id": None,
-            "chatroom_id": None,
-            "budget_id": None,
-        }
-    ).inserted_id
+    signup(client, "testuser")
+    trip_id = create_trip(client)
 
     rv = client.post(
         f"/itinerary/{trip_id}/items",
-        headers={"x-access-token": token},
-        data=json.dumps(
-            {
-                "activity": "Test activity",
-                "location": "Test location",
-                "time": "2024-07-12T12:00:00",
-                "notes": "Test notes",
-            }
-        ),
-        content_type="application/json",
+        json={
+            "activity": "Test activity",
+            "location": "Test location",
+            "time": "2024-07-12T12:00:00",
+            "notes": "Test notes",
+        },
     )
 
     assert rv.status_code == 201
-    json_data = rv.get_json()
-    assert json_data["message"] == "Itinerary item added"
+    assert rv.get_json()["item"]["activity"] == "Test activity"
+
+
+def test_multi_day_items_are_accepted_and_conflict(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    hotel = {"activity": "Hotel", "location": "Rome", "time": "2024-07-12T15:00", "end": "2024-07-15T11:00"}
+    tour = {"activity": "Tour", "location": "Rome", "time": "2024-07-14T10:00", "duration": 120}
+
+    assert client.post(f"/itinerary/{trip_id}/items", json=hotel).status_code == 201
+    rv = client.post(f"/itinerary/{trip_id}/items", json=tour)
+
+    assert rv.status_code == 201
+    assert [item["activity"] for item in rv.get_json()["conflicts"]] == ["Hotel"]
+
+
+def test_older_trips_check_conflicts_against_every_item(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    # A trip from before max_item_seconds, with an item stored back then
+    store.db.itineraries.update_one(
+        {"_id": ObjectId(trip_id)}, {"$unset": {"max_item_seconds": "", "item_spans_complete": ""}}
+    )
+    hotel = {"activity": "Hotel", "location": "Rome", "time": "2024-07-10T15:00", "end": "2024-07-15T11:00"}
+    assert client.post(f"/itinerary/{trip_id}/items", json=hotel).status_code == 201
+    store.db.itineraries.update_one({"_id": ObjectId(trip_id)}, {"$set": {"max_item_seconds": 3600}})
+    tour = {"activity": "Tour", "location": "Rome", "time": "2024-07-14T10:00", "duration": 120}
+
+    rv = client.post(f"/itinerary/{trip_id}/items", json=tour)
+
+    assert [item["activity"] for item in rv.get_json()["conflicts"]] == ["Hotel"]
+    assert itinerary_items.count_spans() == 1
+    assert store.db.itineraries.find_one({"_id": ObjectId(trip_id)})["max_item_seconds"] == 5 * 86400 - 4 * 3600
+
+
+def test_import_keeps_the_rows_read_before_an_unreadable_byte(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    rows = "".join(f"Museum {i},Paris,2024-07-12T{i % 24:02d}:00:00\n" for i in range(400))
+    body = ("activity,location,time\n" + rows).encode() + b"Caf\xe9,Paris,2024-07-13T09:00:00\n"
+
+    rv = client.post(f"/itinerary/{trip_id}/import?format=csv", data=body, content_type="text/csv")
+
+    assert rv.status_code == 400
+    assert rv.get_json()["error"].startswith("Could not read the file")
+    imported = rv.get_json()["imported"]
+    assert 0 < imported <= 400
+    assert store.db.itinerary_items.count_documents({"trip_id": ObjectId(trip_id)}) == imported
 
 
 def test_add_expense(client):
-    register_user(client, "testuser", "testpassword", "test@example.com")
-    login_response = login_user(client, "testuser", "testpassword")
-    token = login_response.get_json()["token"]
-    trip_id = mongo.db.trips.insert_one(
-        {
-            "trip_name": "Test Trip",
-            "trip_owner": mongo.db.users.find_one({"username": "testuser"})["_id"],
-            "members": [],
-            "itinerary_id": None,
-            "chatroom_id": None,
-            "budget_id": None,
-        }
-    ).inserted_id
+    signup(client, "testuser")
+    trip_id = create_trip(client)
 
     rv = client.post(
         f"/budget/{trip_id}/expenses",
-        headers={"x-access-token": token},
-        data=json.dumps(
-            {
-                "category": "Test category",
-                "amount": 100.0,
-                "description": "Test description",
-            }
-        ),
-        content_type="application/json",
+        json={"category": "food", "amount": 100.0, "description": "Test description"},
     )
 
     assert rv.status_code == 201
-    json_data = rv.get_json()
-    assert json_data["message"] == "Expense added"
-
-
-# import requests
-
-# BASE_URL = "http://127.0.0.1:5000"
-
-
-# def test_register():
-#     url = f"{BASE_URL}/auth/register"
-#     payload = {
-#         "username": "testuser",
-#         "password": "Test@1234",
-#         "email": "testuser@example.com",
-#     }
-#     response = requests.post(url, json=payload)
-#     print("Raw Register Response Content:", response.text)
-#     try:
-#         print("Register Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-
-
-# def test_login():
-#     url = f"{BASE_URL}/auth/login"
-#     payload = {"username": "testuser", "password": "Test@1234"}
-#     response = requests.post(url, json=payload)
-#     print("Raw Login Response Content:", response.text)
-#     try:
-#         print("Login Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-#     return response.json().get("token")
-
-
-# def test_chat(token):
-#     url = f"{BASE_URL}/chat/1/messages"
-#     headers = {"x-access-token": token}
-#     payload = {"message": "Hello, World!"}
-#     response = requests.post(url, headers=headers, json=payload)
-#     print("Raw Chat Response Content:", response.text)
-#     try:
-#         print("Chat Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-#     return response.json().get("message")
-
-
-# def test_poll(token):
-#     url = f"{BASE_URL}/chat/1/polls"
-#     headers = {"x-access-token": token}
-#     payload = {
-#         "question": "What is your favorite color?",
-#         "options": ["Red", "Green", "Blue"],
-#     }
-#     response = requests.post(url, headers=headers, json=payload)
-#     print("Raw Poll Response Content:", response.text)
-#     try:
-#         print("Poll Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-#     return response.json().get("message")
-
-
-# def test_protected(token):
-#     url = f"{BASE_URL}/protected"
-#     headers = {"x-access-token": token}
-#     response = requests.get(url, headers=headers)
-#     print("Raw Protected Response Content:", response.text)
-#     try:
-#         print("Protected Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-
-
-# def test_itenerary(token):
-#     url = f"{BASE_URL}/itinerary/1/items"
-#     headers = {"x-access-token": token}
-#     payload = {
-#         "activity": "Hiking",
-#         "location": "Mount Everest",
-#         "time": "2021-12-31T23:59:59",
-#         "notes": "Bring water and snacks",
-#     }
-#     response = requests.post(url, headers=headers, json=payload)
-#     print("Raw Itinerary Response Content:", response.text)
-#     try:
-#         print("Itinerary Response JSON:", response.json())
-#     except requests.exceptions.JSONDecodeError as e:
-#         print("Failed to decode JSON response:", e)
-#     return response.json().get("message")
-
-
-# if __name__ == "__main__":
-#     print("Testing User Registration:")
-#     test_register()
-
-#     print("\nTesting User Login:")
-#     token = test_login()
-
-#     # if token:
-#     #     print("\nTesting Protected Route with Valid Token:")
-#     #     test_protected(token)
-#     # else:
-#     #     print("\nLogin failed, cannot test protected route.")
-
-#     print("\nTesting Chat:")
-#     test_chat(token)
-
-#     print("\nTesting Poll:")
-#     test_poll(token)
-
-#     print("\nTesting Itinerary:")
-#     test_itenerary(token)
+    assert rv.get_json()["message"] == "Expense added"
+
+    outsider = {"category": "food", "amount": 5.0, "description": "Taxi", "payer_id": str(ObjectId())}
+    rv = client.post(f"/budget/{trip_id}/expenses", json=outsider)
+    assert rv.status_code == 400
+    rv = client.post(f"/budget/{trip_id}/expenses/bulk", json=[outsider])
+    assert rv.status_code == 400 and rv.get_json()["errors"][0]["error"] == "Payer is not a member of the trip"
+
+
+def test_budget_of_a_trip_without_budget_rows_is_empty(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    store.db.itineraries.update_one({"_id": ObjectId(trip_id)}, {"$set": {"budget": []}})
+
+    assert client.get(f"/trip/{trip_id}/budget").status_code == 200
+    summary = client.get(f"/budget/{trip_id}/summary").get_json()
+    assert summary["members"] == [] and summary["total"] == 0
+    assert client.get("/trip/000000000000000000000000/budget").status_code == 404
+
+
+def test_bulk_expenses_stop_at_an_unreadable_line(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    line = b'{"category": "food", "description": "Lunch", "amount": 1.5}\n'
+    body = line * 1005 + b'{"category": "food", "description": "Caf\xff", "amount": 2}\n' + line * 3
+
+    rv = client.post(f"/budget/{trip_id}/expenses/bulk", data=body, content_type="application/x-ndjson")
+
+    assert rv.status_code == 201
+    assert rv.get_json()["inserted"] == 1005
+    assert [error["index"] for error in rv.get_json()["errors"]] == [1005]
+    assert store.db.balances.find_one({"_id": ObjectId(trip_id)})["total"] == 1005 * 150
+    log = store.db.trip_events.find_one({"_id": ObjectId(trip_id)})
+    assert log["events"][-1]["kind"] == "expense"
+
+
+def test_index_failures_do_not_fail_requests(monkeypatch):
+    calls = []
+
+    def refuse(db=None):
+        calls.append(db)
+        raise IndexBuildError([("trip_name_unique", "E11000 duplicate key error")])
+
+    monkeypatch.setattr("app.ensure_indexes", refuse)
+    client = create_app({"TESTING": True, "DATA_BACKEND": "memory", "ENSURE_INDEXES": True}).test_client()
+
+    assert client.get("/").status_code == 200
+    assert client.get("/").status_code == 200
+    assert len(calls) == 1
+
+
+def test_memory_backend_needs_testing_mode():
+    with pytest.raises(ValueError, match="TESTING"):
+        create_app({"DATA_BACKEND": "memory", "ENSURE_INDEXES": False})
+
+
+def test_event_streams_are_bounded(app, client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    app.config["EVENT_STREAMS"] = 0
+    events.init_app(app)
+
+    assert client.get("/events/000000000000000000000000/stream").status_code == 404
+    assert client.get(f"/events/{trip_id}/stream").status_code == 204
+
+
+def test_trip_views_answer_304_until_the_trip_changes(client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    # The first page shows the "Trip created" flash and is not tagged
+    assert client.get(f"/trip/{trip_id}").get_etag() == (None, None)
+    urls = [
+        f"/trip/{trip_id}",
+        f"/trip/{trip_id}/itinerary",
+        f"/trip/{trip_id}/budget",
+        f"/trip/{trip_id}/chat",
+        f"/chat/{trip_id}/messages",
+    ]
+    tags = {url: client.get(url).headers["ETag"] for url in urls}
+
+    for url, tag in tags.items():
+        rv = client.get(url, headers={"If-None-Match": tag})
+        assert rv.status_code == 304, url
+        assert rv.headers["ETag"] == tag
+
+    client.post(f"/chat/{trip_id}/messages", data={"message": "hi"})
+    for url, tag in tags.items():
+        rv = client.get(url, headers={"If-None-Match": tag})
+        assert rv.status_code == 200, url
+        assert rv.headers["ETag"] != tag
+
+
+def test_writes_bump_the_trip_revision(app, client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    with app.app_context():
+
+        def revision():
+            return trips.revision(trip_id)
+
+        assert revision() == 0
+        client.post(f"/chat/{trip_id}/messages", data={"message": "hi"})
+        assert revision() == 1
+        client.post(
+            f"/itinerary/{trip_id}/items", json={"activity": "Museum", "location": "Louvre", "time": "2024-07-12T12:00:00"}
+        )
+        assert revision() == 2
+        client.post(f"/budget/{trip_id}/expenses", json={"category": "food", "amount": 10.0, "description": "Lunch"})
+        assert revision() == 3
+        signup(app.test_client(), "other")
+        client.post(f"/itinerary/{trip_id}/members", json={"usernames": ["other"]})
+        assert revision() == 4
+
+
+def test_tags_differ_per_user(app, client):
+    signup(client, "testuser")
+    trip_id = create_trip(client)
+    client.get(f"/trip/{trip_id}")
+    other = app.test_client()
+    signup(other, "other")
+
+    assert client.get(f"/trip/{trip_id}").headers["ETag"] != other.get(f"/trip/{trip_id}").headers["ETag"]
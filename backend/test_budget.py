@@ -0,0 +1,80 @@
+from bson import ObjectId
+
+from backend.indexes import INDEXES
+from backend.memberships import BUDGET_FIELDS
+from backend.repositories import _finish_summary, budgets, summary_pipeline
+from backend.store import store
+
+
+def test_summary_adds_category_totals_and_averages():
+    doc = {
+        "_id": ObjectId(),
+        "trip_name": "Test Trip",
+        "members": [],
+        "flight": 500,
+        "hotel": 700,
+        "food": 300,
+        "transport": 200,
+        "activities": 300,
+        "spending": 180,
+        "total": 2180,
+        "member_count": 2,
+    }
+    summary = _finish_summary(doc)
+
+    assert summary["categories"]["hotel"] == 700
+    assert summary["average"]["hotel"] == 350
+    assert summary["average"]["total"] == 1090
+    assert "member_count" not in summary
+
+
+def test_pipeline_matches_every_requested_trip():
+    trip_ids = [ObjectId(), ObjectId()]
+    pipeline = summary_pipeline(trip_ids)
+
+    assert pipeline[0] == {"$match": {"_id": {"$in": trip_ids}}}
+    group = pipeline[-1]["$group"]
+    assert set(BUDGET_FIELDS) <= set(group)
+
+
+def test_summary_pipeline_runs_on_the_memory_store():
+    store.use("memory", INDEXES)
+    alice, bob, gone = ObjectId(), ObjectId(), ObjectId()
+    store.db.users.insert_many([{"_id": alice, "username": "alice"}, {"_id": bob, "username": "bob"}])
+    budget = [
+        {"user_id": alice, "flight": 500, "hotel": 300},
+        {"user_id": bob, "hotel": 100, "food": None},
+        {"user_id": gone, "hotel": 999},
+    ]
+    trip_id = store.db.itineraries.insert_one({"trip_name": "Rome", "invite_code": "ROME01", "budget": budget}).inserted_id
+    empty_id = store.db.itineraries.insert_one({"trip_name": "Oslo", "invite_code": "OSLO01", "budget": []}).inserted_id
+
+    summaries = budgets.summaries([trip_id, empty_id])
+
+    assert list(summaries) == [trip_id]
+    summary = summaries[trip_id]
+    assert [(row["username"], row["total"], row["food"]) for row in summary["members"]] == [
+        ("alice", 800, 0),
+        ("bob", 100, 0),
+    ]
+    assert summary["categories"]["hotel"] == 400
+    assert summary["average"]["total"] == 450
+
+
+def test_balances_pipeline_rebuilds_the_running_totals():
+    store.use("memory", INDEXES)
+    trip_id, alice, bob = ObjectId(), ObjectId(), ObjectId()
+    store.db.expenses.insert_many(
+        [
+            {"trip_id": trip_id, "payer_id": alice, "amount": 10.1},
+            {"trip_id": trip_id, "payer_id": alice, "amount": 0.2},
+            {"trip_id": trip_id, "payer_id": bob, "amount": 5},
+        ]
+    )
+
+    budgets.rebuild_balances()
+
+    balances = store.db.balances.find_one({"_id": trip_id})
+    assert balances["paid"] == {str(alice): 1030, str(bob): 500}
+    assert balances["total"] == 1530
+    assert all(type(cents) is int for cents in balances["paid"].values())
@@ -0,0 +1,77 @@
+from backend.cache import TTLCache
+from backend.indexes import INDEXES
+from backend.metrics import cache_collector, render
+from backend.repositories import principal_cache, users
+from backend.store import store
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=30, clock=clock)
+    cache.set("alice", {"username": "alice"})
+    assert cache.get("alice") == {"username": "alice"}
+
+    clock.now = 31
+    assert cache.get("alice") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 0, "weight": 0}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_weight_bound_evicts_oldest_entries():
+    cache = TTLCache(maxsize=100, ttl=30, maxweight=10, weigh=len)
+    cache.set("a", "xxxx")
+    cache.set("b", "xxxx")
+    cache.set("c", "xxxx")
+
+    assert cache.get("a") is None
+    assert cache.stats()["weight"] == 8
+
+
+def test_invalidate_where_matches_values():
+    cache = TTLCache()
+    cache.set("alice", {"_id": 1})
+    cache.set("bob", {"_id": 2})
+    cache.invalidate_where(lambda user: user["_id"] == 2)
+
+    assert cache.get("bob") is None
+    assert cache.get("alice") == {"_id": 1}
+
+
+def test_cache_counters_are_exported():
+    cache = TTLCache()
+    cache_collector("test_cache", cache)
+    cache.get("missing")
+
+    assert 'tripplanner_cache_misses_total{cache="test_cache"} 1' in render()
+
+
+def test_cached_principals_cannot_be_changed_by_callers():
+    store.use("memory", INDEXES)
+    principal_cache.clear()
+    store.db.users.insert_one({"username": "alice", "profile": {"trips": []}})
+    hits = principal_cache.hits
+
+    users.principal("alice")["profile"]["trips"].append("changed")
+    users.principal("alice")["profile"]["trips"].append("changed")
+
+    assert users.principal("alice")["profile"]["trips"] == []
+    assert principal_cache.hits - hits == 2
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from backend.indexes import INDEXES
+from backend.repositories import MESSAGE_GAP_SECONDS, chats
+from backend.store import store
+
+
+@pytest.fixture
+def chatroom():
+    store.use("memory", INDEXES)
+    return store.db.chatrooms.insert_one({"created_at": datetime.utcnow()}).inserted_id
+
+
+def message(chatroom, text, **fields):
+    return {
+        "chatroom_id": chatroom,
+        "user_id": ObjectId(),
+        "username": "alice",
+        "message": text,
+        "timestamp": datetime.utcnow(),
+        **fields,
+    }
+
+
+def test_messages_are_numbered_and_paged_by_seq(chatroom):
+    trip_id = ObjectId()
+    for text in ("one", "two", "three"):
+        chats.add(trip_id, message(chatroom, text))
+
+    newer, more = chats.page(chatroom, after=1, limit=1)
+    older, _ = chats.page(chatroom, before=3)
+
+    assert [(m["seq"], m["message"]) for m in newer] == [(2, "two")] and more
+    assert [m["message"] for m in older] == ["one", "two"]
+
+
+def test_pages_wait_for_a_message_whose_insert_is_pending(chatroom):
+    chats.add(ObjectId(), message(chatroom, "one"))
+    # seq 2 was taken by a request that has not inserted its message yet
+    store.db.chatrooms.update_one({"_id": chatroom}, {"$inc": {"message_seq": 1}})
+    chats.add(ObjectId(), message(chatroom, "three"))
+
+    assert chats.page(chatroom, after=1) == ([], False)
+    assert [m["seq"] for m in chats.page(chatroom)[0]] == [1]
+
+    # Long enough without it: the insert failed and the gap is skipped
+    stale = datetime.utcnow() - timedelta(seconds=MESSAGE_GAP_SECONDS + 1)
+    store.db.messages.update_one({"seq": 3}, {"$set": {"timestamp": stale}})
+    assert [m["seq"] for m in chats.page(chatroom, after=1)[0]] == [3]
+
+
+def test_older_messages_are_numbered_below_the_new_ones(chatroom):
+    store.db.messages.insert_many([message(chatroom, "first"), message(chatroom, "second")])
+    chats.add(ObjectId(), message(chatroom, "new"))
+
+    assert chats.number_messages(chatroom) == 2
+    assert [(m["seq"], m["message"]) for m in chats.page(chatroom)[0]] == [(-1, "first"), (0, "second"), (1, "new")]
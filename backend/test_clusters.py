@@ -0,0 +1,40 @@
+import random
+
+from backend.clusters import MAX_CLUSTER_ZOOM, build_levels, clusters_for
+
+BBOX = (48.7, 49.0, 2.2, 2.5)
+
+
+def city(count, seed):
+    rng = random.Random(seed)
+    return [
+        {"name": f"p{i}", "latitude": str(48.85 + rng.gauss(0, 0.02)), "longitude": str(2.35 + rng.gauss(0, 0.03))}
+        for i in range(count)
+    ]
+
+
+def test_every_level_keeps_every_place():
+    levels = build_levels(city(2000, 1))
+
+    for zoom, cells in levels.items():
+        assert sum(cell[0] for cell in cells.values()) == 2000
+
+
+def test_clusters_get_coarser_when_zooming_out():
+    levels = build_levels(city(2000, 2))
+
+    sizes = [len(levels[zoom]) for zoom in range(10, MAX_CLUSTER_ZOOM)]
+
+    assert sizes == sorted(sizes)
+    clusters, places = clusters_for([levels], 10, BBOX)
+    assert sum(c["count"] for c in clusters) + len(places) == 2000
+    assert len(clusters) + len(places) < 30
+
+
+def test_tiles_merge_into_shared_cells():
+    places = city(400, 3)
+    whole = clusters_for([build_levels(places)], 12, BBOX)
+    split = clusters_for([build_levels(places[:150]), build_levels(places[150:])], 12, BBOX)
+
+    assert sorted(c["count"] for c in whole[0]) == sorted(c["count"] for c in split[0])
+    assert len(whole[1]) == len(split[1])
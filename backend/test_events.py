@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+from bson import ObjectId
+
+from backend.events import EventBroker, format_sse
+from backend.indexes import INDEXES
+from backend.store import store
+
+
+@pytest.fixture(autouse=True)
+def memory_store():
+    store.use("memory", INDEXES)
+
+
+@pytest.fixture
+def trip():
+    return str(ObjectId())
+
+
+def test_wait_returns_events_after_id(trip):
+    broker = EventBroker()
+    broker.publish(trip, "message", {"message": "one"})
+    broker.publish(trip, "budget", {"food": 10})
+
+    events = broker.wait(trip, 1, timeout=0)
+    assert [(event_id, kind) for event_id, kind, _ in events] == [(2, "budget")]
+
+
+def test_wait_wakes_up_on_publish(trip):
+    broker = EventBroker()
+    broker.last_id(trip)
+    received = []
+
+    def subscriber():
+        received.extend(broker.wait(trip, 0, timeout=5))
+
+    thread = threading.Thread(target=subscriber)
+    thread.start()
+    broker.publish(trip, "itinerary", {"activity": "Museum"})
+    thread.join(5)
+
+    assert received == [(1, "itinerary", '{"activity": "Museum"}')]
+
+
+def test_events_published_by_another_worker_arrive_with_the_same_ids(trip):
+    # Two brokers over one database stand in for two gunicorn workers
+    here, there = EventBroker(), EventBroker()
+    assert here.last_id(trip) == 0
+    there.publish(trip, "message", {"message": "from the other worker"})
+    received = []
+
+    def subscriber():
+        received.extend(here.wait(trip, 0, timeout=5))
+
+    thread = threading.Thread(target=subscriber)
+    thread.start()
+    while not received and thread.is_alive():
+        here.pump()
+    thread.join(5)
+
+    assert [(event_id, kind) for event_id, kind, _ in received] == [(1, "message")]
+    # A stream resuming on the other worker picks up from the same id
+    here.publish(trip, "budget", {"food": 10})
+    assert [event_id for event_id, _, _ in there.wait(trip, 1, timeout=0)] == [2]
+
+
+def test_idle_topics_are_dropped(trip, monkeypatch):
+    broker = EventBroker()
+    broker.wait(trip, 0, timeout=0)
+    assert len(broker) == 1
+
+    monkeypatch.setattr("backend.events.IDLE_TOPIC_SECONDS", 0)
+    broker.pump()
+    assert len(broker) == 0
+
+
+def test_topics_are_isolated(trip):
+    broker = EventBroker()
+    broker.publish(trip, "message", {})
+    assert broker.wait(str(ObjectId()), 0, timeout=0) == []
+
+
+def test_format_sse():
+    assert format_sse(3, "message", "{}") == "id: 3\nevent: message\ndata: {}\n\n"
@@ -0,0 +1,90 @@
+import bisect
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from backend import gazetteer
+from backend.gazetteer import Gazetteer, SortedKeys, build, normalize, read_geonames
+from backend.schedule import build_item
+
+DUMP = [
+    # geonameid, name, asciiname, alternatenames, lat, lng, class, code, country, cc2,
+    # admin1-4, population, elevation, dem, timezone, modified
+    "2988507\tParis\tParis\tParigi,Parijs,Paryz\t48.85341\t2.3488\tP\tPPLC\tFR\t\t11\t75\t751\t75056\t2138551\t\t42\tEurope/Paris\t2024-01-01",
+    "4717560\tParis\tParis\t\t33.66094\t-95.55551\tP\tPPLA2\tUS\t\tTX\t277\t\t\t24171\t\t177\tAmerica/Chicago\t2024-01-01",
+    "2995469\tMarseille\tMarseille\tMarsella,Marsiglia\t43.29695\t5.38107\tP\tPPLA\tFR\t\t93\t13\t\t\t870731\t\t28\tEurope/Paris\t2024-01-01",
+    "3014728\tParis-l'Hôpital\tParis-l'Hopital\t\t46.91667\t4.63333\tP\tPPL\tFR\t\t27\t71\t\t\t289\t\t\tEurope/Paris\t2024-01-01",
+    "2643743\tLondon\tLondon\tLondres,Londra\t51.50853\t-0.12574\tP\tPPLC\tGB\t\tENG\tGLA\t\t\t8961989\t\t25\tEurope/London\t2024-01-01",
+    "3117735\tMálaga\tMalaga\t\t36.72016\t-4.42034\tP\tPPLA2\tES\t\t51\tMA\t\t\t592346\t\t\tEurope/Madrid\t2024-01-01",
+    "not a geonames line",
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    build(read_geonames(DUMP), tmp_path)
+    loaded = Gazetteer()
+    loaded.load(str(tmp_path))
+    return loaded
+
+
+def test_names_are_normalized():
+    assert normalize("  Paris-l'Hôpital ") == "paris l hopital"
+    assert normalize("MÁLAGA") == "malaga"
+
+
+def test_sorted_keys_bisect_like_bisect_left():
+    words = [b"", b"lon", b"london", b"london", b"malaga", b"paris"]
+    keys = SortedKeys(b"".join(words), np.cumsum([0] + [len(w) for w in words]))
+
+    for key in (b"", b"a", b"london", b"londres", b"paris", b"z"):
+        assert keys.bisect(key) == bisect.bisect_left(words, key)
+    assert keys.bisect(b"a", lo=3) == 3
+    assert keys.find(b"malaga") == 4 and keys.find(b"lond") is None
+
+
+def test_suggestions_are_ranked_by_population(index):
+    # "par" comes from the prefix table, "paris" from a key range scan
+    for query in ("Par", "paris"):
+        assert [p["name"] for p in index.suggest(query)] == ["Paris, FR", "Paris, US", "Paris-l'Hôpital, FR"]
+
+
+def test_prefix_table_matches_a_range_scan(index):
+    for query in ("p", "pa", "m", "l", "lo"):
+        assert index.suggest(query, limit=10) == index.suggest(query, limit=11)
+
+
+def test_alternate_names_and_accents_match(index):
+    assert index.suggest("Londr")[0]["name"] == "London, GB"
+    assert index.suggest("málag")[0]["name"] == "Málaga, ES"
+    assert index.suggest("xyz") == []
+
+
+def test_resolve_prefers_the_given_country(index):
+    assert index.resolve("Paris")["country"] == "FR"
+    assert index.resolve("Paris, US")["country"] == "US"
+    assert index.resolve("Paris, Texas")["country"] == "FR"
+    assert index.resolve("Parigi")["geonameid"] == 2988507
+    assert index.resolve("Atlantis") is None
+
+
+def test_unloaded_gazetteer_finds_nothing():
+    empty = Gazetteer()
+
+    assert empty.suggest("Paris") == []
+    assert empty.resolve("Paris") is None
+
+
+def test_typed_locations_are_geocoded(index, monkeypatch):
+    monkeypatch.setattr(gazetteer, "index", index)
+
+    item = build_item(ObjectId(), {"activity": "Vieux Port", "location": "Marseille", "time": "2022-07-15T10:00"})
+    pinned = build_item(
+        ObjectId(),
+        {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00", "latitude": "48.86", "longitude": "2.33"},
+    )
+
+    assert item["geonameid"] == 2995469
+    assert item["point"]["coordinates"] == [pytest.approx(5.38107), pytest.approx(43.29695)]
+    assert "geonameid" not in pinned
@@ -0,0 +1,49 @@
+import random
+
+import numpy as np
+import pytest
+
+from backend.geo import GeoIndex, distances_m
+
+
+def brute_force(points, lat, lng):
+    dist = distances_m(lat, lng, np.array([p[0] for p in points]), np.array([p[1] for p in points]))
+    return sorted(zip(dist.tolist(), range(len(points))))
+
+
+@pytest.fixture
+def city():
+    rng = random.Random(5)
+    points = [(48.85 + rng.uniform(-0.1, 0.1), 2.35 + rng.uniform(-0.15, 0.15)) for _ in range(3000)]
+    index = GeoIndex()
+    for key, (lat, lng) in enumerate(points):
+        index.add(key, lat, lng, key)
+    return points, index
+
+
+def test_within_matches_brute_force(city):
+    points, index = city
+
+    found = [key for _, key in index.within(48.86, 2.34, 1500)]
+
+    assert found == [key for d, key in brute_force(points, 48.86, 2.34) if d <= 1500]
+
+
+def test_nearest_matches_brute_force(city):
+    points, index = city
+
+    for lat, lng in [(48.85, 2.35), (48.949, 2.49), (49.5, 2.35)]:
+        found = [key for _, key in index.nearest(lat, lng, 15)]
+        assert found == [key for _, key in brute_force(points, lat, lng)[:15]]
+
+
+def test_entries_can_move_and_be_removed():
+    index = GeoIndex()
+    index.add("a", 48.85, 2.35, "a")
+    index.add("a", 40.71, -74.0, "a")
+    index.add("b", 48.85, 2.35, "b")
+    index.remove("b")
+
+    assert [value for _, value in index.nearest(48.85, 2.35, 5)] == ["a"]
+    assert index.within(48.85, 2.35, 10000) == []
+    assert len(index) == 1
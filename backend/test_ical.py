@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+from backend.ical import InvalidCalendar, calendar_footer, calendar_header, format_event, parse_events
+from backend.schedule import build_item
+
+CALENDAR = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:louvre@example.com\r
+DTSTART;TZID=Europe/Paris:20220715T100000\r
+DURATION:PT1H30M\r
+SUMMARY:Louvre\\, then lunch\r
+LOCATION:Paris\r
+DESCRIPTION:Tickets are in the shared folder and the meeting point is the p\r
+ yramid\r
+GEO:48.8606;2.3376\r
+BEGIN:VALARM\r
+ACTION:DISPLAY\r
+DESCRIPTION:Reminder\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:No start\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+def test_events_are_parsed_into_items():
+    louvre, broken = list(parse_events(CALENDAR.splitlines(keepends=True)))
+
+    assert louvre["activity"] == "Louvre, then lunch"
+    assert louvre["time"] == datetime(2022, 7, 15, 10)
+    assert louvre["end"] == datetime(2022, 7, 15, 11, 30)
+    assert louvre["notes"].endswith("the pyramid")
+    assert (louvre["latitude"], louvre["longitude"]) == ("48.8606", "2.3376")
+    assert isinstance(broken, InvalidCalendar)
+    item = build_item(ObjectId(), louvre)
+    assert item["uid"] == "louvre@example.com"
+
+
+def test_exported_events_parse_back():
+    exported = (
+        calendar_header("Test Trip")
+        + format_event(
+            "x@tripplanner421",
+            datetime(2022, 7, 15, 10),
+            datetime(2022, 7, 15, 11),
+            "Café; with a very long name that needs folding over more than one content line",
+            "Paris, France",
+            "Line one\nLine two",
+        )
+        + calendar_footer()
+    )
+
+    assert all(len(line.encode()) <= 75 for line in exported.split("\r\n"))
+    (event,) = parse_events(exported.splitlines(keepends=True))
+    assert event["activity"].startswith("Café; with")
+    assert event["location"] == "Paris, France"
+    assert event["notes"] == "Line one\nLine two"
@@ -0,0 +1,39 @@
+import pytest
+
+from backend.indexes import IndexBuildError, ensure_indexes, plan_stages, query_planner
+from backend.store import MemoryDatabase
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [
+                {"stage": "IXSCAN", "indexName": "username_unique"},
+                {"stage": "COLLSCAN"},
+            ],
+        },
+    }
+    assert sorted(plan_stages(plan)) == ["COLLSCAN", "FETCH", "IXSCAN", "OR"]
+
+
+def test_query_planner_of_a_pushed_down_geo_near():
+    planner = {"winningPlan": {"stage": "GEO_NEAR_2DSPHERE", "indexName": "trip_point"}}
+    explain = {"stages": [{"$geoNearCursor": {"queryPlanner": planner}}, {"$limit": 20}]}
+
+    assert query_planner(explain) is planner
+    assert query_planner({"queryPlanner": planner}) is planner
+
+
+
+def test_a_refused_index_does_not_stop_the_others():
+    db = MemoryDatabase()
+    db.itineraries.insert_many([{"trip_name": "Rome", "invite_code": "A"}, {"trip_name": "Rome", "invite_code": "B"}])
+
+    with pytest.raises(IndexBuildError) as e:
+        ensure_indexes(db)
+
+    assert [name for name, _ in e.value.failures] == ["trip_name_unique"]
+    assert "invite_code_unique" in db.itineraries.index_information()
+    assert "trip_day_time" in db.itinerary_items.index_information()
@@ -0,0 +1,33 @@
+import random
+
+from backend.intervals import find_overlaps
+
+
+def brute_force(intervals):
+    return {
+        frozenset((a[2], b[2]))
+        for i, a in enumerate(intervals)
+        for b in intervals[i + 1 :]
+        if a[0] < b[1] and b[0] < a[1] and a[0] < a[1] and b[0] < b[1]
+    }
+
+
+def random_intervals(count, seed):
+    rng = random.Random(seed)
+    intervals = []
+    for key in range(count):
+        start = rng.randint(0, 2000)
+        intervals.append((start, start + rng.randint(0, 120), key))
+    return intervals
+
+
+def test_sweep_finds_the_same_pairs_as_brute_force():
+    intervals = random_intervals(300, 1)
+
+    pairs = {frozenset(pair) for pair in find_overlaps(intervals)}
+
+    assert pairs == brute_force(intervals)
+
+
+def test_touching_intervals_do_not_overlap():
+    assert list(find_overlaps([(0, 60, "a"), (60, 120, "b")])) == []
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from backend.ledger import InvalidExpense, build_expense, decode_cursor, encode_cursor, expense_query
+
+
+def test_build_expense_defaults_payer_and_rounds_amount():
+    trip_id, payer = ObjectId(), ObjectId()
+    expense = build_expense(
+        str(trip_id), {"category": "food", "description": "Dinner", "amount": "12.345"}, payer
+    )
+
+    assert expense["trip_id"] == trip_id
+    assert expense["payer_id"] == payer
+    assert expense["amount"] == 12.35
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        None,
+        {"description": "Dinner", "amount": 10},
+        {"category": "food", "description": "Dinner", "amount": -1},
+        {"category": "food", "description": "Dinner", "amount": "ten"},
+        {"category": "food", "description": "Dinner", "amount": 10, "payer_id": "nope"},
+    ],
+)
+def test_build_expense_rejects_bad_input(data):
+    with pytest.raises(InvalidExpense):
+        build_expense(str(ObjectId()), data, ObjectId())
+
+
+def test_build_expense_refuses_payers_outside_the_trip():
+    member, outsider = ObjectId(), ObjectId()
+    data = {"category": "food", "description": "Dinner", "amount": 10}
+
+    assert build_expense(str(ObjectId()), data, member, {member})["payer_id"] == member
+    with pytest.raises(InvalidExpense, match="member"):
+        build_expense(str(ObjectId()), dict(data, payer_id=str(outsider)), member, {member})
+    with pytest.raises(InvalidExpense, match="member"):
+        build_expense(str(ObjectId()), data, outsider, {member})
+
+
+def test_cursor_round_trip_continues_after_last_expense():
+    expense = {"_id": ObjectId(), "created_at": datetime(2024, 5, 1, 12, 30)}
+    cursor = encode_cursor(expense)
+
+    assert decode_cursor(cursor) == (expense["created_at"], expense["_id"])
+    query = expense_query(str(ObjectId()), after=cursor)
+    assert query["$or"][1] == {"created_at": expense["created_at"], "_id": {"$gt": expense["_id"]}}
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+from app import create_app
+from backend.repositories import trips
+from backend.store import store
+
+MONGO_URI = "mongodb://localhost:27017/tripplanner_test_memberships"
+JOINERS = 300
+
+
+def mongo_available():
+    try:
+        MongoClient(MONGO_URI, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except ServerSelectionTimeoutError:
+        return False
+
+
+@pytest.fixture(
+    params=[
+        "memory",
+        pytest.param("mongo", marks=pytest.mark.skipif(not mongo_available(), reason="needs a local mongod")),
+    ]
+)
+def app(request):
+    flask_app = create_app(
+        {"TESTING": True, "DATA_BACKEND": request.param, "MONGO_URI": MONGO_URI, "ENSURE_INDEXES": False}
+    )
+    with flask_app.app_context():
+        for name in ("users", "itineraries"):
+            store.db[name].drop()
+        yield flask_app
+
+
+def make_trip(owner_id):
+    return store.db.itineraries.insert_one(
+        {"trip_name": "Race", "users": [owner_id], "budget": [], "invite_code": "RACE01"}
+    ).inserted_id
+
+
+def test_simultaneous_joins_add_each_user_once(app):
+    owner_id = ObjectId()
+    trip_id = make_trip(owner_id)
+    user_ids = store.db.users.insert_many(
+        [{"username": f"user{i}", "profile": {"trips": []}} for i in range(JOINERS)]
+    ).inserted_ids
+    # Every user joins twice at the same moment
+    barrier = threading.Barrier(JOINERS * 2)
+    results = []
+
+    def join(user_id):
+        with app.app_context():
+            barrier.wait()
+            results.append(trips.join("RACE01", user_id)[1])
+
+    threads = [threading.Thread(target=join, args=(u,)) for u in user_ids for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    trip = store.db.itineraries.find_one({"_id": trip_id})
+    assert results.count(True) == JOINERS
+    assert len(trip["users"]) == len(set(trip["users"])) == JOINERS + 1
+    assert len(trip["budget"]) == JOINERS
+    for user in store.db.users.find():
+        assert [ref["trip_id"] for ref in user["profile"]["trips"]] == [trip_id]
+
+
+def test_bulk_invite_races_with_joins(app):
+    owner_id = ObjectId()
+    trip_id = make_trip(owner_id)
+    user_ids = store.db.users.insert_many(
+        [{"username": f"user{i}", "profile": {"trips": []}} for i in range(JOINERS)]
+    ).inserted_ids
+    barrier = threading.Barrier(JOINERS + 1)
+
+    def join(user_id):
+        with app.app_context():
+            barrier.wait()
+            trips.join("RACE01", user_id)
+
+    threads = [threading.Thread(target=join, args=(u,)) for u in user_ids]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    trips.add_members(trip_id, owner_id, user_ids, attempts=JOINERS)
+    for thread in threads:
+        thread.join()
+
+    trip = store.db.itineraries.find_one({"_id": trip_id})
+    assert sorted(trip["users"]) == sorted([owner_id, *user_ids])
+    assert len(trip["budget"]) == JOINERS
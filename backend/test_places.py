@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from backend.places import MAX_TILES, PlacesClient, UpstreamError, tile_bounds, tile_for, tiles_for_bbox
+from benchmarks.travel_advisor_stub import start_stub
+
+# Roughly downtown San Francisco at map zoom 12
+SF_BBOX = (37.74, 37.81, -122.47, -122.38)
+
+
+@pytest.fixture
+def stub():
+    server = start_stub()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(stub):
+    places = PlacesClient()
+    places.configure(base_url=stub.url, api_key="test")
+    return places
+
+
+def test_tile_bounds_contain_the_point():
+    x, y = tile_for(37.7749, -122.4194, 12)
+    bl_lat, tr_lat, bl_lng, tr_lng = tile_bounds(x, y, 12)
+    assert bl_lat <= 37.7749 <= tr_lat
+    assert bl_lng <= -122.4194 <= tr_lng
+
+
+def test_nearby_viewports_snap_to_the_same_tiles():
+    shifted = (37.741, 37.811, -122.469, -122.381)
+    assert tiles_for_bbox(*SF_BBOX) == tiles_for_bbox(*shifted)
+    assert len(tiles_for_bbox(*SF_BBOX)) <= 4
+
+
+@pytest.mark.parametrize("bbox", [(30, 45, -125, -100), (-85, 85, -180, 180), (-1, 1, -179, 179)])
+def test_large_boxes_get_coarse_tiles_not_many(bbox):
+    tiles = tiles_for_bbox(*bbox)
+
+    assert 1 <= len(tiles) <= MAX_TILES
+    assert len({zoom for _, _, zoom in tiles}) == 1
+
+
+def test_tiles_are_cached(client, stub):
+    first = client.places_in_bbox("restaurants", *SF_BBOX)
+    calls = stub.calls["restaurants"]
+    second = client.places_in_bbox("restaurants", *SF_BBOX)
+
+    assert first and first == second
+    assert stub.calls["restaurants"] == calls == client.upstream_calls
+    assert client.cache.hits == calls
+
+
+def test_concurrent_misses_are_coalesced(stub):
+    stub.latency = 0.2
+    places = PlacesClient()
+    places.configure(base_url=stub.url)
+    x, y, zoom = tiles_for_bbox(*SF_BBOX)[0]
+
+    threads = [
+        threading.Thread(target=places.fetch_tile, args=("hotels", x, y, zoom))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stub.calls["hotels"] == 1
+    assert places.coalesced == 9
+
+
+def test_zoomed_out_clusters_fetch_a_few_coarse_tiles(client, stub):
+    # Most of the western US at map zoom 5
+    clusters, places = client.clusters_in_bbox("restaurants", 5, 30, 45, -125, -100)
+
+    assert stub.calls["restaurants"] <= MAX_TILES
+    assert all(zoom <= 5 for _, _, zoom in tiles_for_bbox(30, 45, -125, -100, max_zoom=5))
+    assert clusters or places
+
+
+def test_waiting_on_a_stuck_identical_request_is_an_upstream_error():
+    places = PlacesClient()
+    places.timeout = 0.05
+    # An in-flight fetch of the tile that never finishes
+    places._inflight[("hotels", 12, 1, 2)] = Future()
+
+    with pytest.raises(UpstreamError):
+        places.fetch_tile("hotels", 1, 2, 12)
+
+
+def test_upstream_failure_is_reported_and_not_cached():
+    server = start_stub(fail=True)
+    places = PlacesClient()
+    places.configure(base_url=server.url)
+    try:
+        with pytest.raises(UpstreamError):
+            places.places_in_bbox("attractions", *SF_BBOX)
+        assert places.upstream_errors == 1
+        assert len(places.cache) == 0
+    finally:
+        server.shutdown()
+
+
+def test_fan_out_takes_about_as_long_as_the_slowest_category(stub):
+    stub.latency = {"restaurants": 0.1, "attractions": 0.2, "hotels": 0.3}
+    places = PlacesClient()
+    places.configure(base_url=stub.url)
+
+    start = time.perf_counter()
+    merged, missing = places.all_places_in_bbox(*SF_BBOX, deadline=5)
+    elapsed = time.perf_counter() - start
+
+    assert missing == []
+    assert elapsed < 0.55
+    assert {category for place in merged for category in place["categories"]} == {
+        "restaurants",
+        "attractions",
+        "hotels",
+    }
+    ids = [place["location_id"] for place in merged]
+    assert len(ids) == len(set(ids))
+
+
+def test_fan_out_returns_partial_results_at_the_deadline(stub):
+    stub.latency = {"hotels": 1.0}
+    places = PlacesClient()
+    places.configure(base_url=stub.url)
+
+    merged, missing = places.all_places_in_bbox(*SF_BBOX, deadline=0.3)
+
+    assert missing == ["hotels"]
+    assert merged
+    assert all("hotels" not in place["categories"] for place in merged)
@@ -0,0 +1,53 @@
+import pytest
+from flask import Flask
+
+from backend import profiling
+from backend.profiling import HEADER, make_token, profiled
+
+
+def slow_part():
+    return sum(i * i for i in range(300000))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setitem(profiling.settings, "directory", str(tmp_path))
+    monkeypatch.setitem(profiling.settings, "sample_rate", 0.0)
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+
+    @app.route("/trip")
+    @profiled
+    def trip_detail():
+        return str(slow_part())
+
+    return app
+
+
+def test_requests_are_not_profiled_by_default(app, tmp_path):
+    app.test_client().get("/trip", headers={HEADER: "forged"})
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_signed_header_writes_pstats_and_collapsed_stacks(app, tmp_path):
+    with app.app_context():
+        token = make_token()
+
+    response = app.test_client().get("/trip", headers={HEADER: token})
+
+    assert response.status_code == 200
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert [name.rsplit(".", 1)[1] for name in files] == ["collapsed", "pstats"]
+    assert files[0].startswith("trip_detail-")
+    stacks = (tmp_path / files[0]).read_text().splitlines()
+    assert all(line.startswith("trip_detail;") for line in stacks)
+    assert any("test_profiling:slow_part" in line for line in stacks)
+
+
+def test_sample_rate_profiles_without_a_header(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(profiling.settings, "sample_rate", 1.0)
+
+    app.test_client().get("/trip")
+
+    assert len(list(tmp_path.glob("*.pstats"))) == 1
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from backend.routing import haversine_matrix, nearest_neighbour, order_stops, route_length
+
+
+def test_haversine_matches_a_known_distance():
+    # Paris to London
+    dist = haversine_matrix([48.8566, 51.5074], [2.3522, -0.1278])
+
+    assert dist[0, 1] == pytest.approx(343.5, abs=0.5)
+    assert dist[0, 0] == 0
+
+
+def test_route_keeps_the_first_stop_and_visits_every_stop_once():
+    rng = np.random.default_rng(3)
+    lat = 48.85 + rng.uniform(-0.05, 0.05, 60)
+    lng = 2.35 + rng.uniform(-0.05, 0.05, 60)
+
+    order, length, original = order_stops(lat, lng)
+
+    assert order[0] == 0
+    assert sorted(order) == list(range(60))
+    dist = haversine_matrix(lat, lng)
+    assert length == pytest.approx(route_length(order, dist))
+    assert length <= route_length(nearest_neighbour(dist), dist) < original
+
+
+def test_stops_on_a_line_are_visited_in_line_order():
+    lng = [2.30, 2.34, 2.31, 2.33, 2.32]
+
+    order, _, _ = order_stops([48.85] * 5, lng)
+
+    assert list(order) == [0, 2, 4, 3, 1]
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from backend.schedule import InvalidItem, build_item, find_conflicts, group_by_day, items_query
+
+
+def test_string_and_datetime_times_are_normalized():
+    trip_id = ObjectId()
+    from_form = build_item(str(trip_id), {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00"})
+    from_seed = build_item(trip_id, {"activity": "Louvre", "location": "Paris", "time": datetime(2022, 7, 15, 10)})
+
+    assert from_form["time"] == from_seed["time"] == datetime(2022, 7, 15, 10)
+    assert from_form["day"] == "2022-07-15"
+
+
+def test_range_query_bounds_the_days_too():
+    query = items_query(str(ObjectId()), datetime(2022, 7, 15), datetime(2022, 7, 16))
+
+    assert query["day"] == {"$gte": "2022-07-15", "$lte": "2022-07-15"}
+    assert query["time"] == {"$gte": datetime(2022, 7, 15), "$lt": datetime(2022, 7, 16)}
+
+
+def test_items_are_grouped_by_consecutive_days():
+    items = [{"day": "2022-07-15"}, {"day": "2022-07-15"}, {"day": "2022-07-16"}]
+
+    days = group_by_day(items)
+
+    assert [(d["day"], len(d["items"])) for d in days] == [("2022-07-15", 2), ("2022-07-16", 1)]
+
+
+def test_duration_sets_the_end_and_can_span_days():
+    trip_id = ObjectId()
+    item = build_item(trip_id, {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00", "duration": "90"})
+    hotel = build_item(trip_id, {"activity": "Hotel", "location": "Paris", "time": "2022-07-15T15:00", "end": "2022-07-18T11:00"})
+
+    assert item["end"] == datetime(2022, 7, 15, 11, 30)
+    assert hotel["end"] == datetime(2022, 7, 18, 11)
+    with pytest.raises(InvalidItem):
+        build_item(trip_id, {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00", "duration": -30})
+
+
+def test_conflicts_pair_overlapping_items():
+    lunch = {"_id": 1, "time": datetime(2022, 7, 15, 12), "end": datetime(2022, 7, 15, 13)}
+    tour = {"_id": 2, "time": datetime(2022, 7, 15, 12, 30), "end": datetime(2022, 7, 15, 14)}
+    dinner = {"_id": 3, "time": datetime(2022, 7, 15, 19), "end": datetime(2022, 7, 15, 21)}
+
+    assert find_conflicts([dinner, tour, lunch]) == [(lunch, tour)]
+
+
+def test_coordinates_are_stored_as_geojson():
+    item = build_item(
+        ObjectId(),
+        {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00", "latitude": "48.8606", "longitude": "2.3376"},
+    )
+
+    assert item["point"] == {"type": "Point", "coordinates": [2.3376, 48.8606]}
+    with pytest.raises(InvalidItem):
+        build_item(ObjectId(), {"activity": "Louvre", "location": "Paris", "time": "2022-07-15T10:00", "latitude": "95", "longitude": "2"})
@@ -0,0 +1,33 @@
+import random
+
+from backend.settle import net_balances, simplify_debts
+
+
+def test_leftover_cents_keep_balances_at_zero():
+    balances = net_balances(["a", "b", "c"], {"a": 1000}, 1000)
+
+    assert balances == {"a": 666, "b": -333, "c": -333}
+    assert sum(balances.values()) == 0
+
+
+def test_payer_who_left_keeps_credit():
+    balances = net_balances(["a", "b"], {"a": 400, "z": 200}, 600)
+
+    assert balances == {"a": 100, "b": -300, "z": 200}
+
+
+def test_transfers_settle_every_balance():
+    rng = random.Random(7)
+    members = [f"user{i}" for i in range(200)]
+    paid = {user: rng.randint(0, 50000) for user in members}
+    balances = net_balances(members, paid, sum(paid.values()))
+
+    transfers = simplify_debts(balances)
+
+    remaining = dict(balances)
+    for debtor, creditor, cents in transfers:
+        assert cents > 0
+        remaining[debtor] += cents
+        remaining[creditor] -= cents
+    assert set(remaining.values()) == {0}
+    assert len(transfers) < len(members)
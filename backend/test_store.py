@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from backend.indexes import INDEXES
+from backend.repositories import itinerary_items
+from backend.store import MemoryDatabase, Store, store
+
+
+@pytest.fixture
+def db():
+    store = Store()
+    store.use("memory", INDEXES)
+    return store.db
+
+
+def test_queries_match_array_members_and_dotted_paths(db):
+    alice, bob = ObjectId(), ObjectId()
+    trip_id = ObjectId()
+    db.users.insert_many(
+        [
+            {"_id": alice, "username": "alice", "profile": {"trips": [{"trip_id": trip_id}]}},
+            {"_id": bob, "username": "bob", "profile": {"trips": []}},
+        ]
+    )
+    db.itineraries.insert_one({"_id": trip_id, "trip_name": "Rome", "users": [alice], "invite_code": "ROME01"})
+
+    assert db.itineraries.count_documents({"users": alice}) == 1
+    assert db.itineraries.count_documents({"users": {"$ne": bob}}) == 1
+    assert db.itineraries.count_documents({"users": {"$nin": [alice, bob]}}) == 0
+    assert [u["username"] for u in db.users.find({"profile.trips.trip_id": trip_id})] == ["alice"]
+    assert [u["username"] for u in db.users.find({"profile.trips.trip_id": {"$ne": trip_id}})] == ["bob"]
+    assert db.users.find_one({"username": "alice"}, {"username": 1}) == {"_id": alice, "username": "alice"}
+
+
+def test_ranges_or_and_sorts(db):
+    trip_id = ObjectId()
+    times = [datetime(2024, 5, 1, hour) for hour in (12, 9, 9, 18)]
+    docs = [{"trip_id": trip_id, "day": "2024-05-01", "time": time} for time in times]
+    db.itinerary_items.insert_many(docs)
+    first, second = sorted(docs, key=lambda d: (d["time"], d["_id"]))[:2]
+
+    ordered = list(db.itinerary_items.find({"trip_id": trip_id}).sort([("time", ASCENDING), ("_id", ASCENDING)]))
+    after_cursor = list(
+        db.itinerary_items.find(
+            {"trip_id": trip_id, "$or": [{"time": {"$gt": first["time"]}}, {"time": first["time"], "_id": {"$gt": first["_id"]}}]}
+        )
+        .sort([("time", ASCENDING), ("_id", ASCENDING)])
+        .limit(1)
+    )
+
+    assert [d["time"].hour for d in ordered] == [9, 9, 12, 18]
+    assert after_cursor[0]["_id"] == second["_id"]
+    assert db.itinerary_items.distinct("day", {"trip_id": trip_id}) == ["2024-05-01"]
+
+
+def test_unique_indexes_raise_duplicate_key_errors(db):
+    db.itineraries.insert_one({"trip_name": "Rome", "invite_code": "AAAAAA"})
+
+    with pytest.raises(DuplicateKeyError, match="trip_name"):
+        db.itineraries.insert_one({"trip_name": "Rome", "invite_code": "BBBBBB"})
+    # Only items with a uid take part in the partial (trip_id, uid) index
+    trip_id = ObjectId()
+    db.itinerary_items.insert_many([{"trip_id": trip_id}, {"trip_id": trip_id}])
+    with pytest.raises(BulkWriteError) as e:
+        db.itinerary_items.bulk_write(
+            [InsertOne({"trip_id": trip_id, "uid": "a"}), InsertOne({"trip_id": trip_id, "uid": "a"})], ordered=False
+        )
+    assert e.value.details["nInserted"] == 1
+    assert [error["index"] for error in e.value.details["writeErrors"]] == [1]
+
+
+def test_updates_positional_upserts_and_find_one_and_update(db):
+    alice, bob = ObjectId(), ObjectId()
+    trip_id = db.itineraries.insert_one(
+        {"users": [alice], "budget": [{"user_id": alice, "food": 0}, {"user_id": bob, "food": 0}]}
+    ).inserted_id
+
+    db.itineraries.update_one({"_id": trip_id, "budget.user_id": bob}, {"$set": {"budget.$.food": 40}})
+    before = db.itineraries.find_one_and_update(
+        {"_id": trip_id, "users": {"$ne": bob}}, {"$addToSet": {"users": bob}}, projection={"users": 1}
+    )
+    again = db.itineraries.find_one_and_update(
+        {"_id": trip_id, "users": {"$ne": bob}}, {"$addToSet": {"users": bob}}, return_document=ReturnDocument.AFTER
+    )
+    result = db.balances.bulk_write(
+        [UpdateOne({"_id": trip_id}, {"$inc": {"paid.a": 150, "version": 1}}, upsert=True)] * 2
+    )
+
+    trip = db.itineraries.find_one(trip_id)
+    assert [row["food"] for row in trip["budget"]] == [0, 40]
+    assert before == {"_id": trip_id, "users": [alice]}
+    assert again is None and trip["users"] == [alice, bob]
+    assert (result.upserted_count, result.modified_count) == (1, 1)
+    assert db.balances.find_one({"_id": trip_id}) == {"_id": trip_id, "paid": {"a": 300}, "version": 2}
+
+
+def test_documents_are_copied_in_and_out():
+    db = MemoryDatabase()
+    doc = {"tags": ["a"]}
+    db.things.insert_one(doc)
+    doc["tags"].append("b")
+    found = db.things.find_one({})
+    found["tags"].append("c")
+
+    assert db.things.find_one({})["tags"] == ["a"]
+    assert "_id" in doc
+
+
+def test_geo_near_ranks_placed_items_by_distance():
+    store.use("memory", INDEXES)
+    db = store.db
+    trip_id = ObjectId()
+    places = {"louvre": (48.8606, 2.3376), "orsay": (48.86, 2.3266), "versailles": (48.8049, 2.1204)}
+    for name, (lat, lng) in places.items():
+        db.itinerary_items.insert_one(
+            {"trip_id": trip_id, "activity": name, "point": {"type": "Point", "coordinates": [lng, lat]}}
+        )
+    db.itinerary_items.insert_one({"trip_id": trip_id, "activity": "unplaced"})
+
+    found = itinerary_items.nearby(trip_id, 48.8606, 2.3376, radius_m=5000)
+
+    assert [item["activity"] for item in found] == ["louvre", "orsay"]
+    assert found[0]["distance_m"] == 0 and 700 < found[1]["distance_m"] < 900
+
+
+@pytest.mark.parametrize(
+    "run",
+    [
+        lambda db: db.things.find_one({"name": {"$regex": "^a"}}),
+        lambda db: db.things.update_many({}, {"$mul": {"count": 2}}),
+        lambda db: db.things.bulk_write([InsertOne({"name": "b"}), UpdateOne({}, {"$rename": {"name": "n"}})]),
+        lambda db: list(db.things.aggregate([{"$match": {}}, {"$facet": {}}])),
+        lambda db: list(db.things.aggregate([{"$project": {"n": {"$concat": ["$name", "!"]}}}])),
+    ],
+)
+def test_unsupported_operators_are_refused_before_anything_runs(db, run):
+    db.things.insert_one({"name": "a", "count": 1})
+
+    with pytest.raises(OperationFailure, match="not supported by the memory backend"):
+        run(db)
+    assert list(db.things.find({}, {"_id": 0})) == [{"name": "a", "count": 1}]
@@ -0,0 +1,89 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+from flask import Blueprint, Flask
+
+from backend import metrics, telemetry
+from backend.metrics import Histogram, render
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ("route",), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, "home")
+
+    lines = [line for line in render_one(histogram) if not line.startswith("#")]
+
+    assert lines == [
+        'tripplanner_test_seconds_bucket{le="0.1",route="home"} 2',
+        'tripplanner_test_seconds_bucket{le="1",route="home"} 3',
+        'tripplanner_test_seconds_bucket{le="+Inf",route="home"} 4',
+        'tripplanner_test_seconds_sum{route="home"} 3.65',
+        'tripplanner_test_seconds_count{route="home"} 4',
+    ]
+
+
+def render_one(collector):
+    saved = metrics._collectors[:]
+    metrics._collectors[:] = [collector]
+    try:
+        return render().splitlines()
+    finally:
+        metrics._collectors[:] = saved
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    bp = Blueprint("trips", __name__)
+
+    @bp.route("/<trip_id>")
+    def show(trip_id):
+        return "ok" if trip_id != "missing" else ("no", 404)
+
+    app.register_blueprint(bp, url_prefix="/trips")
+    telemetry.init_app(app)
+    return app
+
+
+def test_requests_are_counted_per_endpoint(app):
+    client = app.test_client()
+    client.get("/trips/1")
+    client.get("/trips/2")
+    client.get("/trips/missing")
+
+    output = render()
+
+    assert 'tripplanner_http_requests_total{blueprint="trips",endpoint="trips.show",method="GET",status="200"} 2' in output
+    assert 'tripplanner_http_requests_total{blueprint="trips",endpoint="trips.show",method="GET",status="404"} 1' in output
+    assert 'tripplanner_http_request_duration_seconds_count{blueprint="trips",endpoint="trips.show",method="GET"} 3' in output
+
+
+def test_mongo_commands_are_labelled_with_collection_and_route(app):
+    listener = telemetry.CommandMetrics()
+    started = SimpleNamespace(
+        command_name="find", command={"find": "itinerary_items"}, connection_id=("db", 1), request_id=7
+    )
+    reply = {"cursor": {"firstBatch": [{}, {}, {}]}}
+
+    with app.test_request_context("/trips/1"):
+        listener.started(started)
+    listener.succeeded(
+        SimpleNamespace(command_name="find", connection_id=("db", 1), request_id=7, duration_micros=1500, reply=reply)
+    )
+
+    assert 'tripplanner_mongo_documents_total{collection="itinerary_items",command="find",route="trips.show"} 3' in render()
+
+
+def test_log_events_are_sampled_and_capped(caplog, monkeypatch):
+    monkeypatch.setitem(telemetry.settings, "field_chars", 5)
+    caplog.set_level(logging.INFO, logger="tripplanner")
+
+    telemetry.log_event("itinerary.item", sample_rate=0, activity="dropped")
+    telemetry.log_event("itinerary.item", sample_rate=1, activity="hello world")
+
+    assert [json.loads(r.getMessage()) for r in caplog.records] == [
+        {"event": "itinerary.item", "activity": "hello...(+6 chars)"}
+    ]
@@ -0,0 +1,101 @@
+# Payload size and marker counts for a city with 20k places, with and
+# without server-side clustering, across map zoom levels. Tiles are loaded
+# straight into the places cache, so no upstream API is involved.
+#
+#   python -m benchmarks.bench_clusters --places 20000
+import argparse
+import json
+import math
+import random
+import time
+
+from backend.places import PlacesClient, tile_bounds, tiles_for_bbox
+
+CENTER = (48.8566, 2.3522)
+CATEGORY = "restaurants"
+VIEWPORT_PIXELS = (1200, 800)
+
+
+def city(count, rng):
+    places = []
+    for i in range(count):
+        # Denser towards the centre, like a real city
+        lat = CENTER[0] + rng.gauss(0, 0.03)
+        lng = CENTER[1] + rng.gauss(0, 0.045)
+        places.append(
+            {
+                "location_id": str(i),
+                "name": f"Restaurant {i}",
+                "latitude": f"{lat:.6f}",
+                "longitude": f"{lng:.6f}",
+                "rating": "4.5",
+                "price_level": "$$",
+                "location_string": "Paris, Ile-de-France",
+                "web_url": f"https://www.tripadvisor.com/Restaurant_Review-{i}",
+                "photo": f"https://media-cdn.tripadvisor.com/media/photo-s/{i}.jpg",
+            }
+        )
+    return places
+
+
+def viewport(zoom):
+    # Degrees covered by a VIEWPORT_PIXELS map at this zoom
+    lng_span = VIEWPORT_PIXELS[0] / (256 * 2**zoom) * 360
+    lat_span = lng_span * VIEWPORT_PIXELS[1] / VIEWPORT_PIXELS[0] * math.cos(math.radians(CENTER[0]))
+    return (
+        CENTER[0] - lat_span / 2,
+        CENTER[0] + lat_span / 2,
+        CENTER[1] - lng_span / 2,
+        CENTER[1] + lng_span / 2,
+    )
+
+
+def load_tiles(client, places, bbox):
+    for x, y, zoom in tiles_for_bbox(*bbox):
+        key = (CATEGORY, zoom, x, y)
+        if client.cache.get(key) is not None:
+            continue
+        bl_lat, tr_lat, bl_lng, tr_lng = tile_bounds(x, y, zoom)
+        tile = [
+            place
+            for place in places
+            if bl_lat <= float(place["latitude"]) < tr_lat
+            and bl_lng <= float(place["longitude"]) < tr_lng
+        ]
+        client.cache.set(key, tile)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--places", type=int, default=20000)
+    args = parser.parse_args()
+
+    places = city(args.places, random.Random(421))
+    client = PlacesClient()
+    client.configure(max_bytes=1024**3)
+
+    print(f"{args.places} places around Paris, {VIEWPORT_PIXELS[0]}x{VIEWPORT_PIXELS[1]} viewport")
+    print(f"{'zoom':>4} {'raw markers':>12} {'raw KB':>8} {'drawn':>6} {'clustered KB':>13} {'first':>8} {'cached':>8}")
+    for zoom in range(11, 18):
+        bbox = viewport(zoom)
+        load_tiles(client, places, bbox)
+
+        raw = client.places_in_bbox(CATEGORY, *bbox)
+        raw_bytes = len(json.dumps({"data": raw}))
+
+        start = time.perf_counter()
+        clusters, singles = client.clusters_in_bbox(CATEGORY, zoom, *bbox)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        client.clusters_in_bbox(CATEGORY, zoom, *bbox)
+        cached = time.perf_counter() - start
+
+        clustered_bytes = len(json.dumps({"zoom": zoom, "clusters": clusters, "places": singles}))
+        print(
+            f"{zoom:>4} {len(raw):>12} {raw_bytes / 1024:>8.0f} {len(clusters) + len(singles):>6}"
+            f" {clustered_bytes / 1024:>13.1f} {first * 1000:>6.1f}ms {cached * 1000:>6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
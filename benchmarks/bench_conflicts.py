@@ -0,0 +1,110 @@
+# Conflict detection on a large itinerary, through the code the app runs:
+# each insert is checked with ItineraryItemRepository.conflicts_for (a
+# bounded range scan of the (trip_id, day, time) index) and then stored, and
+# the /conflicts endpoint sweeps the whole trip with find_conflicts. Pairwise
+# checks are timed on a sample for comparison.
+#
+# --mongo works as in benchmarks.loadtest (spawn, a URI, or memory). The
+# memory backend only indexes trip_id, so its conflicts_for scans the trip
+# and the per-insert figure is meaningful against MongoDB only.
+#
+#   python -m benchmarks.bench_conflicts --items 100000 --inserts 1000
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from backend.indexes import ensure_indexes
+from backend.repositories import itinerary_items
+from backend.schedule import build_item, find_conflicts, item_seconds, items_query
+from backend.store import store
+from benchmarks.loadtest import build_app, database
+
+CHUNK = 5000
+
+
+def random_entries(count, rng, days):
+    start = datetime(2024, 5, 1, 8)
+    for _ in range(count):
+        begin = start + timedelta(days=rng.randrange(days), minutes=rng.randrange(14 * 60))
+        yield {
+            "activity": "Museum",
+            "location": "Paris",
+            "time": begin.isoformat(),
+            "duration": rng.choice((30, 60, 90, 120, 240)),
+        }
+
+
+def pairwise(items):
+    count = 0
+    for i, item in enumerate(items):
+        for other in items[i + 1 :]:
+            if item["time"] < other["end"] and other["time"] < item["end"]:
+                count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=100000, help="items already in the trip")
+    parser.add_argument("--inserts", type=int, default=1000, help="items added one by one")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--pairwise", type=int, default=5000)
+    parser.add_argument("--mongo", default="spawn", help="spawn, memory, or a mongodb:// URI")
+    args = parser.parse_args()
+    rng = random.Random(421)
+    trip_id = ObjectId()
+
+    with database(args.mongo) as uri:
+        app = build_app(uri)
+        with app.app_context():
+            if store.backend == "mongo":
+                store.db.client.drop_database(store.db.name)
+                ensure_indexes()
+            items = [build_item(trip_id, entry) for entry in random_entries(args.items, rng, args.days)]
+            # As TripRepository.create leaves it, with the preloaded items counted
+            store.db.itineraries.insert_one(
+                {
+                    "_id": trip_id,
+                    "max_item_seconds": max(item_seconds(item) for item in items),
+                    "item_spans_complete": True,
+                }
+            )
+            for start in range(0, len(items), CHUNK):
+                store.db.itinerary_items.insert_many(items[start : start + CHUNK])
+
+            # What POST /itinerary/<trip>/items does for each new item
+            new_items = [build_item(trip_id, entry) for entry in random_entries(args.inserts, rng, args.days)]
+            found = 0
+            start = time.perf_counter()
+            for item in new_items:
+                found += len(itinerary_items.conflicts_for(item))
+                itinerary_items.add(item)
+            inserts = time.perf_counter() - start
+            print(
+                f"inserts:  {args.inserts} into {args.items} items in {inserts:.2f}s "
+                f"({inserts / args.inserts * 1e3:.2f}ms per insert, {found} conflicts)"
+            )
+
+            # What GET /itinerary/<trip>/conflicts does for the whole trip
+            start = time.perf_counter()
+            pairs = len(find_conflicts(itinerary_items.iterate(items_query(trip_id))))
+            sweep = time.perf_counter() - start
+            total = args.items + args.inserts
+            print(f"sweep:    {total} items read and checked, {pairs} conflicts in {sweep * 1000:.0f}ms")
+
+    sample = items[: args.pairwise]
+    start = time.perf_counter()
+    pairwise(sample)
+    naive = time.perf_counter() - start
+    scale = (args.items / args.pairwise) ** 2
+    print(
+        f"pairwise: {args.pairwise} items in {naive:.2f}s, "
+        f"~{naive * scale:.0f}s extrapolated to {args.items}"
+    )
+
+
+if __name__ == "__main__":
+    main()
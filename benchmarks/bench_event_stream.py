@@ -0,0 +1,160 @@
+# Load test for the trip event stream: N idle chat tabs polling
+# /chat/<trip_id>/messages every 5 seconds vs. holding one SSE connection.
+#
+# The broker mode measures in-process fan-out latency to N listeners, on the
+# memory backend, and needs nothing else:
+#   python -m benchmarks.bench_event_stream broker --tabs 500
+#
+# The http mode drives a running server and counts the requests idle tabs
+# actually send, both ways. A streaming tab also re-fetches messages every
+# CATCH_UP_INTERVAL like the chat page, and polls when its stream is refused
+# (204, over EVENT_STREAMS). gunicorn.conf.py streams 2 x 256 tabs by
+# default; size GUNICORN_THREADS for more:
+#   python -m benchmarks.bench_event_stream http --tabs 500 --duration 60 \
+#       --base-url http://127.0.0.1:5000 --trip-id <id> --token <x-access-token>
+import argparse
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+from backend.events import EventBroker
+from backend.indexes import INDEXES
+from backend.store import store
+
+POLL_INTERVAL = 5
+CATCH_UP_INTERVAL = 30
+
+
+def run_broker(tabs, events):
+    store.use("memory", INDEXES)
+    broker = EventBroker()
+    trip_id = str(ObjectId())
+    broker.last_id(trip_id)
+    received = [0] * tabs
+    latencies = []
+    lock = threading.Lock()
+    ready = threading.Barrier(tabs + 1)
+    sent_at = {}
+
+    def tab(index):
+        last_id = 0
+        ready.wait()
+        while last_id < events:
+            for event_id, kind, payload in broker.wait(trip_id, last_id, 1):
+                last_id = event_id
+                received[index] += 1
+                with lock:
+                    latencies.append(time.perf_counter() - sent_at[event_id])
+
+    threads = [threading.Thread(target=tab, args=(i,), daemon=True) for i in range(tabs)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+
+    start = time.perf_counter()
+    for i in range(1, events + 1):
+        sent_at[i] = time.perf_counter()
+        broker.publish(trip_id, "message", {"message": f"event {i}"})
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"tabs={tabs} events={events} delivered={sum(received)} in {elapsed:.2f}s")
+    print(
+        f"fan-out latency p50={latencies[len(latencies) // 2] * 1000:.2f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms"
+    )
+
+
+def run_http(tabs, duration, base_url, trip_id, token):
+    import requests
+
+    cookies = {"x-access-token": token}
+    messages_url = f"{base_url}/chat/{trip_id}/messages"
+    counts = {"poll": 0, "stream": 0, "refused": 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            counts[name] += 1
+
+    def poll_until(session, deadline, interval):
+        while time.monotonic() < deadline:
+            session.get(messages_url, cookies=cookies)
+            count("poll")
+            time.sleep(interval)
+
+    def polling_tab(deadline):
+        poll_until(requests.Session(), deadline, POLL_INTERVAL)
+
+    def read_stream(session, deadline):
+        # Reconnects when the server closes the stream, like EventSource
+        while time.monotonic() < deadline:
+            with session.get(
+                f"{base_url}/events/{trip_id}/stream", cookies=cookies, stream=True, timeout=duration + 30
+            ) as response:
+                count("stream")
+                if response.status_code == 204:
+                    count("refused")
+                    return False
+                for _ in response.iter_lines():
+                    if time.monotonic() >= deadline:
+                        break
+        return True
+
+    def streaming_tab(deadline):
+        session = requests.Session()
+        refused = []
+        reader = threading.Thread(
+            target=lambda: refused.append(not read_stream(requests.Session(), deadline)), daemon=True
+        )
+        reader.start()
+        session.get(messages_url, cookies=cookies)
+        count("poll")
+        while time.monotonic() < deadline and reader.is_alive():
+            reader.join(CATCH_UP_INTERVAL)
+            if reader.is_alive() and time.monotonic() < deadline:
+                session.get(messages_url, cookies=cookies)
+                count("poll")
+        if refused and refused[0]:
+            poll_until(session, deadline, POLL_INTERVAL)
+
+    for mode, target in (("poll", polling_tab), ("stream", streaming_tab)):
+        for name in counts:
+            counts[name] = 0
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=target, args=(deadline,), daemon=True) for _ in range(tabs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(duration + 30)
+        requests_sent = counts["poll"] + counts["stream"]
+        print(
+            f"{mode:>6}: {requests_sent} requests in {duration}s "
+            f"({requests_sent / duration:.1f} req/s) for {tabs} idle tabs"
+            + (f", {counts['stream']} stream connections, {counts['refused']} refused" if mode == "stream" else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["broker", "http"])
+    parser.add_argument("--tabs", type=int, default=500)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--duration", type=int, default=60)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--trip-id")
+    parser.add_argument("--token")
+    args = parser.parse_args()
+
+    if args.mode == "broker":
+        run_broker(args.tabs, args.events)
+    else:
+        run_http(args.tabs, args.duration, args.base_url, args.trip_id, args.token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Memory footprint and query latency of the memory-mapped gazetteer at a few
+# million names. The build runs in a child process so the resident memory
+# measured here is what a web worker pays after loading, not the build's.
+#
+#   python -m benchmarks.bench_gazetteer --places 1000000
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from backend.gazetteer import Gazetteer, build
+
+SYLLABLES = "ba be bi bo ca ce co da de di do fa fe ga go ha ka ki la le li lo lu ma me mi mo na ne ni no pa pe po ra re ri ro sa se si so ta te ti to va ve vi vo za".split()
+ACCENTED = {"a": "á", "e": "é", "o": "ö", "u": "ü"}
+COUNTRIES = ["FR", "DE", "ES", "IT", "US", "GB", "BR", "JP", "IN", "MX"]
+
+
+def word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def synthetic_rows(count, seed=421):
+    # Town-like names with a heavy-tailed population and a few alternates
+    rng = random.Random(seed)
+    for geonameid in range(count):
+        name = word(rng).capitalize()
+        if rng.random() < 0.3:
+            name = f"{name} {rng.choice(['Saint', 'Nueva', 'Nord', 'Sur', word(rng).capitalize()])}"
+        ascii_name = name
+        if rng.random() < 0.2:
+            name = "".join(ACCENTED.get(c, c) if rng.random() < 0.3 else c for c in name)
+        alternates = [word(rng).capitalize() for _ in range(rng.randint(0, 2))]
+        yield (
+            geonameid,
+            name,
+            [ascii_name] + alternates,
+            rng.uniform(-60, 70),
+            rng.uniform(-180, 180),
+            rng.choice(COUNTRIES),
+            int(rng.paretovariate(1.2) * 100),
+        )
+
+
+def build_into(count, path, result):
+    start = time.perf_counter()
+    places, keys = build(synthetic_rows(count), path)
+    result.put((places, keys, time.perf_counter() - start))
+
+
+def memory_mb():
+    # (private, mapped): heap the process owns vs file pages it shares with
+    # the page cache and with every other worker mapping the same files
+    with open("/proc/self/statm") as f:
+        resident, shared = (int(v) for v in f.read().split()[1:3])
+    page = os.sysconf("SC_PAGE_SIZE") / 1024**2
+    return (resident - shared) * page, shared * page
+
+
+def report(label, before):
+    private, mapped = memory_mb()
+    print(f"{label} private +{private - before[0]:.1f} MB, mapped +{mapped - before[1]:.1f} MB")
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--places", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        result = multiprocessing.Queue()
+        child = multiprocessing.Process(target=build_into, args=(args.places, path, result))
+        child.start()
+        places, keys, elapsed = result.get()
+        child.join()
+        print(f"build:   {keys} names for {places} places in {elapsed:.1f}s")
+        sizes = {name: os.path.getsize(os.path.join(path, name)) for name in sorted(os.listdir(path))}
+        for name, size in sizes.items():
+            print(f"         {name:<22} {size / 1024**2:8.1f} MB")
+        print(f"         total                  {sum(sizes.values()) / 1024**2:8.1f} MB on disk")
+
+        before = memory_mb()
+        index = Gazetteer()
+        start = time.perf_counter()
+        index.load(path)
+        print(f"load:    {(time.perf_counter() - start) * 1000:.1f}ms")
+        report("memory after load: ", before)
+
+        rng = random.Random(7)
+        names = [row[1] for row in synthetic_rows(args.queries, seed=99)]
+        for length in (1, 2, 3, 4, 6, 8):
+            timings = []
+            for name in names:
+                start = time.perf_counter()
+                index.suggest(name[:length])
+                timings.append(time.perf_counter() - start)
+            p50, p99 = percentiles(timings)
+            print(f"suggest: prefix {length}  p50 {p50:.3f}ms  p99 {p99:.3f}ms")
+
+        known = [index.place(rng.randrange(places))["name"].rsplit(",", 1)[0] for _ in range(args.queries)]
+        timings = []
+        for name in known:
+            start = time.perf_counter()
+            index.resolve(name)
+            timings.append(time.perf_counter() - start)
+        p50, p99 = percentiles(timings)
+        print(f"resolve: p50 {p50:.3f}ms  p99 {p99:.3f}ms")
+        report("memory after queries:", before)
+
+
+if __name__ == "__main__":
+    main()
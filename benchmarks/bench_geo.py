@@ -0,0 +1,58 @@
+# Radius and k-nearest latency of the in-process GeoIndex over a million
+# points spread across a metro area, the scale the places cache can reach.
+#
+#   python -m benchmarks.bench_geo --points 1000000
+import argparse
+import random
+import time
+
+from backend.geo import GeoIndex
+
+CENTER = (48.8566, 2.3522)
+SPREAD = (0.5, 0.75)  # degrees, roughly 110 x 110 km
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(421)
+
+    def random_point():
+        return (
+            CENTER[0] + rng.uniform(-SPREAD[0], SPREAD[0]),
+            CENTER[1] + rng.uniform(-SPREAD[1], SPREAD[1]),
+        )
+
+    index = GeoIndex()
+    start = time.perf_counter()
+    for key in range(args.points):
+        lat, lng = random_point()
+        index.add(key, lat, lng, key)
+    print(f"build:   {args.points} points in {time.perf_counter() - start:.1f}s")
+
+    centers = [random_point() for _ in range(args.queries)]
+    for label, query in (
+        ("radius 250m", lambda lat, lng: index.within(lat, lng, 250)),
+        ("radius 1km", lambda lat, lng: index.within(lat, lng, 1000, limit=50)),
+        ("k=10", lambda lat, lng: index.nearest(lat, lng, 10)),
+        ("k=100", lambda lat, lng: index.nearest(lat, lng, 100, max_radius_m=5000)),
+    ):
+        timings = []
+        found = 0
+        for lat, lng in centers:
+            begin = time.perf_counter()
+            found += len(query(lat, lng))
+            timings.append(time.perf_counter() - begin)
+        p50, p99 = percentiles(timings)
+        print(f"{label:<12} p50={p50:.2f}ms p99={p99:.2f}ms avg results={found / len(centers):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Throughput and peak memory of the itinerary importer and exporter on a
+# generated calendar of 50k events. The database writes are left out; the
+# importer sends one bulk_write per IMPORT_CHUNK items.
+#
+#   python -m benchmarks.bench_itinerary_io --events 50000
+import argparse
+import io
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from backend.ical import calendar_footer, calendar_header, format_event, parse_events
+from backend.schedule import IMPORT_CHUNK, build_item
+
+
+def generate_calendar(events):
+    start = datetime(2024, 5, 1, 8)
+    yield calendar_header("Benchmark trip")
+    for i in range(events):
+        begin = start + timedelta(minutes=45 * i)
+        yield format_event(
+            f"event-{i}@bench",
+            begin,
+            begin + timedelta(minutes=30),
+            f"Activity {i}",
+            "Paris, France",
+            "Generated by bench_itinerary_io",
+            (48.85 + i % 100 / 1000, 2.35 + i % 77 / 1000),
+        )
+    yield calendar_footer()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=50000)
+    args = parser.parse_args()
+
+    data = "".join(generate_calendar(args.events)).encode()
+    print(f"calendar: {args.events} events, {len(data) / 1e6:.1f} MB")
+
+    trip_id = ObjectId()
+
+    def run_import():
+        chunk = []
+        chunks = 0
+        for entry in parse_events(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")):
+            chunk.append(build_item(trip_id, entry))
+            if len(chunk) >= IMPORT_CHUNK:
+                chunks += 1
+                chunk = []
+        return chunks
+
+    def run_export():
+        return sum(len(part) for part in generate_calendar(args.events))
+
+    # Timed without tracemalloc, which slows allocation-heavy code a lot
+    start = time.perf_counter()
+    chunks = run_import()
+    elapsed = time.perf_counter() - start
+    peak = peak_memory(run_import)
+    print(
+        f"import:   parsed and validated in {elapsed:.2f}s "
+        f"({args.events / elapsed:,.0f} events/s), {chunks} bulk writes, "
+        f"peak {peak / 1e6:.1f} MB beyond the upload"
+    )
+
+    start = time.perf_counter()
+    size = run_export()
+    elapsed = time.perf_counter() - start
+    peak = peak_memory(run_export)
+    print(f"export:   {size / 1e6:.1f} MB generated in {elapsed:.2f}s, peak {peak / 1e6:.2f} MB")
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    main()
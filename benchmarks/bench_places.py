@@ -0,0 +1,61 @@
+# Hit ratio and upstream calls of the tile-quantized places cache when many
+# users look at a few cities, against the local Travel Advisor stub.
+#
+#   python -m benchmarks.bench_places --requests 2000 --latency 0.05
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.places import PlacesClient
+from benchmarks.travel_advisor_stub import start_stub
+
+CITIES = {
+    "San Francisco": (37.7749, -122.4194),
+    "Paris": (48.8566, 2.3522),
+    "Tokyo": (35.6762, 139.6503),
+    "New York": (40.7128, -74.0060),
+}
+# Half-size of a zoom 12 viewport, in degrees
+VIEWPORT = (0.035, 0.045)
+
+
+def random_viewport(rng):
+    lat, lng = CITIES[rng.choice(list(CITIES))]
+    lat += rng.uniform(-0.02, 0.02)
+    lng += rng.uniform(-0.02, 0.02)
+    return lat - VIEWPORT[0], lat + VIEWPORT[0], lng - VIEWPORT[1], lng + VIEWPORT[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    stub = start_stub(latency=args.latency)
+    client = PlacesClient()
+    client.configure(base_url=stub.url)
+    rng = random.Random(421)
+    viewports = [
+        (rng.choice(("restaurants", "attractions", "hotels")), random_viewport(rng))
+        for _ in range(args.requests)
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(lambda job: client.places_in_bbox(job[0], *job[1]), viewports))
+    elapsed = time.perf_counter() - start
+
+    stats = client.cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    print(f"{args.requests} viewport requests in {elapsed:.2f}s")
+    print(f"tile lookups={lookups} hit ratio={stats['hits'] / lookups:.1%}")
+    print(f"upstream calls={client.upstream_calls} (direct browser calls: {args.requests})")
+    print(f"coalesced={client.coalesced} cached tiles={stats['size']} bytes={stats['weight']}")
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
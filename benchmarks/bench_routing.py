@@ -0,0 +1,53 @@
+# Timings of the day route optimizer for days of 10, 100 and 1000 stops
+# scattered over a city, and how much shorter the route gets than visiting
+# the stops in time order.
+#
+#   python -m benchmarks.bench_routing
+import argparse
+import time
+
+import numpy as np
+
+from backend.routing import haversine_matrix, nearest_neighbour, route_length, two_opt
+
+CENTER = (48.8566, 2.3522)
+SPREAD = 0.08  # degrees, roughly a 9 km box
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stops", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(421)
+
+    for stops in args.stops:
+        timings = {"matrix": [], "nearest": [], "two_opt": []}
+        for _ in range(args.runs):
+            lat = CENTER[0] + rng.uniform(-SPREAD, SPREAD, stops)
+            lng = CENTER[1] + rng.uniform(-SPREAD, SPREAD, stops)
+
+            start = time.perf_counter()
+            dist = haversine_matrix(lat, lng)
+            timings["matrix"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            order = nearest_neighbour(dist)
+            timings["nearest"].append(time.perf_counter() - start)
+            greedy = route_length(order, dist)
+
+            start = time.perf_counter()
+            order = two_opt(order, dist)
+            timings["two_opt"].append(time.perf_counter() - start)
+
+        original = route_length(np.arange(stops), dist)
+        print(
+            f"{stops:>5} stops: "
+            + " ".join(f"{name}={min(t) * 1000:.2f}ms" for name, t in timings.items())
+            + f" | time order {original:.1f}km, greedy {greedy:.1f}km,"
+            f" 2-opt {route_length(order, dist):.1f}km"
+        )
+
+
+if __name__ == "__main__":
+    main()
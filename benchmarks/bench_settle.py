@@ -0,0 +1,77 @@
+# Cost of the settle-up engine for one large trip: applying a stream of
+# expenses to the running balances versus replaying the ledger, and the
+# debt simplification that runs on every cache miss.
+#
+#   python -m benchmarks.bench_settle --members 1000 --expenses 1000000
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from backend.settle import net_balances, simplify_debts, to_cents
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--expenses", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(421)
+    members = [f"{i:024x}" for i in range(args.members)]
+    expenses = [
+        {"payer_id": rng.choice(members), "amount": round(rng.uniform(1, 500), 2)}
+        for _ in range(args.expenses)
+    ]
+
+    # What record_expenses sends per bulk chunk: one $inc per payer
+    paid = defaultdict(int)
+    total = 0
+    start = time.perf_counter()
+    for offset in range(0, len(expenses), args.batch):
+        increments = defaultdict(int)
+        for expense in expenses[offset : offset + args.batch]:
+            increments[expense["payer_id"]] += to_cents(expense["amount"])
+        for payer, cents in increments.items():
+            paid[payer] += cents
+            total += cents
+    incremental = time.perf_counter() - start
+    print(
+        f"incremental: {args.expenses} expenses in chunks of {args.batch} "
+        f"in {incremental:.2f}s ({incremental / args.expenses * 1e6:.2f}us per expense)"
+    )
+
+    # What a page view would cost without the running balances
+    start = time.perf_counter()
+    replayed = defaultdict(int)
+    for expense in expenses:
+        replayed[expense["payer_id"]] += to_cents(expense["amount"])
+    replay = time.perf_counter() - start
+    assert replayed == paid
+    print(f"replay:      full ledger in {replay * 1000:.0f}ms per settle request")
+
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        balances = net_balances(members, paid, total)
+        transfers = simplify_debts(balances)
+    settle = (time.perf_counter() - start) / runs
+    print(
+        f"settle:      {args.members} members -> {len(transfers)} transfers "
+        f"in {settle * 1000:.2f}ms per cache miss"
+    )
+
+    for members_count in (10000, 100000):
+        balances = {f"u{i}": rng.randint(-10**6, 10**6) for i in range(members_count)}
+        balances["u0"] -= sum(balances.values())
+        start = time.perf_counter()
+        transfers = simplify_debts(balances)
+        print(
+            f"simplify:    {members_count} members -> {len(transfers)} transfers "
+            f"in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
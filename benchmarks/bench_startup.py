@@ -0,0 +1,78 @@
+# Startup cost of the app: module import, create_app() and the first request
+# to a page that does not touch the database. Each run is a fresh interpreter.
+#
+#   python -m benchmarks.bench_startup --runs 10
+#
+# To compare with a tree from before the app factory, check it out next to
+# this one and pass --legacy-root; there importing app.py builds the app and
+# seeds the database, so it needs a reachable MONGO_URI.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FACTORY_PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app({"ENSURE_INDEXES": False})
+created = time.perf_counter()
+response = flask_app.test_client().get("/admit")
+first = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": created - imported,
+                  "first_request": first - created, "status": response.status_code}))
+"""
+
+LEGACY_PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/admit")
+first = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": 0.0,
+                  "first_request": first - imported, "status": response.status_code}))
+"""
+
+
+def measure(root, probe, runs):
+    env = dict(os.environ)
+    env.setdefault("MONGO_URI", "mongodb://localhost:27017/tripplanner_bench")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", probe],
+            cwd=root,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+
+def report(label, samples):
+    print(label)
+    for key in ("import", "create_app", "first_request"):
+        values = [sample[key] * 1000 for sample in samples]
+        print(f"  {key:<14} median {statistics.median(values):8.1f} ms  max {max(values):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--legacy-root")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report("app factory", measure(root, FACTORY_PROBE, args.runs))
+    if args.legacy_root:
+        report("import-time initialization", measure(args.legacy_root, LEGACY_PROBE, args.runs))
+
+
+if __name__ == "__main__":
+    main()
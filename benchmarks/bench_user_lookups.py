@@ -0,0 +1,88 @@
+# Compare the number of Mongo queries issued to resolve trip members on the
+# mainpage: one find_one per member of every trip vs. the batched users
+# repository.
+#
+#   mongod --dbpath ./backend/data/db
+#   python -m benchmarks.bench_user_lookups
+import os
+import time
+
+from bson.objectid import ObjectId
+from flask import Flask
+from pymongo import monitoring
+
+from backend.repositories import users
+from backend.models import mongo
+
+MONGO_URI = os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017/tripplanner_bench")
+SHAPES = [(1, 2), (5, 4), (10, 8), (25, 10), (50, 20)]  # (trips, members)
+
+
+class QueryCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(trips, members):
+    mongo.db.users.drop()
+    user_ids = mongo.db.users.insert_many(
+        [{"username": f"bench{i}"} for i in range(members)]
+    ).inserted_ids
+    return [{"_id": ObjectId(), "users": user_ids} for _ in range(trips)]
+
+
+def naive(past_trips):
+    for trip in past_trips:
+        user_names = []
+        for user_id in trip["users"]:
+            trip_user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
+            if trip_user:
+                user_names.append(trip_user["username"])
+        trip["user_names"] = user_names
+
+
+def batched(past_trips):
+    members = users.load_many(user_id for trip in past_trips for user_id in trip["users"])
+    for trip in past_trips:
+        trip["user_names"] = users.usernames(trip["users"], members)
+
+
+def measure(app, counter, fn, past_trips):
+    # A fresh app context per run gives a fresh identity map
+    with app.app_context():
+        counter.count = 0
+        start = time.perf_counter()
+        fn(past_trips)
+        return counter.count, (time.perf_counter() - start) * 1000
+
+
+def main():
+    counter = QueryCounter()
+    app = Flask(__name__)
+    mongo.init_app(app, MONGO_URI, event_listeners=[counter])
+
+    print(f"{'trips':>5} {'members':>7} | {'naive q':>7} {'ms':>8} | {'batched q':>9} {'ms':>8}")
+    with app.app_context():
+        for trips, members in SHAPES:
+            past_trips = seed(trips, members)
+            naive_q, naive_ms = measure(app, counter, naive, past_trips)
+            batched_q, batched_ms = measure(app, counter, batched, past_trips)
+            print(
+                f"{trips:>5} {members:>7} | {naive_q:>7} {naive_ms:>8.2f} | "
+                f"{batched_q:>9} {batched_ms:>8.2f}"
+            )
+        mongo.db.users.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+# Concurrent load test of the main pages and API endpoints, with stored
+# baselines to compare against. Synthetic users, trips, chat histories,
+# itineraries and expenses are seeded at the chosen scale, the app is served
+# on a local port, and worker threads log in and loop over a weighted mix of
+# requests. Every run is reproducible from --seed.
+#
+# Where the data lives (--mongo):
+#   spawn   start a throwaway mongod on a free port in a temp dir (default;
+#           needs `mongod` on PATH or MONGOD=/path/to/mongod)
+#   URI     an existing server; the database is dropped first, so its name
+#           must contain "bench"
+#   memory  the in-process backend (DATA_BACKEND=memory): no server, so it
+#           measures the app itself; its baselines are kept apart
+#
+#   python -m benchmarks.loadtest --users 500 --trips 100 --concurrency 16 --duration 30
+#   python -m benchmarks.loadtest ... --save-baseline   # record this machine's numbers
+#   python -m benchmarks.loadtest ... --check           # exit 1 on a regression
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import requests
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+from app import create_app
+from backend.indexes import ensure_indexes
+from backend.ledger import build_expense
+from backend.memberships import BUDGET_FIELDS, blank_budget, membership_ref
+from backend.repositories import budgets, users as user_repository
+from backend.schedule import build_item
+from backend.store import store
+
+PASSWORD = "Benchpassword1"
+SECRET_KEY = "loadtest"
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines", "loadtest.json")
+CHUNK = 5000
+# Relative frequency of each request in the mix
+WEIGHTS = {
+    "login": 2,
+    "mainpage": 10,
+    "trip_detail": 15,
+    "chat_poll": 35,
+    "chat_post": 12,
+    "itinerary_add": 10,
+    "budget_update": 8,
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def spawned_mongod():
+    binary = os.getenv("MONGOD") or shutil.which("mongod")
+    if not binary:
+        raise SystemExit("mongod not found: install it, set MONGOD, or pass --mongo URI")
+    dbpath = tempfile.mkdtemp(prefix="loadtest-")
+    port = free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    uri = f"mongodb://127.0.0.1:{port}/tripplanner_bench"
+    try:
+        client = MongoClient(uri, serverSelectionTimeoutMS=200)
+        for _ in range(100):
+            try:
+                client.admin.command("ping")
+                break
+            except ServerSelectionTimeoutError:
+                if process.poll() is not None:
+                    raise SystemExit(f"mongod exited with {process.returncode}")
+        else:
+            raise SystemExit("mongod did not start")
+        yield uri
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+@contextmanager
+def database(mode):
+    if mode == "memory":
+        yield None
+    elif mode == "spawn":
+        with spawned_mongod() as uri:
+            yield uri
+    else:
+        name = mode.rsplit("/", 1)[-1].split("?", 1)[0]
+        if "bench" not in name:
+            raise SystemExit(f"Refusing to drop database {name!r}: its name must contain 'bench'")
+        yield mode
+
+
+def build_app(uri):
+    # auth signs and checks tokens with the SECRET_KEY environment variable
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    return create_app(
+        {
+            "DATA_BACKEND": "memory" if uri is None else "mongo",
+            # The memory backend is only accepted in testing mode
+            "TESTING": uri is None,
+            "MONGO_URI": uri,
+            "SECRET_KEY": SECRET_KEY,
+            "ENSURE_INDEXES": False,
+            "LOG_SAMPLE_RATE": 0,
+        }
+    )
+
+
+def _chunks(docs):
+    for start in range(0, len(docs), CHUNK):
+        yield docs[start : start + CHUNK]
+
+
+def seed(args, rng):
+    """Fill the database and return {username: (user_id, [trip ids])}."""
+    if store.backend == "mongo":
+        store.db.client.drop_database(store.db.name)
+    ensure_indexes()
+    # One hash for everyone: hashing is deliberately slow
+    password = generate_password_hash(PASSWORD)
+    users = [
+        {
+            "_id": ObjectId(),
+            "username": f"bench{i}",
+            "password": password,
+            "email": f"bench{i}@example.com",
+            "profile": {"name": f"Bench {i}", "trips": []},
+        }
+        for i in range(args.users)
+    ]
+    for chunk in _chunks(users):
+        store.db.users.insert_many(chunk, ordered=False)
+
+    trips_of = defaultdict(list)
+    refs = []
+    messages = []
+    items = []
+    expenses = []
+    start = datetime(2025, 7, 1, 8)
+    for t in range(args.trips):
+        members = rng.sample(users, min(args.members, len(users)))
+        trip_id = ObjectId()
+        chatroom_id = store.db.chatrooms.insert_one(
+            {"created_at": datetime.utcnow(), "message_seq": args.messages}
+        ).inserted_id
+        store.db.itineraries.insert_one(
+            {
+                "_id": trip_id,
+                "trip_name": f"Bench trip {t}",
+                "users": [m["_id"] for m in members],
+                "chatroom_id": chatroom_id,
+                "budget": [blank_budget(m["_id"]) for m in members],
+                "invite_code": f"B{t:05X}",
+                "max_item_seconds": 90 * 60,
+                "item_spans_complete": True,
+            }
+        )
+        for i, member in enumerate(members):
+            trips_of[member["username"]].append(str(trip_id))
+            refs.append((member["_id"], membership_ref(trip_id, f"Bench trip {t}", "owner" if i == 0 else "member")))
+        for m in range(args.messages):
+            author = rng.choice(members)
+            messages.append(
+                {
+                    "chatroom_id": chatroom_id,
+                    "user_id": author["_id"],
+                    "username": author["username"],
+                    "message": f"Message {m} about trip {t}",
+                    "seq": m + 1,
+                    "timestamp": start + timedelta(minutes=m),
+                }
+            )
+        for i in range(args.items):
+            items.append(
+                build_item(
+                    trip_id,
+                    {
+                        "activity": f"Activity {i}",
+                        "location": "Paris",
+                        "time": start + timedelta(hours=i * 3),
+                        "duration": 90,
+                    },
+                )
+            )
+        for e in range(args.expenses):
+            payer = rng.choice(members)
+            expenses.append(
+                build_expense(
+                    trip_id,
+                    {"category": "food", "description": f"Expense {e}", "amount": rng.randint(5, 200)},
+                    payer["_id"],
+                )
+            )
+
+    user_repository.add_memberships(refs)
+    for chunk in _chunks(messages):
+        store.db.messages.insert_many(chunk, ordered=False)
+    for chunk in _chunks(items):
+        store.db.itinerary_items.insert_many(chunk, ordered=False)
+    budgets.insert_expenses(expenses)
+    budgets.rebuild_balances()
+    return {user["username"]: (str(user["_id"]), trips_of[user["username"]]) for user in users if trips_of[user["username"]]}
+
+
+class Worker(threading.Thread):
+    def __init__(self, base_url, accounts, seed, deadline, record):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.accounts = accounts
+        self.usernames = sorted(accounts)
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.record = record
+        self.session = requests.Session()
+        self.newest = {}
+        # Like a browser cache: revalidate GETs with the last ETag per URL
+        self.etags = {}
+
+    def call(self, name, method, path, **kwargs):
+        key = (path, tuple(sorted(kwargs.get("params", {}).items())))
+        if method == "GET" and key in self.etags:
+            kwargs["headers"] = {"If-None-Match": self.etags[key]}
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(name, time.perf_counter() - start, ok)
+        if ok and method == "GET" and "ETag" in response.headers:
+            self.etags[key] = response.headers["ETag"]
+        return response
+
+    def login(self):
+        self.username = self.rng.choice(self.usernames)
+        self.user_id, self.trips = self.accounts[self.username]
+        self.session.cookies.clear()
+        self.etags.clear()
+        self.call("login", "POST", "/auth/admit", data={"username": self.username, "password": PASSWORD})
+
+    def run(self):
+        self.login()
+        names = list(WEIGHTS)
+        weights = [WEIGHTS[name] for name in names]
+        while time.perf_counter() < self.deadline:
+            getattr(self, self.rng.choices(names, weights)[0])()
+
+    def mainpage(self):
+        self.call("mainpage", "GET", f"/mainpage/{self.username}")
+
+    def trip_detail(self):
+        self.call("trip_detail", "GET", f"/trip/{self.rng.choice(self.trips)}")
+
+    def chat_poll(self):
+        trip_id = self.rng.choice(self.trips)
+        params = {"after": self.newest[trip_id]} if trip_id in self.newest else {}
+        response = self.call("chat_poll", "GET", f"/chat/{trip_id}/messages", params=params)
+        if response is not None and response.status_code == 200:
+            newest = response.json().get("newest")
+            if newest is not None:
+                self.newest[trip_id] = newest
+
+    def chat_post(self):
+        self.call("chat_post", "POST", f"/chat/{self.rng.choice(self.trips)}/messages", data={"message": "On my way"})
+
+    def itinerary_add(self):
+        day = self.rng.randrange(14)
+        self.call(
+            "itinerary_add",
+            "POST",
+            f"/itinerary/{self.rng.choice(self.trips)}/items",
+            json={
+                "activity": "Museum",
+                "location": "Paris",
+                "time": f"2025-07-{day + 1:02d}T{self.rng.randrange(8, 20):02d}:00",
+                "duration": 60,
+            },
+        )
+
+    def budget_update(self):
+        form = {field: self.rng.randrange(0, 500) for field in BUDGET_FIELDS}
+        form["user_id"] = self.user_id
+        self.call("budget_update", "POST", f"/budget/{self.rng.choice(self.trips)}/updated", data=form)
+
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+def summarize(samples, elapsed):
+    results = {}
+    for name, entries in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in entries)
+        results[name] = {
+            "count": len(entries),
+            "errors": sum(1 for _, ok in entries if not ok),
+            "rps": round(len(entries) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (endpoint, metric, baseline, current) for every regression."""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append((name, "p95_ms", base["p95_ms"], current["p95_ms"]))
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append((name, "rps", base["rps"], current["rps"]))
+        if current["errors"] > base["errors"]:
+            regressions.append((name, "errors", base["errors"], current["errors"]))
+    return regressions
+
+
+def print_table(results, baseline):
+    print(f"{'endpoint':<14} {'count':>7} {'errors':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}  p95 vs baseline")
+    for name, r in results.items():
+        base = baseline.get(name)
+        delta = f"{(r['p95_ms'] / base['p95_ms'] - 1) * 100:+.0f}%" if base and base["p95_ms"] else "-"
+        print(
+            f"{name:<14} {r['count']:>7} {r['errors']:>6} {r['rps']:>8.1f}"
+            f" {r['p50_ms']:>7.1f}ms {r['p95_ms']:>6.1f}ms {r['p99_ms']:>6.1f}ms  {delta}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo", default="spawn", help="spawn, memory, or a mongodb:// URI")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--trips", type=int, default=50)
+    parser.add_argument("--members", type=int, default=6)
+    parser.add_argument("--messages", type=int, default=200, help="per trip")
+    parser.add_argument("--items", type=int, default=30, help="itinerary items per trip")
+    parser.add_argument("--expenses", type=int, default=100, help="per trip")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds not measured")
+    parser.add_argument("--seed", type=int, default=421)
+    parser.add_argument("--baseline", default=BASELINES)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    profile = f"u{args.users}-t{args.trips}-m{args.members}-c{args.concurrency}"
+    if args.mongo == "memory":
+        profile += "-memory"
+
+    with database(args.mongo) as uri:
+        app = build_app(uri)
+        rng = random.Random(args.seed)
+        with app.app_context():
+            started = time.perf_counter()
+            accounts = seed(args, rng)
+            print(f"seeded {profile} in {time.perf_counter() - started:.1f}s")
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        samples = defaultdict(list)
+        lock = threading.Lock()
+        measure_from = time.perf_counter() + args.warmup
+        deadline = measure_from + args.duration
+
+        def record(name, latency, ok):
+            if time.perf_counter() >= measure_from:
+                with lock:
+                    samples[name].append((latency, ok))
+
+        workers = [Worker(base_url, accounts, args.seed + i, deadline, record) for i in range(args.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        server.shutdown()
+
+    results = summarize(samples, args.duration)
+    total = sum(r["count"] for r in results.values())
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(profile, {}).get("endpoints", {})
+    print_table(results, baseline)
+    print(f"total {total} requests, {total / args.duration:.1f} req/s with {args.concurrency} clients")
+
+    if args.save_baseline:
+        baselines[profile] = {"recorded": datetime.utcnow().isoformat(timespec="seconds"), "endpoints": results}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"saved baseline {profile} to {args.baseline}")
+    elif not baseline:
+        print(f"no baseline for {profile}; record one with --save-baseline")
+    else:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, base, current in regressions:
+            print(f"REGRESSION {name} {metric}: {base} -> {current}")
+        if regressions and args.check:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Local stand-in for the Travel Advisor list-in-boundary endpoints. It
+# returns a deterministic grid of places inside the requested box, so the
+# places proxy can be tested and benchmarked without a RapidAPI key.
+#
+#   python -m benchmarks.travel_advisor_stub --port 8099 --latency 0.2
+#   TRAVEL_ADVISOR_URL=http://127.0.0.1:8099 flask run
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CATEGORIES = ("restaurants", "attractions", "hotels")
+GRID = 0.01  # one place per category every ~1 km
+
+
+def places_in_box(category, bl_lat, tr_lat, bl_lng, tr_lng, limit=30):
+    places = []
+    lat_index = int(bl_lat // GRID)
+    while lat_index * GRID <= tr_lat and len(places) < limit:
+        lng_index = int(bl_lng // GRID)
+        while lng_index * GRID <= tr_lng and len(places) < limit:
+            lat, lng = lat_index * GRID, lng_index * GRID
+            if bl_lat <= lat <= tr_lat and bl_lng <= lng <= tr_lng:
+                location_id = f"{category[0]}{lat_index}_{lng_index}"
+                places.append(
+                    {
+                        "location_id": location_id,
+                        "name": f"{category.title()} {location_id}",
+                        "latitude": f"{lat:.5f}",
+                        "longitude": f"{lng:.5f}",
+                        "rating": "4.0",
+                        "web_url": f"https://example.com/{location_id}",
+                        "location_string": "Stub City",
+                    }
+                )
+            lng_index += 1
+        lat_index += 1
+    return places
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, fail=False):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.fail = fail
+        self.calls = {category: 0 for category in CATEGORIES}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        category = url.path.strip("/").split("/")[0]
+        if category not in CATEGORIES or not url.path.endswith("/list-in-boundary"):
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.calls[category] += 1
+        latency = self.server.latency
+        if isinstance(latency, dict):
+            latency = latency.get(category, 0.0)
+        time.sleep(latency)
+        if self.server.fail:
+            self.send_error(500)
+            return
+        query = {key: float(values[0]) for key, values in parse_qs(url.query).items()}
+        body = json.dumps(
+            {
+                "data": places_in_box(
+                    category,
+                    query["bl_latitude"],
+                    query["tr_latitude"],
+                    query["bl_longitude"],
+                    query["tr_longitude"],
+                )
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(latency=0.0, fail=False, port=0):
+    server = StubServer(("127.0.0.1", port), latency=latency, fail=fail)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubServer(("127.0.0.1", args.port), latency=args.latency)
+    print(f"Travel Advisor stub listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+
+# The app is imported once in the master and shared by the forked workers.
+# create_app() does no database I/O, and the Mongo client only connects on
+# first use inside each worker.
+wsgi_app = "wsgi:app"
+preload_app = True
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Threads keep the trip event streams (one connection per open tab) from
+# tying up a whole worker each. An idle stream is a thread blocked on a
+# condition, cheap enough to size the pool for the open tabs: each worker
+# keeps REQUEST_THREADS for pages and API calls and lets streams use the
+# rest (EVENT_STREAMS, see backend/events.py), 2 x 256 streaming tabs by
+# default. Setting GUNICORN_THREADS moves EVENT_STREAMS with it.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "288"))
+REQUEST_THREADS = 32
+os.environ.setdefault("EVENT_STREAMS", str(max(threads - REQUEST_THREADS, 0)))
@@ -1,67 +1,36 @@
-//API snippet grabbed from RapidApi's Travel Advisor API
+//Places come from the backend /places proxy, which calls RapidApi's Travel
+//Advisor API with the server's key and caches results per map tile
 
 
-async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
-  const options = {
-    method: 'GET',
-    url: 'https://travel-advisor.p.rapidapi.com/restaurants/list-in-boundary',
-    params: { bl_latitude, tr_latitude, bl_longitude, tr_longitude },
-    headers: {
-      'x-rapidapi-key': window.RAPIDAPI_KEY,
-      'x-rapidapi-host': 'travel-advisor.p.rapidapi.com'
-    }
-  };
+async function fetchPlaces(category, bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
   try {
-    const response = await axios.request(options);
+    const response = await axios.get(`/places/${category}`, {
+      params: { bl_latitude, tr_latitude, bl_longitude, tr_longitude }
+    });
     return response.data.data;
   } catch (error) {
+    console.error(`API Error (${category}):`, error);
     return [];
   }
  }
  
  
- //API snippet grabbed from RapidApi's Travel Advisor API
+ //Restaurants, attractions and hotels in one request. The server fetches the
+ //three categories in parallel and may return a partial result if one is slow
  
  
- async function fetchAttractions(bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
-  const options = {
-    method: 'GET',
-    url: 'https://travel-advisor.p.rapidapi.com/attractions/list-in-boundary',
-    params: { bl_latitude, tr_latitude, bl_longitude, tr_longitude },
-    headers: {
-      'x-rapidapi-key': window.RAPIDAPI_KEY,
-      'x-rapidapi-host': 'travel-advisor.p.rapidapi.com'
-    }
-  };
+ async function fetchAllPlaces(bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
   try {
-    const response = await axios.request(options);
-    return response.data.data;
-  } catch (error) {
-    return [];
-  }
- }
- 
- 
- //API snippet grabbed from RapidApi's Travel Advisor API
- 
- 
- async function fetchHotels(bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
-  const options = {
-    method: 'GET',
-    url: 'https://travel-advisor.p.rapidapi.com/hotels/list-in-boundary',
-    params: { bl_latitude, tr_latitude, bl_longitude, tr_longitude },
-    headers: {
-      'x-rapidapi-key': window.RAPIDAPI_KEY,
-      'x-rapidapi-host': 'travel-advisor.p.rapidapi.com'
+    const response = await axios.get('/places/all', {
+      params: { bl_latitude, tr_latitude, bl_longitude, tr_longitude }
+    });
+    if (response.data.partial) {
+      console.log("Places still loading for:", response.data.missing);
     }
-  };
-  try {
-    const response = await axios.request(options);
-    console.log("API Response (Hotels):", response.data);
-    return response.data.data;
+    return response.data;
   } catch (error) {
-    console.error("API Error (Hotels):", error);
-    return [];
+    console.error("API Error (places):", error);
+    return { data: [], missing: [] };
   }
  }
  
@@ -93,6 +62,8 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
       document.querySelector('input[name="activity"]').value = place.name || '';
       document.querySelector('input[name="location"]').value = place.location_string || 'Unknown City';
       document.querySelector('textarea[name="notes"]').value = place.web_url || 'No website available';
+      document.querySelector('input[name="latitude"]').value = place.latitude || '';
+      document.querySelector('input[name="longitude"]').value = place.longitude || '';
       window.scrollTo({ top: 0, behavior: 'smooth' });
     };
     tableBody.appendChild(row);
@@ -115,7 +86,17 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
  }
  
  
- //Add places on the map
+ //Add places on the map. Markers from the previous draw are removed first so
+ //panning around does not pile them up
+ 
+ 
+ let markers = [];
+ 
+ 
+ function clearMarkers() {
+  markers.forEach(marker => marker.setMap(null));
+  markers = [];
+ }
  
  
  function addMarkers(map, items) {
@@ -125,7 +106,7 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
       map: map,
       title: item.name,
       icon: {
-        url: item.photo ? item.photo.images.small.url : 'https://maps.google.com/mapfiles/ms/icons/restaurant.png',
+        url: item.photo || 'https://maps.google.com/mapfiles/ms/icons/restaurant.png',
         scaledSize: new google.maps.Size(50, 50)
       }
     });
@@ -135,6 +116,89 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
       window.open(item.web_url, '_blank');
       highlightTableRow(item.web_url);
     });
+    markers.push(marker);
+  });
+ }
+ 
+ 
+ //Dense areas come back from the server as clusters with a count. Clicking a
+ //cluster zooms in on it until the places can be drawn one by one
+ 
+ 
+ async function fetchClusters(category, zoom, bl_latitude, tr_latitude, bl_longitude, tr_longitude) {
+  try {
+    const response = await axios.get(`/places/${category}/clusters`, {
+      params: { zoom, bl_latitude, tr_latitude, bl_longitude, tr_longitude }
+    });
+    return response.data;
+  } catch (error) {
+    console.error(`API Error (${category} clusters):`, error);
+    return { clusters: [], places: [] };
+  }
+ }
+ 
+ 
+ function addClusters(map, clusters) {
+  clusters.forEach(cluster => {
+    const position = { lat: cluster.latitude, lng: cluster.longitude };
+    const marker = new google.maps.Marker({
+      position: position,
+      map: map,
+      label: { text: String(cluster.count), color: 'white', fontSize: '12px' },
+      icon: {
+        path: google.maps.SymbolPath.CIRCLE,
+        scale: 12 + Math.min(Math.log2(cluster.count) * 3, 18),
+        fillColor: '#1a73e8',
+        fillOpacity: 0.85,
+        strokeColor: 'white',
+        strokeWeight: 2
+      }
+    });
+    marker.addListener('click', () => {
+      map.setCenter(position);
+      map.setZoom(map.getZoom() + 2);
+    });
+    markers.push(marker);
+  });
+ }
+ 
+ 
+ //Suggestions for the itinerary location field come from the server's offline
+ //gazetteer. Picking one fills in its coordinates; typing anything else leaves
+ //them empty and the server geocodes the text itself
+ 
+ 
+ function attachLocationSuggestions(input) {
+  const list = document.getElementById(input.getAttribute('list'));
+  let suggestions = [];
+  let timer = null;
+  input.addEventListener('input', () => {
+    const picked = suggestions.find(place => place.name === input.value);
+    if (picked) {
+      input.form.latitude.value = picked.latitude;
+      input.form.longitude.value = picked.longitude;
+      return;
+    }
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const q = input.value.trim();
+      if (!q) {
+        return;
+      }
+      try {
+        const response = await axios.get('/gazetteer/autocomplete', { params: { q } });
+        suggestions = response.data.data;
+      } catch (error) {
+        //503 until a gazetteer has been built
+        suggestions = [];
+      }
+      list.innerHTML = '';
+      suggestions.forEach(place => {
+        const option = document.createElement('option');
+        option.value = place.name;
+        list.appendChild(option);
+      });
+    }, 150);
   });
  }
  
@@ -177,12 +241,54 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
   autocomplete.bindTo('bounds', map);
  
  
+  let places = [];
+ 
+ 
+  const showSelectedPlaces = () => {
+    const category = selectedCategory();
+    const selected = places.filter(place => place.categories.includes(category));
+    displayPlaces(selected, category);
+    refreshMarkers();
+  };
+ 
+ 
+  //Markers follow the viewport: redrawn whenever the map settles after a pan
+  //or zoom, once a destination has been picked
+  let destinationPicked = false;
+  let drawn = 0;
+  const selectedCategory = () => {
+    const showAttractions = document.getElementById('toggleAttractions').checked;
+    const showHotels = document.getElementById('toggleHotels').checked;
+    return showAttractions ? 'attractions' : showHotels ? 'hotels' : 'restaurants';
+  };
+  const refreshMarkers = () => {
+    const bounds = map.getBounds();
+    if (!destinationPicked || !bounds) {
+      return;
+    }
+    const bl = bounds.getSouthWest();
+    const tr = bounds.getNorthEast();
+    const draw = ++drawn;
+    fetchClusters(selectedCategory(), map.getZoom(), bl.lat(), tr.lat(), bl.lng(), tr.lng()).then(result => {
+      //A newer pan already asked for other markers
+      if (draw !== drawn) {
+        return;
+      }
+      clearMarkers();
+      addClusters(map, result.clusters);
+      addMarkers(map, result.places);
+    });
+  };
+  map.addListener('idle', refreshMarkers);
+ 
+ 
   autocomplete.addListener('place_changed', () => {
     const place = autocomplete.getPlace();
     if (!place.geometry) {
       console.log(`No details available for input: '${place.name}'`);
       return;
     }
+    destinationPicked = true;
     map.fitBounds(place.geometry.viewport || place.geometry.location);
     map.setZoom(12);
  
@@ -195,34 +301,34 @@ async function fetchRestaurants(bl_latitude, tr_latitude, bl_longitude, tr_longi
     console.log("Map Bounds:", { bl_latitude: bl.lat(), bl_longitude: bl.lng(), tr_latitude: tr.lat(), tr_longitude: tr.lng() });
  
  
-    const showAttractions = document.getElementById('toggleAttractions').checked;
-    const showHotels = document.getElementById('toggleHotels').checked;
- 
- 
-    const fetchAndDisplay = (fetchFn, displayFn) => {
-      fetchFn(bl.lat(), tr.lat(), bl.lng(), tr.lng()).then(places => {
-        displayFn(places);
-        addMarkers(map, places);
+    const loadPlaces = (retries) => {
+      fetchAllPlaces(bl.lat(), tr.lat(), bl.lng(), tr.lng()).then(result => {
+        places = result.data;
+        showSelectedPlaces();
+        //Slow categories keep loading on the server, ask again shortly
+        if (result.missing.length && retries > 0) {
+          setTimeout(() => loadPlaces(retries - 1), 2000);
+        }
       });
     };
- 
- 
-    if (showAttractions) {
-      fetchAndDisplay(fetchAttractions, displayAttractions);
-    } else if (showHotels) {
-      fetchAndDisplay(fetchHotels, displayHotels);
-    } else {
-      fetchAndDisplay(fetchRestaurants, displayRestaurants);
-    }
+    loadPlaces(2);
   });
  
  
-  document.getElementById('toggleAttractions').addEventListener('change', () => google.maps.event.trigger(input, 'place_changed'));
-  document.getElementById('toggleHotels').addEventListener('change', () => google.maps.event.trigger(input, 'place_changed'));
+  //Toggling a category filters the table locally and redraws the markers from
+  //the server's cached tiles
+  document.getElementById('toggleAttractions').addEventListener('change', showSelectedPlaces);
+  document.getElementById('toggleHotels').addEventListener('change', showSelectedPlaces);
  }
  
  
  window.addEventListener('load', initMap);
+ window.addEventListener('load', () => {
+  const input = document.querySelector('input[name="location"][list]');
+  if (input) {
+    attachLocationSuggestions(input);
+  }
+ });
  
  
  function copyInviteCode() {